@@ -13,7 +13,11 @@ import pandas as pd
 import numpy as np
 
 import databases_utils as db
+from rgbd.DepthStorage import ChunkedDepthFormat, read_depth_dataframe
+from rgbd.TrialMetadata import metadata_path, read_metadata, read_timestamps
+from rgbd.DepthPostProcessing import DepthPostProcessing
 import ExperimentRecorder as erc
+from TrialPersistence import PersistenceExecutor
 # import ExperimentPreProcessor as epp
 # import ExperimentReplayer as erp
 # import ExperimentAnalyser as ea
@@ -237,6 +241,18 @@ class Session:
         self.experiment_pre_processor = None
         self.experiment_replayer = None
         self.experiment_analyser = None
+        # trials recorded during the session are saved in the background by a single executor
+        self.persistence = None
+    
+    def get_persistence(self):
+        if self.persistence is None:
+            # optional 'save_memory_budget_mb' row in the recording parameters
+            memory_budget_mb = 2048.
+            recording_parameters = getattr(self, 'recording_parameters', None)
+            if recording_parameters is not None and 'save_memory_budget_mb' in recording_parameters:
+                memory_budget_mb = float(recording_parameters['save_memory_budget_mb'][0])
+            self.persistence = PersistenceExecutor(memory_budget_mb=memory_budget_mb)
+        return self.persistence
     
     def build_progress_display(self):
         name = "Processing..."
@@ -525,14 +541,57 @@ class Session:
         self.save_processing_monitoring()
         self.experiment_pre_processor.stop()
         
-    def replay_selected_participants(self):    
+    def detect_hands_selected_participants(self, workers = None, sequence = 'movement'):
+        """
+        Detects the hands in the videos of the trials of the selected participants with a pool of worker processes, for all devices.
+        Their landmarks are cached, so that replaying the trials only reads their depths.
+        The progress window is kept responsive while the workers run, and its Interrupt button cancels the trials not started yet.
+        """
+        from HandDetectionBatch import HandDetectionBatch
+        for device_id, device_data in self.devices_data.items():
+            jobs = []
+            for participant in self.participants_to_process:
+                for trial in participant.replayable_trials:
+                    if not os.path.exists(trial.pre_processing_path):
+                        continue
+                    try:
+                        depth_path, video_path = trial.get_replay_files(device_id, sequence)
+                    except IndexError:
+                        continue
+                    jobs.append((f'{participant.pseudo} {trial.label}', video_path, depth_path))
+            print(f"Detecting hands of {len(jobs)} trials for device {device_id}")
+            self.devices_progress_display.set_current(f"Detecting hands for device {device_id}")
+            self.progress_window.update()
+            HandDetectionBatch(device_data, workers = workers).run(jobs, poll = self.poll_progress_window)
+            if self.continue_processing == False:
+                break
+
+    def poll_progress_window(self):
+        self.progress_window.update()
+        return self.continue_processing
+
+    def replay_selected_participants(self, detect_hands_beforehand = False, workers = None, hand_detection_cache = True):
+        """
+        Replays the trials of the selected participants, for all devices.
+
+        Args:
+            detect_hands_beforehand (bool, optional): Detect the hands in all the trials first, in parallel processes on CPU, so that
+                the replay only reads the cached landmarks. Defaults to False.
+            workers (int, optional): Number of processes detecting the hands beforehand. Defaults to None (number of CPUs).
+            hand_detection_cache (bool, optional): Read and save the hand landmarks in the hand detection cache. Defaults to True.
+        """
         self.fetch_participants_to_process()
         self.build_progress_display()
+        # landmarks detected beforehand are only read back from the cache
+        if detect_hands_beforehand and hand_detection_cache:
+            self.detect_hands_selected_participants(workers = workers)
         
         for device_id, device_data in self.devices_data.items():
+            if self.continue_processing == False:
+                break
             print(f"Building experiment replayer for device {device_id} with device_data: resolution {device_data['resolution']}, matrix {device_data['matrix']}")
             self.current_device_id = device_id
-            self.experiment_replayer = erp.ExperimentReplayer(device_id, device_data)
+            self.experiment_replayer = erp.ExperimentReplayer(device_id, device_data, hand_detection_cache = hand_detection_cache)
             self.devices_progress_display.set_current(f"Processing device {device_id}")
             self.progress_window.update_idletasks()
             print("updating progress window")
@@ -694,7 +753,7 @@ class Session:
                 pseudo = pseudo_in_db 
                 print(f"Participant {participant_firstname} {participant_surname} selected to complete its trials")
         print(f'Session database counts now {len(self.participants_database)} participants')
-        self.current_participant = Participant(pseudo, self.path, self.experimental_parameters, self.recording_parameters, mode=self.mode, language=language)
+        self.current_participant = Participant(pseudo, self.path, self.experimental_parameters, self.recording_parameters, mode=self.mode, language=language, persistence=self.get_persistence())
         self.current_participant.set_instructions(self.instructions_languages)
         return pseudo
     
@@ -764,10 +823,13 @@ class Session:
         
         if self.current_participant is not None:
             self.current_participant.close()
+        if self.persistence is not None:
+            self.persistence.shutdown()
             
 class Participant:
-    def __init__(self, pseudo, session_path, session_experimental_parameters=None, recording_parameters=None, mode = 'Recording', language='English') -> None:
+    def __init__(self, pseudo, session_path, session_experimental_parameters=None, recording_parameters=None, mode = 'Recording', language='English', persistence=None) -> None:
         self.pseudo = pseudo
+        self.persistence = persistence
         self.experimental_parameters = session_experimental_parameters
         self.recording_parameters = recording_parameters
         self.combinations_data = []
@@ -927,18 +989,25 @@ class Participant:
             print(f"combinations data: \n{self.combinations_data}")
             print(f"Combinations read from '{self.combinations_path}'")
         
-    def build_recorders(self, devices_ids, resolution, fps):
+    def build_recorders(self, devices_ids, resolution, fps, rgb_encoding=None, depth_postprocessing=None):
         print('LESSGOOOOOOO')
+        # the devices are booted concurrently, with their calibrations read from the cache
+        from rgbd.DeviceManager import DeviceManager
+        cameras = DeviceManager().open_cameras(devices_ids, resolution = resolution, fps_rgb = fps, show_rgb = False, show_depth = False, rgb_encoding = rgb_encoding, depth_postprocessing = depth_postprocessing)
         for device_id in devices_ids:
-            expe_recorder = erc.ExperimentRecorder(self.path, device_id = device_id, resolution = resolution, fps = fps)
+            expe_recorder = erc.ExperimentRecorder(self.path, device_id = device_id, resolution = resolution, fps = fps, rgb_encoding = rgb_encoding, persistence = self.persistence, camera = cameras[device_id])
             self.expe_recorders.append(expe_recorder)
     
     def initiate_experiment(self):
         devices_ids = self.recording_parameters['devices_ids']
         self.resolution = self.recording_parameters['resolution']
         fps = self.recording_parameters['fps'][0]
+        # optional 'rgb_encoding' row (H264 or H265) to encode the rgb stream on the devices
+        rgb_encoding = (self.recording_parameters.get('rgb_encoding') or [None])[0] or None
+        # optional 'depth_postprocessing' row (raw, light, filtered or decimated) and 'depth_<setting>' rows, see DepthPostProcessing
+        depth_postprocessing = DepthPostProcessing.from_recording_parameters(self.recording_parameters)
         self.build_UIs()
-        self.build_recorders(devices_ids, self.resolution, fps)   
+        self.build_recorders(devices_ids, self.resolution, fps, rgb_encoding, depth_postprocessing)   
         self.save_experimental_parameters()
         self.save_recording_parameters()   
         
@@ -987,8 +1056,14 @@ class Participant:
             self.display_next_trial()
     
     def start_next_trial(self):
-        self.trial_ongoing = True
         self.start_next_trial_button.state(['disabled'])
+        # the previous trials must be saved first if they hold too much memory, the UI is kept alive meanwhile
+        if self.persistence is not None and not self.persistence.has_capacity():
+            print("Waiting for previous trials to be saved before starting a new one")
+            while not self.persistence.wait_for_capacity(timeout=0.1):
+                self.update_saving_status()
+                self.experimentator_window.update()
+        self.trial_ongoing = True
         self.stop_current_trial_button.state(['!disabled'])
         self.instructions_text_widget.insert(tk.END, " \n \n \n \nRecording", "recording")
         for rec in self.expe_recorders:
@@ -1006,7 +1081,17 @@ class Participant:
             self.display_next_trial_button.state(['!disabled'])
             self.display_next_trial()
         self.stop_current_trial_button.state(['disabled'])
+        self.update_saving_status()
         print(f"Stopped {self.current_trial.label}")
+    
+    def update_saving_status(self):
+        if self.persistence is not None:
+            self.saving_status.set(self.persistence.get_status())
+    
+    def monitor_saving_status(self):
+        self.update_saving_status()
+        if self.experimentator_window is not None and self.experimentator_window.winfo_exists():
+            self.experimentator_window.after(500, self.monitor_saving_status)
         
     def display_task(self):
         rotate = True
@@ -1097,6 +1182,11 @@ class Participant:
         self.stop_current_trial_button.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         self.stop_button = ttk.Button(frame, text="Stop experiment", command=self.stop_experiment, style = 'danger.TButton')
         self.stop_button.pack(fill=tk.BOTH, expand=True, pady=30)
+        self.saving_status = tk.StringVar()
+        self.saving_status.set("All trials saved")
+        self.saving_status_label = ttk.Label(frame, textvariable=self.saving_status, font=("Helvetica", 15), justify='center')
+        self.saving_status_label.pack(fill=tk.BOTH, expand=True)
+        self.monitor_saving_status()
         self.display_next_trial_button.state(['disabled'])
         self.start_next_trial_button.state(['disabled'])
         self.stop_current_trial_button.state(['disabled'])
@@ -1828,10 +1918,11 @@ class Trial:
             print('Trial {} not pre-processed'.format(self.label))
             return pre_processed
         pre_processed = True
-        file_suffixes =  ['depth_map_movement.gzip', 
+        # depth maps are saved in chunked depth files, or in gzip-pickled dataframes for older pre-processings
+        file_suffixes =  [('depth_map_movement' + ChunkedDepthFormat.EXTENSION, 'depth_map_movement.gzip'), 
                           'timestamps_movement.gzip', 
                           'video_movement.avi',
-                          'depth_map_contact.gzip', 
+                          ('depth_map_contact' + ChunkedDepthFormat.EXTENSION, 'depth_map_contact.gzip'), 
                           'timestamps_contact.gzip',
                           'video_contact.avi'
                         #   'depth_map_return.gzip',
@@ -1841,6 +1932,17 @@ class Trial:
                         #   'timestamps_stand.gzip',
                         #   'video_stand.avi'
                           ]
+        
+        # the timestamps of the sequences are saved in the pre-processed trial metadata, or in a file per sequence for older pre-processings
+        pre_processed_metadata = metadata_path(self.pre_processing_path, self.label)
+        if os.path.exists(pre_processed_metadata):
+            file_suffixes = [suffix for suffix in file_suffixes if not (isinstance(suffix, str) and suffix.startswith('timestamps'))]
+            sequences = read_metadata(pre_processed_metadata, device_ID, columns=['device_id', 'sequence'], filters=[('sequence', 'in', ['movement', 'contact'])])
+            nb_devices = (sequences.groupby('device_id')['sequence'].nunique() == 2).sum()
+            if nb_devices < (1 if device_ID is not None else 2):
+                pre_processed = False
+                print(f"Trial '{self.label}' not pre-processed: missing movement or contact sequence in {pre_processed_metadata}")
+                file_suffixes = []
 
         for suffix in file_suffixes:
             #count number of files with suffix in the trial folder
@@ -1942,6 +2044,20 @@ class Trial:
         self.combi_ok, self.face_ok, duration = experiment_pre_processor.process_trial(self.path, self.combination, self.pre_processing_path)
         return self.combi_ok, self.face_ok, duration
     
+    def get_replay_files(self, device_id, sequence = 'movement'):
+        """
+        Returns:
+            Tuple[str, str]: The paths of the pre-processed depth file and video of a device, for a sequence of the trial.
+        """
+        #get the depth file with device_id in the name, chunked depth files first
+        depth_file_list = [f for f in os.listdir(self.pre_processing_path) if device_id in f and f.endswith((ChunkedDepthFormat.EXTENSION, ".gzip")) and 'depth_map' in f and sequence in f]
+        depth_file_list.sort(key=lambda f: not f.endswith(ChunkedDepthFormat.EXTENSION))
+        # print('depth_file_list', depth_file_list)
+        depth_file = depth_file_list[0]
+        #get the video file with device_id in the name
+        video = [f for f in os.listdir(self.pre_processing_path) if device_id in f and f.endswith(".avi") and sequence in f][0]
+        return os.path.join(self.pre_processing_path, depth_file), os.path.join(self.pre_processing_path, video)
+
     def replay(self, experiment_replayer, sequence = 'movement'):
         if not self.was_pre_processed():
             print(f'Trial {self.label} not pre-processed. This trial cannot be replayed and will be skipped.')
@@ -1952,17 +2068,12 @@ class Trial:
         device_id = experiment_replayer.get_device_id()
         # print('device_id', device_id)
         # print('folder', self.pre_processing_path)
-        #get the .gzip file with device_id in the name
-        depth_file_list = [f for f in os.listdir(self.pre_processing_path) if device_id in f and f.endswith(".gzip") and 'depth_map' in f and sequence in f]
-        # print('depth_file_list', depth_file_list)
-        depth_file = depth_file_list[0]
-        #extract data from the first file into a dataframe
-        timestamps_and_depth = pd.read_pickle(os.path.join(self.pre_processing_path, depth_file), compression='gzip')
-        #get the video file with device_id in the name
-        video = [f for f in os.listdir(self.pre_processing_path) if device_id in f and f.endswith(".avi") and sequence in f][0]
+        depth_path, video_path = self.get_replay_files(device_id, sequence)
+        #extract data from the depth file into a dataframe
+        timestamps_and_depth = read_depth_dataframe(depth_path)
         #merge the two dataframes into a single dataframe
         replay = timestamps_and_depth.to_dict(orient='list')
-        replay['Video'] = os.path.join(self.pre_processing_path, video)
+        replay['Video'] = video_path
         
         #get the current pandas timestamp
         now = pd.Timestamp.now()
@@ -1985,7 +2096,11 @@ class Trial:
         self.duration = last_timestamp - first_timestamp
         self.meta_data = {'Trial_duration': [self.duration], 'Trial_data_extration_duration': [replay_duration]}
         
-        timestamps_only = pd.read_pickle(os.path.join(self.pre_processing_path, f"{self.label}_cam_{device_id}_timestamps_{sequence}.gzip"), compression='gzip')
+        pre_processed_metadata = metadata_path(self.pre_processing_path, self.label)
+        if os.path.exists(pre_processed_metadata):
+            timestamps_only = read_timestamps(pre_processed_metadata, device_id, sequence=sequence)[['Timestamps']]
+        else:
+            timestamps_only = pd.read_pickle(os.path.join(self.pre_processing_path, f"{self.label}_cam_{device_id}_timestamps_{sequence}.gzip"), compression='gzip')
         self.main_data = timestamps_only
         
         # merge the hands_data into the main_data
@@ -7,6 +7,10 @@ from tkinter import ttk
 import os
 import pandas as pd
 import threading
+from rgbd.DepthStorage import ChunkedDepthFormat, read_depth_dataframe, write_depth_file
+from rgbd.TrialMetadata import metadata_path, read_metadata, read_recording_info, read_timestamps, written_metadata, write_metadata
+from rgbd.VideoReaders import IndexedVideoReader
+from rgbd.EncodedRecording import remux_leftover_bitstreams
 
 #TODO : MODIFY THIS FILE ACCORDING TO YOUR NEEDS
 
@@ -126,8 +130,8 @@ class ExperimentPreProcessor:
         Calculates and updates the duration of different segments.
     skip_trial():
         Skips the current trial.
-    pre_process(replays, name=None):
-        Pre-processes the videos by setting up the GUI and loading data.
+    pre_process(name=None):
+        Pre-processes the videos of the trial (video_paths) by setting up the GUI and loading data.
     cut_and_save():
         Starts a thread to cut and save the trial.
     cut_and_save_task():
@@ -342,25 +346,36 @@ class ExperimentPreProcessor:
             combi_txt += f'\n {combination.values[i]}'
         self.combination_label.configure(text=combi_txt)
         
-        # List '.avi' files in the folder
-        self.video_files = [f for f in os.listdir(folder_path) if f.endswith('.avi')]
+        # List video files in the folder, '.avi' when encoded on the host, '.mp4' when encoded on the device.
+        # Bitstreams left without container by the recorder are remuxed, or read as raw bitstreams if they cannot be
+        leftover_bitstreams = remux_leftover_bitstreams(folder_path)
+        self.video_files = [f for f in os.listdir(folder_path) if f.endswith(('_video.avi', '_video.mp4'))]
+        self.video_files += [os.path.basename(path) for path in leftover_bitstreams]
         print(f"video_files : {self.video_files}")
-        recording_paths = [os.path.join(folder_path, video_file).split('_video.avi')[0] for video_file in self.video_files]
+        recording_paths = [os.path.join(folder_path, video_file).rsplit('_video.', 1)[0] for video_file in self.video_files]
         
         # Set paths for video, depth map, and timestamps
-        self.video_paths = [path + '_video.avi' for path in recording_paths]
-        self.depthmap_paths = [path + '_depth_map.gzip' for path in recording_paths]
+        self.video_paths = [os.path.join(folder_path, video_file) for video_file in self.video_files]
+        # depth maps are saved in chunked depth files, older recordings used gzip-pickled dataframes
+        self.depthmap_paths = [path + '_depth_map' + ChunkedDepthFormat.EXTENSION if os.path.exists(path + '_depth_map' + ChunkedDepthFormat.EXTENSION) else path + '_depth_map.gzip' for path in recording_paths]
         self.timestamps_paths = [path + '_timestamps.csv' for path in recording_paths]
+        self.device_ids = [path.rsplit('_cam_', 1)[1] for path in recording_paths]
+        self.trial_label = folder
         
-        # Load timestamps
-        self.timestamps = pd.read_pickle(self.timestamps_paths[0], compression='gzip')
+        # Load timestamps, from the trial metadata or from the timestamps files of older recordings
+        self.metadata_path = metadata_path(folder_path, folder)
+        if os.path.exists(self.metadata_path):
+            self.timestamps = read_timestamps(self.metadata_path, self.device_ids[0])
+        else:
+            self.metadata_path = None
+            self.timestamps = pd.read_pickle(self.timestamps_paths[0], compression='gzip')
         
         print(f"video_paths : {self.video_paths}")
         print(f"depthmap_paths : {self.depthmap_paths}")
         print(f"timestamps_paths : {self.timestamps_paths}")
         
         # Pre-process the trial
-        self.pre_process(recording_paths)
+        self.pre_process()
         return self.bcombination_respected, not self.bface_visible, self.durations
 
     def get_duration(self):
@@ -392,15 +407,15 @@ class ExperimentPreProcessor:
         # Increment the current trial index to skip the trial
         self.current_trial_index += 1
     
-    def pre_process(self, replays, name=None):
-        # Load video files for the given replays
-        self.videos = [cv2.VideoCapture(replay + '_video.avi') for replay in replays]
+    def pre_process(self, name=None):
+        # Load the video files of the trial
+        # frames are read through a seek index, so that the trackbars and the playback do not decode from arbitrary positions
+        self.videos = [IndexedVideoReader(video_path) for video_path in self.video_paths]
         
         # Get frame dimensions and number of frames
-        frame_width = int(self.videos[0].get(3))
-        frame_height = int(self.videos[0].get(4))
+        frame_width, frame_height = self.videos[0].resolution
         print(f"frame_width : {frame_width}, frame_height : {frame_height}")
-        nbf = int(self.videos[0].get(cv2.CAP_PROP_FRAME_COUNT))
+        nbf = len(self.videos[0])
         self.nb_frames = min(nbf, len(self.timestamps))
         
         print(f"nb_frames : {self.nb_frames} (min between video [{nbf}] and timestamps[{len(self.timestamps)}])")
@@ -458,6 +473,9 @@ class ExperimentPreProcessor:
         video_paths = self.video_paths.copy()   
         depthmap_paths = self.depthmap_paths.copy()
         timestamps_paths = self.timestamps_paths.copy()
+        device_ids = self.device_ids.copy()
+        source_metadata_path = self.metadata_path
+        destination_metadata_path = metadata_path(self.destination_folder, self.trial_label)
         
         # Get start, end, and return movement start frame indices
         start = self.start
@@ -472,23 +490,23 @@ class ExperimentPreProcessor:
         nb_frames = self.nb_frames
         
         # Generate destination paths for saving the segments
-        destination_paths = [os.path.join(self.destination_folder, video_file).split('_video.avi')[0] for video_file in self.video_files]
+        destination_paths = [os.path.join(self.destination_folder, video_file).rsplit('_video.', 1)[0] for video_file in self.video_files]
         
         # Define paths for different segments
         stand_video_paths = [path + '_video_stand.avi' for path in destination_paths]
-        stand_depthmap_paths = [path + '_depth_map_stand.gzip' for path in destination_paths]
+        stand_depthmap_paths = [path + '_depth_map_stand' + ChunkedDepthFormat.EXTENSION for path in destination_paths]
         stand_timestamps_paths = [path + '_timestamps_stand.gzip' for path in destination_paths]
         
         mov_video_paths = [path + '_video_movement.avi' for path in destination_paths]
-        mov_depthmap_paths = [path + '_depth_map_movement.gzip' for path in destination_paths]
+        mov_depthmap_paths = [path + '_depth_map_movement' + ChunkedDepthFormat.EXTENSION for path in destination_paths]
         mov_timestamps_paths = [path + '_timestamps_movement.gzip' for path in destination_paths]
         
         contact_video_paths = [path + '_video_contact.avi' for path in destination_paths]
-        contact_depthmap_paths = [path + '_depth_map_contact.gzip' for path in destination_paths]
+        contact_depthmap_paths = [path + '_depth_map_contact' + ChunkedDepthFormat.EXTENSION for path in destination_paths]
         contact_timestamps_paths = [path + '_timestamps_contact.gzip' for path in destination_paths]
         
         ret_video_paths = [path + '_video_return.avi' for path in destination_paths]
-        ret_depthmap_paths = [path + '_depth_map_return.gzip' for path in destination_paths]
+        ret_depthmap_paths = [path + '_depth_map_return' + ChunkedDepthFormat.EXTENSION for path in destination_paths]
         ret_timestamps_paths = [path + '_timestamps_return.gzip' for path in destination_paths]
         
         print("begin video saving")
@@ -526,34 +544,55 @@ class ExperimentPreProcessor:
         
         print("begin depthmap saving")
         for id, d_path in enumerate(depthmap_paths):
-            df = pd.read_pickle(d_path, compression='gzip')
+            df = read_depth_dataframe(d_path)
             
             # Save depth maps for different segments
             if start > 0:
                 df_stand = df[:start]
                 df_stand.loc[:, 'Timestamps'] = df_stand['Timestamps'] - df_stand['Timestamps'].iloc[0]
-                df_stand.to_pickle(stand_depthmap_paths[id], compression='gzip')
+                write_depth_file(stand_depthmap_paths[id], df_stand['Depth_maps'], df_stand['Date'])
             else:
                 df_stand = pd.DataFrame(columns=df.columns)
             
             df_mov = df[start:end]
             df_mov.loc[:, 'Timestamps'] = df_mov['Timestamps'] - df_mov['Timestamps'].iloc[0]
-            df_mov.to_pickle(mov_depthmap_paths[id], compression='gzip')
+            write_depth_file(mov_depthmap_paths[id], df_mov['Depth_maps'], df_mov['Date'])
             
             df_con = df[end:return_mov_start]
             df_con.loc[:, 'Timestamps'] = df_con['Timestamps'] - df_con['Timestamps'].iloc[0]
-            df_con.to_pickle(contact_depthmap_paths[id], compression='gzip')
+            write_depth_file(contact_depthmap_paths[id], df_con['Depth_maps'], df_con['Date'])
             
             if return_mov_start < nb_frames - 1:
                 df_ret = df[return_mov_start:]
                 df_ret.loc[:, 'Timestamps'] = df_ret['Timestamps'] - df_ret['Timestamps'].iloc[0]
-                df_ret.to_pickle(ret_depthmap_paths[id], compression='gzip')
+                write_depth_file(ret_depthmap_paths[id], df_ret['Depth_maps'], df_ret['Date'])
             else:
                 df_ret = pd.DataFrame(columns=df.columns)
             
             print(f'depthmap {id} saved')
         
         print("begin timestamps saving")
+        if source_metadata_path is not None:
+            # the metadata of the frames written is cut into sequences, saved together in the pre-processed trial metadata
+            for device_id in device_ids:
+                written = written_metadata(read_metadata(source_metadata_path, device_id))
+                sequences = {'movement': written[start:end], 'contact': written[end:return_mov_start]}
+                if start > 0:
+                    sequences['stand'] = written[:start]
+                if return_mov_start < nb_frames - 1:
+                    sequences['return'] = written[return_mov_start:]
+                segments = []
+                for sequence, segment in sequences.items():
+                    segment = segment.copy()
+                    segment['sequence'] = sequence
+                    segments.append(segment)
+                write_metadata(destination_metadata_path, pd.concat(segments, ignore_index=True),
+                               recording_info={device_id: read_recording_info(source_metadata_path, device_id)})
+                print(f'metadata {device_id} saved')
+            movement_time = sequences['movement']['rgb_ts'].iloc[-1] - sequences['movement']['rgb_ts'].iloc[0]
+            print("end cut and save")
+            return movement_time
+        
         for id, t_path in enumerate(timestamps_paths):
             df = pd.read_pickle(t_path, compression='gzip')
             
@@ -615,8 +654,7 @@ class ExperimentPreProcessor:
             imgs = []
             # Read and display frames from all videos
             for vid in self.videos:
-                vid.set(cv2.CAP_PROP_POS_FRAMES, float(frame_index))
-                err, img = vid.read()
+                img = vid.get(frame_index)
                 imgs.append(img)
             self.saved_imgs = imgs
             self.to_display(imgs, frame_index)
@@ -695,8 +733,7 @@ class ExperimentPreProcessor:
         imgs = []
         # Read and display frames from all videos at the new start position
         for vid in self.videos:
-            vid.set(cv2.CAP_PROP_POS_FRAMES, float(trackbarValue))
-            err, img = vid.read()
+            img = vid.get(int(float(trackbarValue)))
             imgs.append(img)
         self.to_display(imgs, ind)
         print(f'start_var bef : {self.start_var.get()}')
@@ -737,8 +774,7 @@ class ExperimentPreProcessor:
         imgs = []
         # Read and display frames from all videos at the new end position
         for vid in self.videos:
-            vid.set(cv2.CAP_PROP_POS_FRAMES, float(trackbarValue))
-            err, img = vid.read()
+            img = vid.get(int(float(trackbarValue)))
             imgs.append(img)
         self.to_display(imgs, ind)
         
@@ -773,8 +809,7 @@ class ExperimentPreProcessor:
         imgs = []
         # Read and display frames from all videos at the new return movement start position
         for vid in self.videos:
-            vid.set(cv2.CAP_PROP_POS_FRAMES, float(trackbarValue))
-            err, img = vid.read()
+            img = vid.get(int(float(trackbarValue)))
             imgs.append(img)
         self.to_display(imgs, ind)
         
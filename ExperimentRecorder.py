@@ -2,175 +2,323 @@
 
 import argparse
 import threading
-from rgbd.RgbdCameras2 import SimpleRgbdCam as RgbdCamera
+import queue
+import concurrent.futures
+from rgbd.FrameBuffers import FrameRingBuffer
+from rgbd.DepthStorage import ChunkedDepthWriter, ChunkedDepthFormat
+from rgbd.DepthPostProcessing import DepthPostProcessing
+from rgbd.EncodedRecording import EncodedStreamWriter, BITSTREAM_EXTENSIONS, remux
+from TrialPersistence import PersistenceExecutor
+from TrialJournal import TrialJournal
+from rgbd.TrialMetadata import build_metadata, write_metadata, metadata_path
 import cv2
 import numpy as np
 import time
-import pandas as pd
 import os
+import shutil
+
+
+class TrialRecording:
+    """
+    State of the recording of one trial by one camera: its paths, its frame buffers, its writers and the recorded timestamps.
+    It outlives the recording until the trial is flushed, so that a new trial can start while the previous one is still being saved.
+    """
+    def __init__(self, main_path, name, cam_label, rgb_buffer, depth_buffer, rgb_encoding=None):
+        self.name = name
+        self.rgb_buffer = rgb_buffer
+        self.depth_buffer = depth_buffer
+        self.rgb_buffer.reset()
+        self.depth_buffer.reset()
+        # device and host timestamps of the frames received from the camera, and device timestamps of the frames written
+        self.rgb_captured_dates = []
+        self.rgb_host_dates = []
+        self.depth_captured_dates = []
+        self.depth_host_dates = []
+        self.rgb_timestamps_series = []
+        self.depth_timestamps_series = []
+        self.rgb_keyframes_count = 0
+        # encoded packets are small and cannot be dropped, they are queued without bound
+        self.packet_queue = queue.Queue()
+        # the writers run until the end of the recording, which must be flagged before they start
+        self.recording = True
+        
+        self.path = os.path.join(main_path, name)
+        if rgb_encoding is None:
+            self.path_vid = os.path.join(self.path, f'{name}_cam_{cam_label}_video.avi')
+            self.path_bitstream = None
+        else:
+            self.path_vid = os.path.join(self.path, f'{name}_cam_{cam_label}_video.mp4')
+            self.path_bitstream = os.path.join(self.path, f'{name}_cam_{cam_label}_video{BITSTREAM_EXTENSIONS[rgb_encoding]}')
+        self.path_depth = os.path.join(self.path, f'{name}_cam_{cam_label}_depth_map{ChunkedDepthFormat.EXTENSION}')
+        # timestamps, drop flags and recording info of all the cameras of the trial
+        self.path_metadata = metadata_path(self.path, name)
+        # timestamps of the frames written to disk, to recover the trial if the recording is interrupted
+        self.journal = TrialJournal(os.path.join(self.path, f'{name}_cam_{cam_label}{TrialJournal.SUFFIX}'))
+        self.writer_threads = []
+
+    def nbytes(self):
+        """
+        Returns:
+            int: Memory held by the recording until it is flushed, in bytes.
+        """
+        return self.rgb_buffer.nbytes + self.depth_buffer.nbytes
+
 
 class ExperimentRecorder:
-    def __init__(self, main_path, device_id=None, resolution=(1280, 720), fps=30.0):
+    def __init__(self, main_path, device_id=None, resolution=(1280, 720), fps=30.0, buffer_duration=2., depth_chunk_size=30, depth_profile=ChunkedDepthFormat.BALANCED, overflow_policy=FrameRingBuffer.DROP_NEWEST, rgb_encoding=None, encoder_bitrate_kbps=None, persistence=None, camera_backend='depthai', camera_options=None, telemetry_interval=10., camera=None):
         print(f"Recorder created at {main_path}")
         self.main_path = main_path
         self.cam_label = device_id
         self.device_id = device_id
         self.resolution = resolution
         self.fps = fps
+        # 'H264' or 'H265' to record the bitstream encoded on the device instead of encoding frames on the host
+        self.rgb_encoding = rgb_encoding
+        if self.rgb_encoding is not None and shutil.which('ffmpeg') is None:
+            # the bitstream could not be remuxed into a video readable by the pre-processing
+            raise ValueError(f'rgb_encoding {self.rgb_encoding} requires ffmpeg to remux the recorded bitstreams, ffmpeg was not found')
         
         self.fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        self.rgbd_camera = RgbdCamera( device_id=device_id,
-                                      resolution=resolution,
-                                      fps_rgb=fps,      
-                                      show_rgb=False,
-                                      show_depth=False,)
+        # 'depthai' for an OAK device, 'synthetic' or 'replay' to record without device, 'shared_memory' for a capture process
+        self.camera_backend = camera_backend
+        # a camera already opened, e.g. by a DeviceManager, is used as is
+        if camera is not None:
+            self.rgbd_camera = camera
+        else:
+            self.rgbd_camera = self.build_camera(camera_backend, encoder_bitrate_kbps, camera_options if camera_options is not None else {})
         self.device_data = self.rgbd_camera.get_device_data()
         res = self.device_data['resolution']
         
         self.path_cam_np = os.path.join(self.main_path, f'cam_{self.cam_label}_{res[0]}_{res[1]}_data.npz')
         if not os.path.exists(self.path_cam_np):
             np.savez(self.path_cam_np, **self.device_data)
-            
-        self.reset()
-        print(f'Recorder with {device_id} built.')
-        self.img = None
-    
-    def reset(self):
-        
-        self.rgb_frame_series = []
-        self.depth_map_series = []
-        self.rgb_timestamps_series = []
-        self.depth_timestamps_series = []
         
-        self.last_rgb_timestamp = 0.
-        self.last_depth_timestamp = 0.
+        # frames are copied into preallocated ring buffers, allocated once and reused for the following trials
+        # rgb frames and depth maps are streamed to disk while recording, the overflow policy applies if the writers fall behind
+        self.buffer_capacity = int(buffer_duration*float(fps))
+        self.overflow_policy = overflow_policy
+        self.free_buffers = []
+        self.buffers_lock = threading.Lock()
+        self.depth_chunk_size = depth_chunk_size
+        # compression profile of the depth maps, 'fast', 'balanced' or 'archive'
+        self.depth_profile = depth_profile
+        if self.rgb_encoding is not None:
+            self.rgbd_camera.add_packet_listener(self.on_encoded_packet)
         
-        self.recording = False
+        # trials are flushed by the session executor, a private one is used when the recorder runs alone
+        self.persistence = persistence if persistence is not None else PersistenceExecutor(workers=1)
+        self.owns_persistence = persistence is None
+        self.flush_futures = []
+        self.current_recording = None
+        # snapshots of the telemetry of the camera are appended to a CSV file every telemetry_interval seconds, None to disable
+        self.telemetry_interval = telemetry_interval
+        self.path_telemetry = os.path.join(self.main_path, f'cam_{self.cam_label}_telemetry.csv')
+        print(f'Recorder with {device_id} built.')
+        self.img = None
+
+    def build_camera(self, camera_backend, encoder_bitrate_kbps, camera_options):
+        """
+        Builds the camera of the recorder.
+
+        Args:
+            camera_backend (str): 'depthai' for an OAK device, 'synthetic' for generated frames, 'replay' to replay a recorded trial,
+                'shared_memory' to run the camera in its own capture process (capture_backend option, 'depthai' or 'synthetic').
+            encoder_bitrate_kbps (int): Bitrate of the device encoder, see SimpleRgbdCam.
+            camera_options (Dict): Additional arguments of the camera, e.g. jitter and drop_rate for 'synthetic', trial_path and loop for 'replay'.
+        Returns:
+            The camera.
+        Raises:
+            ValueError: If the backend is unknown.
+        """
+        # depthai is only imported when a device is used
+        if camera_backend == 'depthai':
+            from rgbd.RgbdCameras2 import SimpleRgbdCam
+            return SimpleRgbdCam(device_id=self.device_id,
+                                 resolution=self.resolution,
+                                 fps_rgb=self.fps,
+                                 show_rgb=False,
+                                 show_depth=False,
+                                 rgb_encoding=self.rgb_encoding,
+                                 encoder_bitrate_kbps=encoder_bitrate_kbps,
+                                 **camera_options)
+        elif camera_backend == 'synthetic':
+            from rgbd.SyntheticCameras import SyntheticRgbdCam
+            return SyntheticRgbdCam(device_id=self.device_id, resolution=self.resolution, fps_rgb=self.fps, rgb_encoding=self.rgb_encoding, **camera_options)
+        elif camera_backend == 'replay':
+            from rgbd.SyntheticCameras import TrialReplayCam
+            return TrialReplayCam(device_id=self.device_id, **camera_options)
+        elif camera_backend == 'shared_memory':
+            from rgbd.SharedMemoryCapture import SharedMemoryCamera
+            return SharedMemoryCamera(self.device_id, resolution=self.resolution, fps_rgb=self.fps, rgb_encoding=self.rgb_encoding,
+                                      capacity=max(4, int(self.fps)), **camera_options)
+        raise ValueError(f"Unknown camera backend '{camera_backend}', expected 'depthai', 'synthetic', 'replay' or 'shared_memory'")
+
+    def get_buffers(self):
+        """
+        Returns:
+            Tuple[FrameRingBuffer, FrameRingBuffer]: Free rgb and depth buffers, left by a flushed trial or newly created.
+        """
+        with self.buffers_lock:
+            if len(self.free_buffers) > 0:
+                return self.free_buffers.pop()
+        rgb_buffer = FrameRingBuffer(self.buffer_capacity, dtype=np.uint8, name=f'{self.device_id} rgb', overflow=self.overflow_policy)
+        depth_buffer = FrameRingBuffer(self.buffer_capacity, dtype=np.uint16, name=f'{self.device_id} depth', overflow=self.overflow_policy)
+        return rgb_buffer, depth_buffer
+
+    def release_buffers(self, recording):
+        with self.buffers_lock:
+            self.free_buffers.append((recording.rgb_buffer, recording.depth_buffer))
 
     def init(self):
         self.rgbd_camera.start()
+        if self.telemetry_interval is not None:
+            self.rgbd_camera.telemetry.start_export(self.path_telemetry, self.telemetry_interval)
         self.capture_thread = threading.Thread(target=self.capture_task)
-        self.record_thread = None
-        self.current_path = None
         self.current_recording = None
         self.capture_thread.start()
-        self.saving_threads=[]
         print(f'Recorder with {self.device_id} started.')
 
     def capture_task(self):
-        self.new_rec = False
-        self.end_rec = False
+        rgb_seq, depth_seq = 0, 0
         
         while self.rgbd_camera.is_on():
-            # in case we want to start a new recording
-            if self.new_rec:
-                self.new_rec = False
-                self.recording = True
-                
-            success, img, map, rgb_timestamp, depth_timestamp = self.rgbd_camera.get_last_frames()
-            
-            if not success:
-                continue
-            self.img = img  
-            if self.recording:
-                is_new_rgb_frame = rgb_timestamp != self.last_rgb_timestamp
-                if is_new_rgb_frame:
+            # sleeps until the camera notifies a new frame on either stream
+            # the frames are retained until they are copied in the ring buffers, so that the camera does not reuse them meanwhile
+            success, rgb_ref, depth_ref, rgb_timestamp, depth_timestamp, new_rgb_seq, new_depth_seq = self.rgbd_camera.wait_for_next(rgb_seq, depth_seq, timeout=0.1, retain=True)
+            img = rgb_ref.array if rgb_ref is not None else None
+            map = depth_ref.array if depth_ref is not None else None
+            is_new_rgb_frame = new_rgb_seq != rgb_seq
+            is_new_depth_frame = new_depth_seq != depth_seq
+            rgb_seq, depth_seq = new_rgb_seq, new_depth_seq
+
+            if success:
+                self.img = img  
+            recording = self.current_recording
+            if success and recording is not None and recording.recording:
+                # with device encoding, rgb frames are previews and the video is recorded from the encoded packets
+                if is_new_rgb_frame and self.rgb_encoding is None:
                     if img is not None and img.size > 0:
-                        self.rgb_frame_series.append(img)
-                        self.rgb_timestamps_series.append(rgb_timestamp)
-                        self.last_rgb_timestamp = rgb_timestamp
+                        recording.rgb_captured_dates.append(rgb_timestamp)
+                        recording.rgb_host_dates.append(time.time())
+                        recording.rgb_buffer.put(img, rgb_timestamp)
                     else:
                         print('Captured empty RGB frame')
                 
-                is_new_depth_frame = depth_timestamp != self.last_depth_timestamp
                 if is_new_depth_frame:
                     if map is not None and map.size > 0:
-                        self.depth_map_series.append(map)
-                        self.depth_timestamps_series.append(depth_timestamp)
-                        self.last_depth_timestamp = depth_timestamp
+                        recording.depth_captured_dates.append(depth_timestamp)
+                        recording.depth_host_dates.append(time.time())
+                        recording.depth_buffer.put(map, depth_timestamp)
                     else:
                         print('Captured empty Depth frame')
-                
-                if not is_new_rgb_frame and not is_new_depth_frame:
-                    time.sleep(0.001)
-                
-                if self.end_rec:
-                    self.end_rec = False
-                    self.recording = False
-    
-    def save_data_task(self):
-        if self.current_path is None:
-            print("No recording to save")
-            return
-        
-        path = self.current_path
+                telemetry = self.rgbd_camera.telemetry
+                telemetry.set_gauge('rgb_buffer_depth', len(recording.rgb_buffer))
+                telemetry.set_gauge('depth_buffer_depth', len(recording.depth_buffer))
+            for ref in [rgb_ref, depth_ref]:
+                if ref is not None:
+                    ref.release()
+
+    def save_data_task(self, recording):
+        path = recording.path
         print(f"Start saving {path}")
-        path_depth_gzip = self.path_depth_gzip
-        path_depth_timestamps_gzip = self.path_depth_timestamps_gzip
-        path_depth_timestamps_csv = self.path_depth_timestamps_csv
-        path_rgb_timestamps_gzip = self.path_rgb_timestamps_gzip
-        path_rgb_timestamps_csv = self.path_rgb_timestamps_csv
-        path_vid = self.path_vid
-        rgb_frame_series = self.rgb_frame_series
-        rgb_timestamps_series = self.rgb_timestamps_series
-        depth_map_series = self.depth_map_series
-        depth_time_series = self.depth_timestamps_series        
-        
-        self.ready_to_start_new_rec = True
-        
-        # # Save video as avi
-        # print(f"Saving video at {path_vid}")
-        # recorder = cv2.VideoWriter(path_vid, self.fourcc, self.fps, self.device_data['resolution'])
-        # print(f'length of rgb_frame_series: {len(rgb_frame_series)}')
-        # for frame in rgb_frame_series:
-        #     recorder.write(frame)
-        #     print(f'writing frame : {frame}')
-        # recorder.release()
-        # print(f"Finished saving video at {path_vid}")
+        # the writers must be done before the timestamps and buffers stats are saved
+        for thread in recording.writer_threads:
+            thread.join()
+        rgb_timestamps_series = recording.rgb_timestamps_series
+        depth_time_series = recording.depth_timestamps_series
         
+        rgb_buffer_stats = recording.rgb_buffer.get_stats()
+        depth_buffer_stats = recording.depth_buffer.get_stats()
+        self.release_buffers(recording)
+        if rgb_buffer_stats['dropped'] > 0 or depth_buffer_stats['dropped'] > 0:
+            print(f"WARNING: {rgb_buffer_stats['dropped']} rgb frames and {depth_buffer_stats['dropped']} depth maps were dropped because the writers fell behind")
         
-        # Save rgb timestamps as gzip and csv
-        print(f"Saving rgb timestamps at {path_rgb_timestamps_gzip}")
-        zero_start_rgb_timestamps = [t - rgb_timestamps_series[0] for t in rgb_timestamps_series]
-        rgb_timestamps_df = pd.DataFrame({'Timestamps': zero_start_rgb_timestamps})
-        rgb_timestamps_df.to_pickle(path_rgb_timestamps_gzip, compression='gzip')
-        rgb_timestamps_df.to_csv(path_rgb_timestamps_csv, index=False)
-        print(f"Finished saving rgb timestamps at {path_rgb_timestamps_gzip}")
+        # The recording info is saved with the metadata of the trial
+        recording_info = {'device_id': self.device_id, 'fps': self.fps, 'resolution': self.device_data['resolution'], 'depth_profile': self.depth_profile}
+        if self.rgb_encoding is not None:
+            recording_info['rgb_encoding'] = self.rgb_encoding
+            recording_info['rgb_keyframes'] = recording.rgb_keyframes_count
+        # the post-processing of the depth maps on the device, if any
+        if self.rgbd_camera.depth_postprocessing is not None:
+            recording_info.update(DepthPostProcessing.to_recording_info(self.rgbd_camera.depth_postprocessing))
+        for key, value in rgb_buffer_stats.items():
+            recording_info[f'rgb_buffer_{key}'] = value
+        for key, value in depth_buffer_stats.items():
+            recording_info[f'depth_buffer_{key}'] = value
         
-        # Save depth maps as gzip
-        print(f"Saving depth map at {path_depth_gzip}")
-        depth_df = pd.DataFrame({'Depth_maps': depth_map_series, 'Date': depth_time_series})
-        depth_df['Timestamps'] = depth_df['Date'] - depth_df['Date'][0]
-        depth_df.to_pickle(path_depth_gzip, compression='gzip')        
-        print(f"Finished saving depth map at {path_depth_gzip}")
+        # Save the timestamps and drop flags of the frames in the trial metadata, depth maps were already saved while recording
+        print(f"Saving metadata at {recording.path_metadata}")
+        metadata = build_metadata(self.device_id, recording.rgb_captured_dates, recording.rgb_host_dates, rgb_timestamps_series,
+                                  recording.depth_captured_dates, recording.depth_host_dates, depth_time_series)
+        write_metadata(recording.path_metadata, metadata, recording_info={self.device_id: recording_info})
+        print(f"Finished saving metadata at {recording.path_metadata}")
         
-        # Save depth timestamps as gzip and csv
-        print(f"Saving depth timestamps at {path_depth_timestamps_gzip}")
-        depth_timestamps_df = pd.DataFrame({'Timestamps': depth_df['Timestamps']})
-        depth_timestamps_df.to_pickle(path_depth_timestamps_gzip, compression='gzip')
-        depth_timestamps_df.to_csv(path_depth_timestamps_csv, index=False)
-        print(f"Finished saving depth timestamps at {path_depth_timestamps_gzip}")
+        # The encoded bitstream is copied into a container, the raw bitstream is kept if it fails, and remuxed again by the pre-processor.
+        # The container has a constant frame rate, the timestamps of the frames are those of the metadata and of the packets file
+        if recording.path_bitstream is not None and remux(recording.path_bitstream, recording.path_vid, self.fps):
+            os.remove(recording.path_bitstream)
+        recording.journal.close(complete=True)
         print(f"Finished saving all files at {path}")
 
 
-    def write_rgb_frames(self):
-        video_writer = cv2.VideoWriter(self.path_vid, self.fourcc, self.fps, self.device_data['resolution'])
+    def write_rgb_frames(self, recording):
+        video_writer = cv2.VideoWriter(recording.path_vid, self.fourcc, self.fps, self.device_data['resolution'])
         write = True
         frame_count = 0
+        frame = None
         while write:
-            if len(self.rgb_frame_series) > 0:
-                frame = self.rgb_frame_series.pop(0)
-                if frame is not None and frame.size > 0:
-                    video_writer.write(frame)
-                    frame_count += 1
-                else:
-                    print('Empty frame encountered')
-            else:
-                time.sleep(0.001)
-            if len(self.rgb_frame_series) == 0 and not self.recording:
+            new_frame, timestamp = recording.rgb_buffer.get(timeout=0.01, out=frame)
+            if new_frame is not None:
+                frame = new_frame
+                video_writer.write(frame)
+                recording.journal.log(TrialJournal.RGB, timestamp)
+                recording.rgb_timestamps_series.append(timestamp)
+                frame_count += 1
+            elif not recording.recording:
                 write = False
         video_writer.release()
-        print(f"Video saved with {frame_count} frames of shape {frame.shape} at {self.path_vid}")
+        if frame is not None:
+            print(f"Video saved with {frame_count} frames of shape {frame.shape} at {recording.path_vid}")
+        else:
+            print(f"Video saved with no frame at {recording.path_vid}")
+
+    def on_encoded_packet(self, packet, timestamp):
+        recording = self.current_recording
+        if recording is not None and recording.recording:
+            recording.rgb_captured_dates.append(timestamp)
+            recording.rgb_host_dates.append(time.time())
+            recording.packet_queue.put((packet, timestamp))
+
+    def write_encoded_packets(self, recording):
+        stream_writer = EncodedStreamWriter(recording.path_bitstream)
+        write = True
+        while write:
+            try:
+                packet, timestamp = recording.packet_queue.get(timeout=0.01)
+            except queue.Empty:
+                if not recording.recording:
+                    write = False
+                continue
+            stream_writer.write(packet, timestamp)
+            recording.journal.log(TrialJournal.RGB, timestamp)
+            recording.rgb_timestamps_series.append(timestamp)
+        stream_writer.close()
+        recording.rgb_keyframes_count = sum(stream_writer.keyframes)
+
+    def write_depth_maps(self, recording):
+        depth_writer = ChunkedDepthWriter(recording.path_depth, chunk_size=self.depth_chunk_size, profile=self.depth_profile)
+        write = True
+        depth_map = None
+        while write:
+            new_depth_map, timestamp = recording.depth_buffer.get(timeout=0.01, out=depth_map)
+            if new_depth_map is not None:
+                depth_map = new_depth_map
+                depth_writer.write(depth_map, timestamp)
+                recording.journal.log(TrialJournal.DEPTH, timestamp)
+                recording.depth_timestamps_series.append(timestamp)
+            elif not recording.recording:
+                write = False
+        depth_writer.close()
 
     # def new_record(self, name):
         
@@ -196,33 +344,29 @@ class ExperimentRecorder:
         name = trial.label
         print(f"Starting recording {self.device_id} with config {name}")
         
-        self.current_recording = name
-        self.reset()
-        
-        self.current_path= os.path.join(self.main_path, name)
-        self.path_vid = os.path.join(self.current_path, f'{name}_cam_{self.cam_label}_video.avi')
-        self.path_depth_gzip = os.path.join(self.current_path,f'{name}_cam_{self.cam_label}_depth_map.gzip')
-        self.path_depth_timestamps_gzip = os.path.join(self.current_path,f'{name}_cam_{self.cam_label}_depth_timestamps.gzip')
-        self.path_depth_timestamps_csv = os.path.join(self.current_path,f'{name}_cam_{self.cam_label}_depth_timestamps.csv')
-        self.path_rgb_timestamps_gzip = os.path.join(self.current_path,f'{name}_cam_{self.cam_label}_rgb_timestamps.gzip')
-        self.path_rgb_timestamps_csv = os.path.join(self.current_path,f'{name}_cam_{self.cam_label}_rgb_timestamps.csv')
-        
-        self.write_rgb_frames_thread = threading.Thread(target=self.write_rgb_frames)
-        self.write_rgb_frames_thread.start()
+        rgb_buffer, depth_buffer = self.get_buffers()
+        recording = TrialRecording(self.main_path, name, self.cam_label, rgb_buffer, depth_buffer, self.rgb_encoding)
+        if self.rgb_encoding is None:
+            recording.writer_threads.append(threading.Thread(target=self.write_rgb_frames, args=(recording,)))
+        else:
+            recording.writer_threads.append(threading.Thread(target=self.write_encoded_packets, args=(recording,)))
+        recording.writer_threads.append(threading.Thread(target=self.write_depth_maps, args=(recording,)))
+        for thread in recording.writer_threads:
+            thread.start()
         
-        self.new_rec = True
+        self.current_recording = recording
     
     def stop_record(self):
-        self.ready_to_start_new_rec = False
-        self.end_rec = True
-        if self.current_recording is None:
+        recording = self.current_recording
+        if recording is None:
             print("No recording to stop")
             return
-        print(f"Stoping recording {self.device_id} with config {self.current_recording}")
-        save_thread = threading.Thread(target=self.save_data_task)
-        save_thread.start()
-        self.saving_threads.append(save_thread)
-        self.write_rgb_frames_thread.join()
+        print(f"Stoping recording {self.device_id} with config {recording.name}")
+        # the writers drain the buffers and the trial is saved in the background
+        recording.recording = False
+        self.current_recording = None
+        future = self.persistence.submit(f'{recording.name} cam {self.cam_label}', lambda: self.save_data_task(recording), recording.nbytes())
+        self.flush_futures = [f for f in self.flush_futures if not f.done()] + [future]
     
     def stop(self):
         print(f"Stoping {self.device_id}")
@@ -232,9 +376,12 @@ class ExperimentRecorder:
         self.capture_thread.join()
         
         print("Capture thread stopped")
-        for thread in self.saving_threads:
-            thread.join()
-            print("Saving thread stopped")
+        self.rgbd_camera.telemetry.stop_export()
+        print(self.rgbd_camera.telemetry.summary())
+        concurrent.futures.wait(self.flush_futures)
+        print("Saving threads stopped")
+        if self.owns_persistence:
+            self.persistence.shutdown()
             
         print(f"Stopped {self.device_id}")
 
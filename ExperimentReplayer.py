@@ -5,8 +5,8 @@ import cv2
 import pickle 
 import os
 import pandas as pd
-from i_grip import RgbdCameras as rgbd
-from i_grip import Hands3DDetectors as hd
+import Hands3DDetectors as hd
+from rgbd.SyntheticCameras import VideoReplayCam
 from i_grip import Object2DDetectors as o2d
 from i_grip import ObjectPoseEstimators as ope
 from i_grip import Scene_refactored_multi_thread as sc
@@ -14,7 +14,7 @@ from i_grip import Scene_refactored_multi_thread as sc
 #TODO : MODIFY THIS FILE ACCORDING TO YOUR NEEDS
 
 class ExperimentReplayer:
-    def __init__(self, device_id, device_data, name = None, display_replay = True, show_depth = False, show_scene = False, save_overlayed_video = True) -> None:
+    def __init__(self, device_id, device_data, name = None, display_replay = True, show_depth = False, show_scene = False, save_overlayed_video = True, hand_detection_cache = True) -> None:
         os.environ['CUDA_VISIBLE_DEVICES'] = '0'
         
         self.device_id = device_id
@@ -25,14 +25,14 @@ class ExperimentReplayer:
         dataset = "ycbv"        
         self.display_replay = display_replay
         
-        self.rgbd_cam = rgbd.RgbdReader()
+        # the frames are decoded ahead, while the previous ones are processed
+        self.rgbd_cam = VideoReplayCam(device_id, cam_data = device_data)
         # device_data = self.rgbd_cam.get_device_data()
         print(f'cam_data: {device_data}')
         
-        hands = ['right', 'left']
-        self.hand_detector = hd.Hands3DDetector(device_data, hands = hands, running_mode =
-                                            hd.Hands3DDetector.VIDEO_FILE_MODE,
-                                            use_gpu=True)
+        # hand landmarks already detected in a replayed video, e.g. by HandDetectionBatch, are read from the cache
+        detection_cache = hd.HandDetectionCache() if hand_detection_cache else None
+        self.hand_detector = hd.get_replay_detector(device_data, use_gpu=True, detection_cache = detection_cache)
         self.object_detector = o2d.get_object_detector(dataset,
                                                        device_data)
         self.object_pose_estimator = ope.get_pose_estimator(dataset,
@@ -59,6 +59,8 @@ class ExperimentReplayer:
         self.rgbd_cam.load_replay(replay)
         self.object_pose_estimator.reset()
         self.hand_detector.reset()
+        self.hand_detector.open_video(replay['Video'])
+        replay_complete = True
         
         if name is not None:
             cv_window_name = f'{self.name} : Replaying {name}'
@@ -180,8 +182,11 @@ class ExperimentReplayer:
             
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 print('end')
+                replay_complete = False
                 self.stop()
                 break
+        self.rgbd_cam.stop()
+        self.hand_detector.close_video(complete = replay_complete)
         self.scene.pause_scene_display()
         hands_data = self.scene.get_hands_data()
         objects_data = self.scene.get_objects_data()
@@ -192,6 +197,7 @@ class ExperimentReplayer:
         
     def stop(self):
         print("Stopping experiment replayer...")
+        self.rgbd_cam.stop()
         print("Stopping object estimator...")
         self.object_pose_estimator.stop()
         print("Stopped object estimator...")
@@ -0,0 +1,161 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import cv2
+import numpy as np
+from rgbd.DepthStorage import read_depth_timestamps
+
+
+# detector of the worker process, built once by init_worker
+_detector = None
+
+
+def init_worker(cam_data, cache_path, use_gpu):
+    global _detector
+    import Hands3DDetectors as hd
+    cache = hd.HandDetectionCache(cache_path) if cache_path is not None else hd.HandDetectionCache()
+    # the detector of the replay, for the landmarks to be cached with its key
+    _detector = hd.get_replay_detector(cam_data, use_gpu=use_gpu, detection_cache=cache)
+
+
+def detect_trial(label, video_path, depth_path):
+    """
+    Detects the hands in the frames of a trial video, as ExperimentReplayer.replay does, and caches their landmarks.
+    Runs in a worker process.
+
+    Returns:
+        Tuple[str, int, float, bool]: The label of the trial, the number of frames processed, the processing time in seconds,
+            and whether the landmarks were already cached.
+    """
+    start = time.perf_counter()
+    _detector.reset()
+    _detector.open_video(video_path)
+    if _detector.cached_detections is not None:
+        _detector.close_video(complete=False)
+        return label, 0, time.perf_counter() - start, True
+    # the frames are paired with the timestamps of the depth maps, as in the replay
+    timestamps = read_depth_timestamps(depth_path)
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        _detector.close_video(complete=False)
+        raise ValueError(f'Error reading video {video_path}')
+    # only the landmarks are cached, their depths are read at replay
+    depth_map = None
+    nb_frames = 0
+    try:
+        for timestamp in timestamps:
+            success, img = video.read()
+            if not success:
+                break
+            if img.shape[0] >= img.shape[1]:
+                img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+            if depth_map is None:
+                depth_map = np.zeros(img.shape[:2], dtype=np.uint16)
+            _detector.get_hands(img, depth_map, timestamp)
+            nb_frames += 1
+    finally:
+        video.release()
+    _detector.close_video(complete=True)
+    return label, nb_frames, time.perf_counter() - start, False
+
+
+def count_frames(video_path):
+    video = cv2.VideoCapture(video_path)
+    nb_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT)) if video.isOpened() else 0
+    video.release()
+    return nb_frames
+
+
+class HandDetectionBatch:
+    """
+    Detects the hands in the videos of many trials with a pool of worker processes, before they are replayed.
+
+    Each worker builds its own detector with Hands3DDetectors.get_replay_detector, as ExperimentReplayer does, and processes one
+    trial at a time. The landmarks of each trial are saved in the hand detection cache with the key of the replay, from which
+    ExperimentReplayer reads them instead of running the landmarker.
+    Trials are submitted longest first (by number of frames): each worker takes the longest trial left when it is free, so that
+    the workers finish at about the same time.
+
+    Args:
+        cam_data (dict): The camera data of the device that recorded the videos.
+        workers (int, optional): Number of worker processes. Defaults to None (number of CPUs).
+        cache_path (str, optional): Folder of the hand detection cache. Defaults to None (HandDetectionCache.DEFAULT_PATH).
+        use_gpu (bool, optional): Whether the workers run the landmarker on GPU. Defaults to False.
+    """
+    def __init__(self, cam_data, workers=None, cache_path=None, use_gpu=False):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        if self.workers < 1:
+            raise ValueError(f'workers must be a positive integer, got {self.workers}')
+        self.cam_data = cam_data
+        self.cache_path = cache_path
+        self.use_gpu = use_gpu
+
+    @staticmethod
+    def schedule(jobs):
+        """
+        Args:
+            jobs (List[Tuple[str, str, str]]): The label, video path and depth file path of each trial.
+        Returns:
+            List[Tuple[Tuple[str, str, str], int]]: The trials with their number of frames, longest first.
+        """
+        sized_jobs = [(job, count_frames(job[1])) for job in jobs]
+        sized_jobs.sort(key=lambda sized_job: sized_job[1], reverse=True)
+        return sized_jobs
+
+    def run(self, jobs, poll=None, poll_interval=0.1):
+        """
+        Detects the hands of the trials, and caches their landmarks.
+
+        Args:
+            jobs (List[Tuple[str, str, str]]): The label, video path and depth file path of each trial.
+            poll (Callable[[], bool], optional): Called every poll_interval seconds while the workers run, e.g. to update a UI.
+                Returning False cancels the trials not started yet. Defaults to None.
+            poll_interval (float, optional): Time between two calls of poll, in seconds. Defaults to 0.1.
+        Returns:
+            Dict[str, Optional[str]]: The error of each trial, None if its landmarks were cached.
+        """
+        if len(jobs) == 0:
+            return {}
+        start = time.time()
+        sized_jobs = self.schedule(jobs)
+        total_frames = sum(nb_frames for _, nb_frames in sized_jobs)
+        workers = min(self.workers, len(sized_jobs))
+        print(f'Detecting hands in {len(sized_jobs)} trials ({total_frames} frames) with {workers} workers')
+        errors = {}
+        processed_frames = 0
+        # mediapipe is not fork-safe, workers are spawned
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                 initargs=(self.cam_data, self.cache_path, self.use_gpu)) as executor:
+            futures = {executor.submit(detect_trial, *job): job[0] for job, _ in sized_jobs}
+            pending = set(futures)
+            interrupted = False
+            while len(pending) > 0:
+                done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    label = futures[future]
+                    try:
+                        _, nb_frames, duration, cached = future.result()
+                        errors[label] = None
+                        processed_frames += nb_frames
+                        if cached:
+                            print(f'Trial {label}: hand landmarks already cached')
+                        else:
+                            print(f'Trial {label}: hands detected in {nb_frames} frames in {duration:.1f} s ({nb_frames / max(duration, 1e-6):.1f} frames/s)')
+                    except Exception as e:
+                        errors[label] = str(e)
+                        print(f'Trial {label}: hands could not be detected : {e}')
+                if poll is not None and poll() is False and not interrupted:
+                    # the trials already started are finished, their landmarks are cached
+                    for future in pending:
+                        if future.cancel():
+                            errors[futures[future]] = 'Interrupted'
+                    pending = {future for future in pending if not future.cancelled()}
+                    interrupted = True
+                    print('Hand detection interrupted, waiting for the running trials')
+        duration = time.time() - start
+        print(f'Hands detected in {processed_frames} frames in {duration:.1f} s ({processed_frames / max(duration, 1e-6):.1f} frames/s), '
+              f'{sum(error is not None for error in errors.values())} trial(s) failed')
+        return errors
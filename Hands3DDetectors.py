@@ -3,8 +3,13 @@ import cv2
 import numpy as np
 import math
 import time
+import os
+import hashlib
+import json
+import dataclasses
 from i_grip.config import _MEDIAPIPE_MODEL_PATH
-from typing import List, Dict
+from typing import List, Dict, Optional
+from rgbd.DepthAccess import DepthSampler
 # import tensorflow as tf
 # print('TENSORFLOW GPU AVAILABLE:')
 # print(tf.config.list_physical_devices('GPU'))
@@ -18,9 +23,16 @@ class Hands3DDetector:
         running_mode (str, optional): The running mode. Defaults to 'LIVE_STREAM'.
         mediapipe_model_path (str, optional): The path to the mediapipe model. Defaults to _MEDIAPIPE_MODEL_PATH.
         use_gpu (bool, optional): Whether to use GPU for processing. Defaults to True.
+        detection_cache (HandDetectionCache, optional): Cache of the landmarks detected in videos. Defaults to None (no cache).
+        roi_tracking (bool, optional): Whether to detect the hands in a crop around the hands of the previous frame. Defaults to False.
+        tracking_margin (float, optional): Margin of the crop on each side of the hands, relative to their size. Defaults to 0.5.
+        min_crop_size (int, optional): Minimal size of the crop, in pixels. Defaults to 256.
     Methods:
         init_landmarker(): Initializes the hand landmarker.
+        get_tracking_window(width, height): Returns the crop in which the hands are tracked.
         reset(): Resets the hand landmarker and clears the predictions.
+        open_video(video_path): Reads the landmarks of a video from the cache, or records them to cache them.
+        close_video(complete): Saves the landmarks recorded for the video.
         extract_hands(detection_result, output_image, timestamp_ms): Extracts the hand landmarks from the detection result.
         get_hands_video(frame, depth_frame, timestamp): Processes a video frame and returns the detected hand landmarks.
         get_hands_live_stream(frame, depth_frame): Processes a live stream frame and returns the detected hand landmarks.
@@ -31,7 +43,8 @@ class Hands3DDetector:
     VIDEO_FILE_MODE = 'VIDEO'
     _HANDS_MODE = ['left', 'right']
     
-    def __init__(self, cam_data: dict, hands: List[str] = _HANDS_MODE, running_mode: str = LIVE_STREAM_MODE, mediapipe_model_path: str = _MEDIAPIPE_MODEL_PATH, use_gpu: bool = True):
+    def __init__(self, cam_data: dict, hands: List[str] = _HANDS_MODE, running_mode: str = LIVE_STREAM_MODE, mediapipe_model_path: str = _MEDIAPIPE_MODEL_PATH, use_gpu: bool = True, detection_cache: Optional["HandDetectionCache"] = None,
+                 roi_tracking: bool = False, tracking_margin: float = 0.5, min_crop_size: int = 256):
         """
         Initializes the Hands3DDetectors object.
         Parameters:
@@ -40,6 +53,10 @@ class Hands3DDetector:
         - running_mode (str): The running mode. Defaults to LIVE_STREAM_MODE.
         - mediapipe_model_path (str): The path to the mediapipe model. Defaults to _MEDIAPIPE_MODEL_PATH.
         - use_gpu (bool): Whether to use GPU for processing. Defaults to True.
+        - detection_cache (HandDetectionCache): Cache of the landmarks detected in videos. Defaults to None (no cache).
+        - roi_tracking (bool): Whether to detect the hands in a crop around the hands of the previous frame. Defaults to False.
+        - tracking_margin (float): Margin of the crop on each side of the hands, relative to their size. Defaults to 0.5.
+        - min_crop_size (int): Minimal size of the crop, in pixels. Defaults to 256.
         
         Raises:
         - ValueError: If the hands parameter is invalid.
@@ -89,14 +106,40 @@ class Hands3DDetector:
             min_tracking_confidence=0.5
             )
             
+        # Hands are tracked in a crop by a landmarker of their own, whose timestamps are independent of the full frame landmarker
+        self.roi_tracking = roi_tracking
+        self.tracking_margin = tracking_margin
+        self.min_crop_size = min_crop_size
+        if self.roi_tracking and running_mode == self.LIVE_STREAM_MODE:
+            self.crop_landmarker_options = dataclasses.replace(self.landmarker_options, result_callback=self.extract_cropped_hands)
+        else:
+            self.crop_landmarker_options = self.landmarker_options
+
         # Initialize the hand landmarker and other variables
         self.init_landmarker()
         self.format=mp.ImageFormat.SRGB
         self.stereoInference = StereoInference(self.cam_data)
+
+        # Configuration of the detection, which identifies the landmarks of a video in the cache.
+        # The delegate is not part of it: landmarks detected on CPU (e.g. by HandDetectionBatch) are reused on GPU, and conversely
+        self.detection_cache = detection_cache
+        self.detection_config = {'model': mediapipe_model_path,
+                                 'model_size': os.path.getsize(mediapipe_model_path) if os.path.exists(mediapipe_model_path) else None,
+                                 'hands': sorted(hands),
+                                 'min_hand_presence_confidence': self.landmarker_options.min_hand_presence_confidence,
+                                 'min_hand_detection_confidence': self.landmarker_options.min_hand_detection_confidence,
+                                 'min_tracking_confidence': self.landmarker_options.min_tracking_confidence,
+                                 'roi_tracking': (tracking_margin, min_crop_size) if roi_tracking else None}
+        self.close_video(complete=False)
         
     def init_landmarker(self):
         self.hands_predictions = []
         self.landmarker = mp.tasks.vision.HandLandmarker.create_from_options(self.landmarker_options)
+        if self.roi_tracking:
+            self.crop_landmarker = mp.tasks.vision.HandLandmarker.create_from_options(self.crop_landmarker_options)
+        self.tracking_window = None
+        self.tracking_lost = False
+        self.crop_windows = {}
         
     def reset(self):
         self.init_landmarker()
@@ -119,18 +162,183 @@ class Hands3DDetector:
                 
                 # Check if the hand landmarks are valid and if the hand should be detected
                 if len(hand_landmarks)>0 and self.depth_map is not None and label in self.hands_to_detect:
-                    hand = HandPrediction(handedness, hand_landmarks, hand_world_landmarks, self.depth_map, self.stereoInference)
+                    hand = HandPrediction(handedness, hand_landmarks, hand_world_landmarks, self.depth_sampler, self.stereoInference)
                     hands_preds.append(hand)
             self.hands_predictions = hands_preds
 
+    def open_video(self, video_path: str):
+        """
+        Starts the detection of the hands in a video. If the landmarks of the video were cached with the same detection configuration,
+        they are read from the cache instead of running the landmarker, and only their depths are read. Otherwise, the landmarks
+        detected are recorded, to be cached by close_video.
+        Args:
+            video_path (str): Path of the video file.
+        """
+        self.close_video(complete=False)
+        if self.detection_cache is None:
+            return
+        self.video_key = self.detection_cache.key(video_path, self.detection_config)
+        self.video_name = os.path.basename(video_path)
+        self.cached_detections = self.detection_cache.load(self.video_key)
+        if self.cached_detections is not None:
+            print(f'Hand landmarks of {self.video_name} read from the cache')
+        else:
+            self.recorded_detections = HandDetectionCache.new_detections()
+
+    def close_video(self, complete: bool = True):
+        """
+        Ends the detection of the hands in the video opened by open_video.
+        Args:
+            complete (bool, optional): Whether all the frames of the video were processed, so that its landmarks are cached. Defaults to True.
+        """
+        if complete and getattr(self, 'recorded_detections', None) is not None:
+            self.detection_cache.save(self.video_key, self.recorded_detections)
+        if getattr(self, 'video_key', None) is not None and self.cached_frames + self.detected_frames > 0:
+            # landmarks detected beforehand (e.g. by HandDetectionBatch) are all read from the cache, the landmarker is not run
+            print(f'Hands of {self.video_name}: {self.cached_frames} frames read from the cache, {self.detected_frames} frames detected by the landmarker')
+        self.video_key = None
+        self.video_name = None
+        self.cached_detections = None
+        self.recorded_detections = None
+        self.video_frame_index = 0
+        self.cached_frames = 0
+        self.detected_frames = 0
+
+    def get_cached_hands(self, depth_frame, frame_timestamp_ms: int) -> Optional[List["HandPrediction"]]:
+        """
+        Returns:
+            Optional[List[HandPrediction]]: The hands of the next frame of the video read from the cache, None if they are not cached.
+        """
+        if self.cached_detections is None:
+            return None
+        frame_index = self.video_frame_index
+        self.video_frame_index += 1
+        hands = HandDetectionCache.get_frame(self.cached_detections, frame_index, frame_timestamp_ms)
+        if hands is None:
+            # the frames read do not match the cached ones, the landmarks of the remaining frames are detected
+            print(f'Frame {frame_index} at {frame_timestamp_ms} ms does not match the cached hand landmarks, the cache is not used')
+            self.cached_detections = None
+            return None
+        return [HandPrediction.from_arrays(label, landmarks, world_landmarks, self.depth_sampler, self.stereoInference) for label, landmarks, world_landmarks in hands]
+
+    def get_tracking_window(self, width: int, height: int) -> Optional[tuple]:
+        """
+        Returns the crop of the frame in which the hands of the previous frame are tracked. The crop is kept while the hands stay
+        well inside it, so that the landmarker tracks them in the same coordinates from frame to frame.
+        Args:
+            width (int): Width of the frame.
+            height (int): Height of the frame.
+        Returns:
+            Optional[tuple]: The crop (xmin, ymin, xmax, ymax) in pixels, None to detect the hands in the whole frame.
+        """
+        if not self.roi_tracking or self.tracking_lost or len(self.hands_predictions) == 0:
+            self.tracking_lost = False
+            self.tracking_window = None
+            return None
+        points = np.vstack([hand.normalized_landmarks[:, :2] for hand in self.hands_predictions]) * (width, height)
+        xmin, ymin = points.min(axis=0)
+        xmax, ymax = points.max(axis=0)
+        hands_size = max(xmax - xmin, ymax - ymin)
+        if self.tracking_window is not None:
+            # the crop is kept while the hands are at least half a margin away from its borders
+            inner = hands_size * self.tracking_margin / 2
+            wxmin, wymin, wxmax, wymax = self.tracking_window
+            if xmin - inner >= wxmin and ymin - inner >= wymin and xmax + inner <= wxmax and ymax + inner <= wymax:
+                return self.tracking_window
+        size = max(int(hands_size * (1 + 2 * self.tracking_margin)), self.min_crop_size)
+        if size * size >= 0.5 * width * height:
+            # cropping would not reduce the image much
+            self.tracking_window = None
+            return None
+        crop_width, crop_height = min(size, width), min(size, height)
+        x0 = int(min(max((xmin + xmax - crop_width) / 2, 0), width - crop_width))
+        y0 = int(min(max((ymin + ymax - crop_height) / 2, 0), height - crop_height))
+        self.tracking_window = (x0, y0, x0 + crop_width, y0 + crop_height)
+        return self.tracking_window
+
+    @staticmethod
+    def to_frame_coordinates(detection_result: mp.tasks.vision.HandLandmarkerResult, window: tuple, width: int, height: int) -> None:
+        """
+        Converts in place the normalized landmarks detected in a crop to normalized coordinates in the whole frame.
+        """
+        xmin, ymin, xmax, ymax = window
+        crop_width, crop_height = xmax - xmin, ymax - ymin
+        for hand_landmarks in detection_result.hand_landmarks:
+            for landmark in hand_landmarks:
+                landmark.x = (landmark.x * crop_width + xmin) / width
+                landmark.y = (landmark.y * crop_height + ymin) / height
+                # depths are normalized by the width of the image, as x
+                landmark.z = landmark.z * crop_width / width
+
+    def is_tracked(self, detection_result: mp.tasks.vision.HandLandmarkerResult, window: tuple, width: int, height: int) -> bool:
+        """
+        Returns:
+            bool: Whether all the hands of the previous frame were found in the crop, away from the borders of the crop inside the frame.
+        """
+        if detection_result is None or len(detection_result.hand_landmarks) < len(self.hands_predictions):
+            return False
+        xmin, ymin, xmax, ymax = window
+        for hand_landmarks in detection_result.hand_landmarks:
+            points = np.array([[l.x * width, l.y * height] for l in hand_landmarks])
+            if (xmin > 0 and points[:, 0].min() <= xmin + 1) or (ymin > 0 and points[:, 1].min() <= ymin + 1) \
+                    or (xmax < width and points[:, 0].max() >= xmax - 1) or (ymax < height and points[:, 1].max() >= ymax - 1):
+                return False
+        return True
+
+    def detect_video_frame(self, frame, frame_timestamp_ms: int) -> tuple:
+        """
+        Detects the hands of a video frame, in the tracking window if the hands are tracked, else in the whole frame.
+        When the hands are not all found in the tracking window, they are detected again in the whole frame.
+        Returns:
+            tuple: The detection result, in normalized coordinates of the whole frame, and the image processed.
+        """
+        height, width = frame.shape[:2]
+        window = self.get_tracking_window(width, height)
+        if window is not None:
+            xmin, ymin, xmax, ymax = window
+            mp_image = mp.Image(image_format=self.format, data=np.ascontiguousarray(frame[ymin:ymax, xmin:xmax]))
+            landmark_results = self.crop_landmarker.detect_for_video(mp_image, frame_timestamp_ms)
+            if landmark_results is not None:
+                self.to_frame_coordinates(landmark_results, window, width, height)
+            if self.is_tracked(landmark_results, window, width, height):
+                return landmark_results, mp_image
+            self.tracking_window = None
+        mp_image = mp.Image(image_format=self.format, data=frame)
+        return self.landmarker.detect_for_video(mp_image, frame_timestamp_ms), mp_image
+
+    def extract_cropped_hands(self, detection_result: mp.tasks.vision.HandLandmarkerResult, output_image: mp.Image, timestamp_ms: int):
+        """
+        Callback of the crop landmarker in live stream mode: extracts the hands detected in the tracking window.
+        If they are not all found, the hands of the next frame are detected in the whole frame.
+        """
+        window, width, height = self.crop_windows.pop(timestamp_ms, (None, None, None))
+        # frames dropped by the landmarker have no result
+        for dropped_timestamp_ms in [t for t in self.crop_windows if t < timestamp_ms]:
+            del self.crop_windows[dropped_timestamp_ms]
+        if window is None or detection_result is None:
+            return
+        self.to_frame_coordinates(detection_result, window, width, height)
+        if not self.is_tracked(detection_result, window, width, height):
+            self.tracking_lost = True
+        self.extract_hands(detection_result, output_image, timestamp_ms)
+
     def get_hands_video(self, frame, depth_frame, timestamp):
         # Check if the frame and depth frame are valid
         if frame is not None and depth_frame is not None:
             frame_timestamp_ms = round(timestamp*1000)
-            mp_image = mp.Image(image_format=self.format, data=frame)
-            landmark_results = self.landmarker.detect_for_video(mp_image, frame_timestamp_ms)
             self.depth_map = depth_frame
-            self.extract_hands(landmark_results, mp_image, frame_timestamp_ms)
+            # the depths of all the hands of the frame are read with the same sampler
+            self.depth_sampler = self.stereoInference.sampler(depth_frame)
+            cached_hands = self.get_cached_hands(depth_frame, frame_timestamp_ms)
+            if cached_hands is not None:
+                self.hands_predictions = cached_hands
+                self.cached_frames += 1
+            else:
+                landmark_results, mp_image = self.detect_video_frame(frame, frame_timestamp_ms)
+                self.detected_frames += 1
+                self.extract_hands(landmark_results, mp_image, frame_timestamp_ms)
+                if self.recorded_detections is not None:
+                    HandDetectionCache.add_frame(self.recorded_detections, frame_timestamp_ms, self.hands_predictions)
             self.new_frame = False
         return self.hands_predictions
     
@@ -138,9 +346,19 @@ class Hands3DDetector:
         # Check if the frame and depth frame are valid
         if frame is not None and depth_frame is not None:
             frame_timestamp_ms = round(time.time()*1000)
-            mp_image = mp.Image(image_format=self.format, data=frame)
             self.depth_map = depth_frame
-            self.landmarker.detect_async(mp_image, frame_timestamp_ms)
+            # the depths of all the hands of the frame are read with the same sampler
+            self.depth_sampler = self.stereoInference.sampler(depth_frame)
+            height, width = frame.shape[:2]
+            window = self.get_tracking_window(width, height)
+            if window is not None:
+                xmin, ymin, xmax, ymax = window
+                self.crop_windows[frame_timestamp_ms] = (window, width, height)
+                mp_image = mp.Image(image_format=self.format, data=np.ascontiguousarray(frame[ymin:ymax, xmin:xmax]))
+                self.crop_landmarker.detect_async(mp_image, frame_timestamp_ms)
+            else:
+                mp_image = mp.Image(image_format=self.format, data=frame)
+                self.landmarker.detect_async(mp_image, frame_timestamp_ms)
             self.new_frame = False
         return self.hands_predictions
 
@@ -152,10 +370,17 @@ class HandPrediction:
         handedness (list): A list of handedness objects.
         landmarks (list): A list of landmark objects.
         world_landmarks (list): A list of world landmark objects.
+        detected_world_landmarks (numpy.ndarray): The world landmarks detected, in mm, relative to the hand.
         depth_map (numpy.ndarray): A numpy array representing the depth map.
         stereo_inference (object): An object representing stereo inference.
+        position (numpy.ndarray): The position of the hand point in the camera frame, from the depth map.
+        roi (tuple): The region of the depth map read for the hand point.
+        landmarks_positions (numpy.ndarray): The positions of the landmarks in the camera frame, from the depth map.
+        landmarks_valid (numpy.ndarray): Whether each landmark had a valid depth.
     Methods:
         __init__(self, handedness, landmarks, world_landmarks, depth_map, stereo_inference): Initializes a HandPrediction object.
+        from_arrays(label, normalized_landmarks, detected_world_landmarks, depth_map, stereo_inference): Builds a HandPrediction object from detected landmarks.
+        lift(depth_map, stereo_inference): Calculates the positions of the hand and of its landmarks from the depth map.
         hand_point(self): Calculates the hand point in 2D and 3D.
         get_landmarks(self): Returns the normalized landmarks.
     """
@@ -171,10 +396,43 @@ class HandPrediction:
     #              stereo_inference: "StereoInference") -> None:
         self.handedness = handedness
         self.normalized_landmarks = np.array([[l.x,l.y,l.z] for l in landmarks])
-        self.world_landmarks = np.array([[l.x,-l.y,l.z] for l in world_landmarks])*1000
+        self.detected_world_landmarks = np.array([[l.x,-l.y,l.z] for l in world_landmarks])*1000
         self.label = handedness[0].category_name.lower()
+        self.lift(depth_map, stereo_inference)
+
+    @classmethod
+    def from_arrays(cls, label: str, normalized_landmarks: np.ndarray, detected_world_landmarks: np.ndarray, depth_map: np.ndarray, stereo_inference: "StereoInference") -> "HandPrediction":
+        """
+        Builds a hand prediction from landmarks already detected, e.g. read from a HandDetectionCache. Its handedness is None.
+        Args:
+            label (str): The label of the hand, 'left' or 'right'.
+            normalized_landmarks (numpy.ndarray): The normalized landmarks, as a (21, 3) array.
+            detected_world_landmarks (numpy.ndarray): The world landmarks detected, in mm, as a (21, 3) array.
+            depth_map (numpy.ndarray): The depth map.
+            stereo_inference (StereoInference): The stereo inference.
+        Returns:
+            HandPrediction: The hand prediction.
+        """
+        hand = cls.__new__(cls)
+        hand.handedness = None
+        hand.label = label
+        hand.normalized_landmarks = np.asarray(normalized_landmarks, dtype=float)
+        hand.detected_world_landmarks = np.asarray(detected_world_landmarks, dtype=float)
+        hand.lift(depth_map, stereo_inference)
+        return hand
+
+    def lift(self, depth_map: np.ndarray, stereo_inference: "StereoInference") -> None:
+        """
+        Reads the positions of the hand and of its landmarks in the depth map, and places the world landmarks at the position of the hand.
+        """
+        self.world_landmarks = self.detected_world_landmarks
         hand_point2D, hand_point3D = self.hand_point()
-        self.position, self.roi = stereo_inference.calc_spatials(hand_point2D, depth_map)
+        # the landmarks and the hand point are lifted to 3D together, the hand point being the last one
+        points2D = np.vstack([self.normalized_landmarks[:, :2], hand_point2D[:2]])
+        positions, boxes, valid = stereo_inference.calc_spatials_batch(points2D, depth_map)
+        self.landmarks_positions, self.landmarks_valid = positions[:-1], valid[:-1]
+        self.position = positions[-1]
+        self.roi = tuple(int(v) for v in boxes[-1]) if boxes is not None else None
         hand_center = self.position.copy()
         self.world_landmarks = self.world_landmarks + hand_center - hand_point3D
         # self.position = self.position/1000
@@ -243,13 +501,26 @@ class StereoInference:
         """
         return math.atan(math.tan(self.hfov / 2.0) * offset / (self.original_width / 2.0))
 
+    def sampler(self, depth_map) -> DepthSampler:
+        """
+        Returns the sampler of the mean depths of a depth map, with the depth thresholds of the stereo inference.
+        Sampling many points of a depth map (e.g. the landmarks of the hands of a frame) with a single sampler is faster than one ROI per point,
+        the sampler is meant to be built once per depth map.
+        Args:
+            depth_map (ndarray or AlignedDepth): Depth map, aligned with the rgb frame.
+        Returns:
+            DepthSampler: The sampler.
+        """
+        return DepthSampler(depth_map, self.depth_thres_low, self.depth_thres_high)
+
     def calc_spatials(self, normalized_img_point: tuple, depth_map: np.ndarray, averaging_method: callable = np.mean) -> tuple:
         """
         Calculates the spatial coordinates based on the normalized image point and depth map.
         Args:
             normalized_img_point (tuple): Normalized image point (x, y).
-            depth_map (ndarray): Depth map.
-            averaging_method (function, optional): Averaging method for calculating average depth. Defaults to np.mean.
+            depth_map (ndarray, AlignedDepth or DepthSampler): Depth map, aligned with the rgb frame.
+            averaging_method (function, optional): Averaging method for calculating average depth. Defaults to np.mean, read from the integral
+                images of the sampler when the ROI is inside them.
         Returns:
             tuple: Spatial coordinates (x, y, z) and bounding box coordinates (xmin, ymin, xmax, ymax).
         """
@@ -281,12 +552,18 @@ class StereoInference:
             ymax = ymin +self.box_size
 
         # Calculate the average depth in the ROI.
-        depthROI = depth_map[ymin:ymax, xmin:xmax]
-        inThreshRange = (self.depth_thres_low < depthROI) & (depthROI < self.depth_thres_high)
-        if depthROI[inThreshRange].any():
-            averageDepth = averaging_method(depthROI[inThreshRange])
+        if averaging_method is np.mean:
+            sampler = depth_map if isinstance(depth_map, DepthSampler) else self.sampler(depth_map)
+            averageDepth = sampler.mean(xmin, ymin, xmax, ymax)
         else:
-            averageDepth = 0
+            if isinstance(depth_map, DepthSampler):
+                depth_map = depth_map.depth_map
+            depthROI = depth_map[ymin:ymax, xmin:xmax]
+            inThreshRange = (self.depth_thres_low < depthROI) & (depthROI < self.depth_thres_high)
+            if depthROI[inThreshRange].any():
+                averageDepth = averaging_method(depthROI[inThreshRange])
+            else:
+                averageDepth = 0
 
         # Calculate the position and bounding box coordinates in 3D space
         mid_w = int(depth_map.shape[1] / 2) # middle of the depth img
@@ -302,5 +579,188 @@ class StereoInference:
 
         return np.array([x,y,z]), (xmin, ymin, xmax, ymax)
         return np.array([x,y,z]), (xmin, ymin, xmax, ymax)
+
+    def calc_spatials_batch(self, normalized_img_points: np.ndarray, depth_map: np.ndarray) -> tuple:
+        """
+        Calculates the spatial coordinates of many normalized image points at once, as calc_spatials with np.mean averaging.
+        The mean depths of all the points are read with a single DepthSampler, and their angles are computed as arrays.
+        Args:
+            normalized_img_points (ndarray): Normalized image points (x, y), as an (N, 2) array.
+            depth_map (ndarray, AlignedDepth or DepthSampler): Depth map, aligned with the rgb frame.
+        Returns:
+            tuple: Spatial coordinates (x, y, z) as an (N, 3) array, bounding boxes (xmin, ymin, xmax, ymax) as an (N, 4) array,
+            and whether each point has a valid depth as an (N,) array.
+        """
+        normalized_img_points = np.asarray(normalized_img_points, dtype=float).reshape(-1, 2)
+        n = len(normalized_img_points)
+        if depth_map is None:
+            print('No depth map available yet')
+            return np.zeros((n, 3)), None, np.zeros(n, dtype=bool)
+        sampler = depth_map if isinstance(depth_map, DepthSampler) else self.sampler(depth_map)
+        height, width = sampler.shape
+
+        # Calculate the pixel coordinates and the bounding boxes, as calc_spatials
+        x = normalized_img_points[:, 0]*self.original_width
+        y = normalized_img_points[:, 1]*self.original_height
+        xmin = np.maximum(np.trunc(x-self.box_size), 0).astype(int)
+        xmax = np.minimum(np.trunc(x+self.box_size), width).astype(int)
+        ymin = np.maximum(np.trunc(y-self.box_size), 0).astype(int)
+        ymax = np.minimum(np.trunc(y+self.box_size), height).astype(int)
+        xmin, xmax = np.minimum(xmin, xmax), np.maximum(xmin, xmax)
+        ymin, ymax = np.minimum(ymin, ymax), np.maximum(ymin, ymax)
+        xmax = np.where(xmin == xmax, xmin + self.box_size, xmax)
+        ymax = np.where(ymin == ymax, ymin + self.box_size, ymax)
+        boxes = np.stack([xmin, ymin, xmax, ymax], axis=1)
+
+        z, counts = sampler.means(boxes)
+
+        # tan(calc_angle(offset)) is linear in the offset from the middle of the image
+        tan_scale = math.tan(self.hfov / 2.0) / (self.original_width / 2.0)
+        positions = np.stack([z * tan_scale * (x - int(width / 2)), -z * tan_scale * (y - int(height / 2)), z], axis=1)
+        return positions, boxes, counts > 0
     
 
+
+
+class HandDetectionCache:
+    """
+    Hand landmarks detected in the frames of videos, saved on disk so that replaying a video again does not run the landmarker.
+    The landmarks of a video are identified by the content of the video file and the configuration of the detector, and saved
+    as arrays in a compressed npz file. Only their depths are read again when they are replayed.
+    Args:
+        path (str, optional): Folder of the cache. Defaults to DEFAULT_PATH.
+    Methods:
+        key(video_path, detection_config): Returns the key of the landmarks of a video detected with a configuration.
+        load(key): Reads cached landmarks.
+        save(key, detections): Saves landmarks.
+        clear(): Removes all the cached landmarks.
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'hand_detections')
+    LABELS = ['left', 'right']
+    _CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        self.path = path
+        self._video_digests = {}
+
+    def video_digest(self, video_path: str) -> str:
+        """
+        Returns:
+            str: The hash of the content of a video file, computed once per file, size and modification time.
+        """
+        stat = os.stat(video_path)
+        file_key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+        if file_key not in self._video_digests:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(video_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self._CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            self._video_digests[file_key] = digest.hexdigest()
+        return self._video_digests[file_key]
+
+    def key(self, video_path: str, detection_config: Dict) -> str:
+        """
+        Args:
+            video_path (str): Path of the video file.
+            detection_config (dict): Configuration of the detector (model, confidence thresholds, hands).
+        Returns:
+            str: The key of the landmarks of the video detected with the configuration.
+        """
+        config = json.dumps(detection_config, sort_keys=True, default=str)
+        return hashlib.blake2b(f'{self.video_digest(video_path)}{config}'.encode(), digest_size=16).hexdigest()
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}_hands.npz')
+
+    def load(self, key: str) -> Optional[Dict]:
+        """
+        Returns:
+            Optional[dict]: The cached landmarks, None if they were never cached.
+        """
+        file_path = self.file_path(key)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with np.load(file_path) as cached:
+                detections = {name: cached[name] for name in ['timestamps', 'frame_index', 'labels', 'landmarks', 'world_landmarks']}
+        except (OSError, KeyError, ValueError) as e:
+            print(f'Hand detection cache {file_path} could not be read ({e}), hands are detected again')
+            return None
+        # first hand of each frame, the hands being sorted by frame
+        detections['frame_starts'] = np.searchsorted(detections['frame_index'], np.arange(len(detections['timestamps']) + 1))
+        return detections
+
+    def save(self, key: str, detections: Dict) -> None:
+        """
+        Args:
+            key (str): The key of the landmarks.
+            detections (dict): The landmarks recorded with new_detections and add_frame.
+        """
+        file_path = self.file_path(key)
+        num_hands = len(detections['labels'])
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            np.savez_compressed(file_path,
+                                timestamps=np.array(detections['timestamps'], dtype=np.int64),
+                                frame_index=np.array(detections['frame_index'], dtype=np.int32),
+                                labels=np.array(detections['labels'], dtype=np.int8),
+                                landmarks=np.array(detections['landmarks'], dtype=np.float32).reshape(num_hands, 21, 3),
+                                world_landmarks=np.array(detections['world_landmarks'], dtype=np.float32).reshape(num_hands, 21, 3))
+            print(f"Hand landmarks of {len(detections['timestamps'])} frames cached in {file_path}")
+        except OSError as e:
+            print(f'Hand landmarks could not be cached : {e}')
+
+    def clear(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith('_hands.npz'):
+                os.remove(os.path.join(self.path, name))
+
+    @staticmethod
+    def new_detections() -> Dict:
+        return {'timestamps': [], 'frame_index': [], 'labels': [], 'landmarks': [], 'world_landmarks': []}
+
+    @staticmethod
+    def add_frame(detections: Dict, timestamp_ms: int, hands: List["HandPrediction"]) -> None:
+        """
+        Records the hands detected in the next frame of a video.
+        """
+        frame_index = len(detections['timestamps'])
+        detections['timestamps'].append(timestamp_ms)
+        for hand in hands:
+            detections['frame_index'].append(frame_index)
+            detections['labels'].append(HandDetectionCache.LABELS.index(hand.label))
+            detections['landmarks'].append(hand.normalized_landmarks)
+            detections['world_landmarks'].append(hand.detected_world_landmarks)
+
+    @staticmethod
+    def get_frame(detections: Dict, frame_index: int, timestamp_ms: int) -> Optional[List[tuple]]:
+        """
+        Returns:
+            Optional[List[tuple]]: The label, normalized landmarks and world landmarks of each hand cached for a frame, None if
+            the frame is not cached with this timestamp.
+        """
+        if frame_index >= len(detections['timestamps']) or detections['timestamps'][frame_index] != timestamp_ms:
+            return None
+        start, end = detections['frame_starts'][frame_index], detections['frame_starts'][frame_index + 1]
+        return [(HandDetectionCache.LABELS[detections['labels'][i]], detections['landmarks'][i], detections['world_landmarks'][i]) for i in range(start, end)]
+
+
+# Hands detected when the trials are replayed
+REPLAY_HANDS = ['right', 'left']
+
+
+def get_replay_detector(cam_data: dict, use_gpu: bool = True, detection_cache: Optional[HandDetectionCache] = None) -> Hands3DDetector:
+    """
+    Builds the detector of the hands of replayed videos. ExperimentReplayer and HandDetectionBatch both build theirs with this function,
+    so that the landmarks detected beforehand by HandDetectionBatch have the cache key of the replay, and are read back from the cache.
+    Args:
+        cam_data (dict): The camera data.
+        use_gpu (bool, optional): Whether to run the landmarker on GPU. It is not part of the cache key. Defaults to True.
+        detection_cache (HandDetectionCache, optional): Cache of the landmarks detected in videos. Defaults to None (no cache).
+    Returns:
+        Hands3DDetector: The detector, in video mode.
+    """
+    return Hands3DDetector(cam_data, hands=REPLAY_HANDS, running_mode=Hands3DDetector.VIDEO_FILE_MODE,
+                           mediapipe_model_path=_MEDIAPIPE_MODEL_PATH, use_gpu=use_gpu, detection_cache=detection_cache)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import shutil
+import subprocess
+import threading
+import time
+import cv2
+import numpy as np
+from rgbd.DepthStorage import ChunkedDepthFormat, ChunkedDepthReader
+from rgbd.TrialMetadata import build_metadata, write_metadata, metadata_path, read_recording_info
+from rgbd.EncodedRecording import BITSTREAM_EXTENSIONS, EncodedStreamWriter, get_codec, split_access_units, packets_path, remux
+
+
+class TrialJournal:
+    """
+    Append-only log of the frames written to disk while a trial is recorded by one camera.
+
+    Each line holds the stream ('rgb' or 'depth') and the timestamp of a frame, in writing order. The journal
+    is flushed to disk regularly, so that the timestamps of the frames already on disk survive a crash of the
+    recording process. Once the trial was completely saved, its timestamps are in the trial metadata and the journal
+    is removed: a journal left belongs to an interrupted recording, which can be rebuilt with recover_trial(). The
+    journal of a recovered recording, or of an older recording completely saved, ends with an 'end' line.
+
+    Args:
+        path (str): Path of the journal.
+        flush_interval (float, optional): Maximum time between two flushes to disk, in seconds. Defaults to 0.5.
+    """
+    SUFFIX = '_journal.csv'
+    RGB = 'rgb'
+    DEPTH = 'depth'
+    END = 'end'
+
+    def __init__(self, path, flush_interval=0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.file = open(path, 'w')
+        self.file.write('Stream,Date\n')
+        self.sync()
+
+    def log(self, stream, timestamp):
+        """
+        Records that a frame was written.
+
+        Args:
+            stream (str): 'rgb' or 'depth'.
+            timestamp (float): The timestamp of the frame.
+        """
+        with self.lock:
+            self.file.write(f'{stream},{timestamp!r}\n')
+            if time.time() - self.last_sync > self.flush_interval:
+                self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.time()
+
+    def close(self, complete=True):
+        """
+        Closes the journal.
+
+        Args:
+            complete (bool, optional): Whether all the files of the trial were saved, in which case the journal is removed. Defaults to True.
+        """
+        with self.lock:
+            self.sync()
+            self.file.close()
+            if complete:
+                os.remove(self.path)
+
+
+def read_journal(path):
+    """
+    Reads a journal, ignoring a last line cut by a crash.
+
+    Args:
+        path (str): Path of the journal.
+    Returns:
+        Tuple[Dict[str, np.ndarray], bool]: The timestamps of each stream, and whether the trial was completely saved.
+    """
+    timestamps = {TrialJournal.RGB: [], TrialJournal.DEPTH: []}
+    complete = False
+    with open(path, 'r') as f:
+        next(f, None)
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            fields = line.strip().split(',')
+            if len(fields) != 2:
+                continue
+            stream, value = fields
+            if stream == TrialJournal.END:
+                complete = True
+            elif stream in timestamps:
+                try:
+                    timestamps[stream].append(float(value))
+                except ValueError:
+                    continue
+    return {stream: np.array(values, dtype=np.float64) for stream, values in timestamps.items()}, complete
+
+
+def find_journals(folder):
+    """
+    Lists the journals of a trial folder, or of all the trial folders of a participant folder.
+
+    Args:
+        folder (str): The trial or participant folder.
+    Returns:
+        List[str]: Paths of the journals.
+    """
+    journals = []
+    for root, _, files in os.walk(folder):
+        journals += [os.path.join(root, f) for f in files if f.endswith(TrialJournal.SUFFIX)]
+    return sorted(journals)
+
+
+def count_video_frames(path):
+    """
+    Counts the frames that can actually be decoded from a video, which may have been cut by a crash.
+    """
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        return 0
+    nb_frames = 0
+    while video.grab():
+        nb_frames += 1
+    video.release()
+    return nb_frames
+
+
+def reindex_video(path):
+    """
+    Rewrites a video cut by a crash with ffmpeg, without re-encoding it, so that its index is rebuilt.
+
+    Returns:
+        bool: True if the video was rewritten.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return False
+    fixed_path = path + '.fixed' + os.path.splitext(path)[1]
+    result = subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-i', path, '-c', 'copy', fixed_path], capture_output=True, text=True)
+    if result.returncode != 0 or not os.path.exists(fixed_path):
+        print(f"Failed to rebuild the index of {path} : {result.stderr}")
+        return False
+    os.replace(fixed_path, path)
+    return True
+
+
+def recover_trial(journal_path, fps=30., force=False):
+    """
+    Rebuilds a consistent trial recording from what reached the disk before the recording process stopped:
+    the depth container is cut after its last complete chunk and re-indexed, the video is re-indexed if needed,
+    and the trial metadata and recording info are written from the journal and the depth chunks, keeping only
+    the frames present on disk.
+
+    Args:
+        journal_path (str): Path of the journal of the recording.
+        fps (float, optional): Frame rate of the recording, used to remux an encoded bitstream. Defaults to 30.
+        force (bool, optional): Whether to rebuild a recording that was completely saved. Defaults to False.
+    Returns:
+        Optional[Dict]: Information on the recovered recording, None if it did not need to be recovered.
+    """
+    journal_timestamps, complete = read_journal(journal_path)
+    if complete and not force:
+        print(f"{journal_path} : recording complete, nothing to recover")
+        return None
+    base = journal_path[:-len(TrialJournal.SUFFIX)]
+    print(f"Recovering {base}")
+    recovery_info = {'recovered': True, 'journal_rgb_frames': len(journal_timestamps[TrialJournal.RGB]),
+                     'journal_depth_frames': len(journal_timestamps[TrialJournal.DEPTH])}
+
+    # depth maps : complete chunks hold their own timestamps
+    depth_timestamps = np.zeros(0, dtype=np.float64)
+    path_depth = base + '_depth_map' + ChunkedDepthFormat.EXTENSION
+    if os.path.exists(path_depth):
+        with ChunkedDepthReader(path_depth) as reader:
+            chunks = reader.chunks
+            depth_timestamps = reader.get_timestamps()
+        end = chunks[-1]['end'] if len(chunks) > 0 else ChunkedDepthFormat.FILE_HEADER.size
+        if os.path.getsize(path_depth) > end:
+            os.truncate(path_depth, end)
+        with open(ChunkedDepthFormat.index_path(path_depth), 'wb') as index_file:
+            for chunk in chunks:
+                index_file.write(ChunkedDepthFormat.INDEX_ENTRY.pack(chunk['offset'], chunk['first_frame'], chunk['n_frames']))
+    recovery_info['depth_frames'] = len(depth_timestamps)
+
+    # rgb frames : the journal gives the timestamps of the frames, which are kept as long as they reached the video
+    rgb_timestamps = journal_timestamps[TrialJournal.RGB]
+    path_bitstreams = [base + '_video' + extension for extension in BITSTREAM_EXTENSIONS.values() if os.path.exists(base + '_video' + extension)]
+    if len(path_bitstreams) > 0:
+        path_bitstream = path_bitstreams[0]
+        with open(path_bitstream, 'rb') as f:
+            packets = list(split_access_units(f.read(), get_codec(path_bitstream)))
+        nb_rgb_frames = min(len(packets), len(rgb_timestamps))
+        # the bitstream is rewritten without its last packet if it was cut
+        rewritten_path = path_bitstream + '.tmp' + os.path.splitext(path_bitstream)[1]
+        stream_writer = EncodedStreamWriter(rewritten_path)
+        for packet, timestamp in zip(packets[:nb_rgb_frames], rgb_timestamps[:nb_rgb_frames]):
+            stream_writer.write(packet, timestamp)
+        stream_writer.close()
+        os.replace(rewritten_path, path_bitstream)
+        os.replace(packets_path(rewritten_path), packets_path(path_bitstream))
+        if remux(path_bitstream, base + '_video.mp4', fps):
+            os.remove(path_bitstream)
+    elif os.path.exists(base + '_video.avi'):
+        path_vid = base + '_video.avi'
+        nb_video_frames = count_video_frames(path_vid)
+        if nb_video_frames == 0 and reindex_video(path_vid):
+            nb_video_frames = count_video_frames(path_vid)
+        nb_rgb_frames = min(nb_video_frames, len(rgb_timestamps))
+    else:
+        nb_rgb_frames = 0
+    rgb_timestamps = rgb_timestamps[:nb_rgb_frames]
+    recovery_info['rgb_frames'] = nb_rgb_frames
+
+    # host timestamps and dropped frames are unknown, only the frames on disk are listed in the trial metadata
+    folder, recording_name = os.path.split(base)
+    label, device_id = recording_name.rsplit('_cam_', 1)
+    no_host_dates = np.full(len(rgb_timestamps), np.nan), np.full(len(depth_timestamps), np.nan)
+    metadata = build_metadata(device_id, rgb_timestamps, no_host_dates[0], rgb_timestamps, depth_timestamps, no_host_dates[1], depth_timestamps)
+    # the recording info written at the end of the recording is completed, or created if it is missing
+    path_metadata = metadata_path(folder, label)
+    recording_info = read_recording_info(path_metadata, device_id) if os.path.isfile(path_metadata) else {}
+    recording_info.update(recovery_info)
+    write_metadata(path_metadata, metadata, recording_info={device_id: recording_info})
+
+    # the line cut by the crash is terminated before the journal is marked as complete
+    with open(journal_path, 'rb') as f:
+        cut_line = not f.read().endswith(b'\n')
+    with open(journal_path, 'a') as f:
+        f.write(('\n' if cut_line else '') + f'{TrialJournal.END},{time.time()!r}\n')
+    print(f"Recovered {base} : {nb_rgb_frames} rgb frames, {len(depth_timestamps)} depth maps")
+    return recovery_info
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuilds the trials whose recording was interrupted")
+    parser.add_argument('folder', help="Trial or participant folder")
+    parser.add_argument('--fps', type=float, default=30., help="Frame rate of the recordings")
+    parser.add_argument('--force', action='store_true', help="Also rebuild the recordings that were completely saved")
+    parser.add_argument('--dry_run', action='store_true', help="Only list the interrupted recordings")
+    args = parser.parse_args()
+
+    journals = find_journals(args.folder)
+    print(f"{len(journals)} journal(s) found in {args.folder}")
+    for journal_path in journals:
+        if args.dry_run:
+            _, complete = read_journal(journal_path)
+            print(f"{journal_path} : {'complete' if complete else 'interrupted'}")
+        else:
+            recover_trial(journal_path, fps=args.fps, force=args.force)
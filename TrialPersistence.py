@@ -0,0 +1,124 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PersistenceExecutor:
+    """
+    Saves the recorded trials in the background, for a whole session.
+
+    Each trial flush is submitted with the amount of memory it holds until it is written (frames still buffered,
+    timestamps...). Submitting never blocks, so that stopping a trial does not freeze the UI. Instead, the backlog
+    is bounded at the start of the next trial: wait_for_capacity() blocks as long as too many flushes are pending,
+    or as long as they hold more memory than the budget.
+
+    Args:
+        max_pending (int, optional): Maximum number of pending flushes before new trials have to wait. Defaults to 4.
+        memory_budget_mb (float, optional): Maximum memory held by the pending flushes before new trials have to wait, in MB. Defaults to 2048.
+        workers (int, optional): Number of flushes run concurrently. Defaults to 2.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+
+    def __init__(self, max_pending=4, memory_budget_mb=2048., workers=2):
+        if max_pending < 1:
+            raise ValueError(f'max_pending must be a positive integer, got {max_pending}')
+        if workers < 1:
+            raise ValueError(f'workers must be a positive integer, got {workers}')
+        self.max_pending = int(max_pending)
+        self.memory_budget = float(memory_budget_mb) * 1e6
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='trial_flush')
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.next_id = 0
+        self.completed = 0
+        self.failed = []
+
+    def submit(self, label, task, nbytes=0):
+        """
+        Schedules a trial flush.
+
+        Args:
+            label (str): Label of the flush, displayed to the experimentator.
+            task (Callable[[], None]): The function saving the trial.
+            nbytes (int, optional): Memory held by the flush until it is done, in bytes. Defaults to 0.
+        Returns:
+            concurrent.futures.Future: The future of the flush.
+        """
+        with self.condition:
+            flush_id = self.next_id
+            self.next_id += 1
+            self.pending[flush_id] = {'label': label, 'nbytes': int(nbytes), 'state': self.QUEUED, 'submitted': time.time()}
+        print(f"Trial flush '{label}' queued ({nbytes / 1e6:.1f} MB), {len(self.pending)} pending")
+        return self.executor.submit(self.run, flush_id, task)
+
+    def run(self, flush_id, task):
+        with self.condition:
+            self.pending[flush_id]['state'] = self.RUNNING
+            label = self.pending[flush_id]['label']
+        try:
+            task()
+        except Exception as e:
+            print(f"Trial flush '{label}' failed : {e}")
+            with self.condition:
+                self.failed.append(label)
+            raise
+        finally:
+            with self.condition:
+                del self.pending[flush_id]
+                self.completed += 1
+                self.condition.notify_all()
+
+    def get_pending(self):
+        """
+        Returns:
+            List[Dict]: The label, memory held, state ('queued' or 'running') and submission time of the pending flushes, oldest first.
+        """
+        with self.condition:
+            return [dict(flush) for _, flush in sorted(self.pending.items())]
+
+    def pending_bytes(self):
+        with self.condition:
+            return sum(flush['nbytes'] for flush in self.pending.values())
+
+    def has_capacity(self):
+        with self.condition:
+            return self._has_capacity()
+
+    def _has_capacity(self):
+        return len(self.pending) < self.max_pending and sum(flush['nbytes'] for flush in self.pending.values()) < self.memory_budget
+
+    def wait_for_capacity(self, timeout=None):
+        """
+        Waits until the backlog is below the maximum number of pending flushes and the memory budget.
+
+        Args:
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to None.
+        Returns:
+            bool: True if there is capacity for a new trial, False if the timeout expired.
+        """
+        with self.condition:
+            return self.condition.wait_for(self._has_capacity, timeout)
+
+    def get_status(self):
+        """
+        Returns:
+            str: A short description of the backlog, for the experimentator UI.
+        """
+        pending = self.get_pending()
+        if len(pending) == 0:
+            return 'All trials saved'
+        running = len([flush for flush in pending if flush['state'] == self.RUNNING])
+        nbytes = sum(flush['nbytes'] for flush in pending)
+        return f'Saving {len(pending)} trial(s) ({running} running, {nbytes / 1e6:.0f} MB)'
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting new flushes, and waits for the pending ones to be done.
+        """
+        pending = len(self.pending)
+        if pending > 0 and wait:
+            print(f"Waiting for {pending} trial flush(es) to be done")
+        self.executor.shutdown(wait=wait)
+        if len(self.failed) > 0:
+            print(f"WARNING: the following trial flushes failed : {self.failed}")
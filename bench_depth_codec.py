@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from rgbd.DepthStorage import ChunkedDepthFormat, ChunkedDepthReader, write_depth_file, read_depth_dataframe
+
+
+def synthetic_depth_maps(nb_frames, resolution, seed=0):
+    """
+    Generates depth maps looking like a recording: a slanted table, a moving hand-sized blob, sensor noise and holes.
+    """
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    background = 600 + 0.5 * y + 0.1 * x
+    depth_maps = []
+    for i in range(nb_frames):
+        cx = width * (0.3 + 0.4 * i / max(nb_frames - 1, 1))
+        cy = height * 0.5
+        blob = 150 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * (0.05 * width) ** 2))
+        depth = background - blob + rng.normal(0, 3, (height, width))
+        depth[rng.random((height, width)) < 0.02] = 0
+        depth_maps.append(depth.astype(np.uint16))
+    return depth_maps
+
+
+def bench_gzip_pickle(depth_maps, dates, folder):
+    path = os.path.join(folder, 'depth_map.gzip')
+    t = time.perf_counter()
+    depth_df = pd.DataFrame({'Depth_maps': depth_maps, 'Date': dates})
+    depth_df['Timestamps'] = depth_df['Date'] - depth_df['Date'][0]
+    depth_df.to_pickle(path, compression='gzip')
+    encode_time = time.perf_counter() - t
+    t = time.perf_counter()
+    read_depth_dataframe(path)
+    decode_time = time.perf_counter() - t
+    return os.path.getsize(path), encode_time, decode_time
+
+
+def bench_chunked(depth_maps, dates, folder, profile, workers):
+    path = os.path.join(folder, f'depth_map_{profile}{ChunkedDepthFormat.EXTENSION}')
+    t = time.perf_counter()
+    write_depth_file(path, depth_maps, dates, profile=profile, workers=workers)
+    encode_time = time.perf_counter() - t
+    t = time.perf_counter()
+    with ChunkedDepthReader(path, workers=workers) as reader:
+        for _ in reader:
+            pass
+    decode_time = time.perf_counter() - t
+    return os.path.getsize(path), encode_time, decode_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the depth maps storage formats on size per frame, encoding and decoding speeds")
+    parser.add_argument('-i', '--input', default=None, help="Recorded depth file (.dch or .gzip), synthetic depth maps are used if not given")
+    parser.add_argument('-n', '--nb_frames', type=int, default=150, help="Number of synthetic depth maps")
+    parser.add_argument('-r', '--resolution', type=int, nargs=2, default=[1280, 720], help="Resolution of the synthetic depth maps")
+    parser.add_argument('-w', '--workers', type=int, default=2, help="Number of compression threads")
+    args = parser.parse_args()
+
+    if args.input is not None:
+        depth_df = read_depth_dataframe(args.input)
+        depth_maps = [np.asarray(depth_map, dtype=np.uint16) for depth_map in depth_df['Depth_maps']]
+        dates = depth_df['Date'].to_numpy()
+    else:
+        depth_maps = synthetic_depth_maps(args.nb_frames, args.resolution)
+        dates = np.arange(len(depth_maps)) / 30.
+    nb_frames = len(depth_maps)
+    print(f"{nb_frames} depth maps of shape {depth_maps[0].shape}, raw size {depth_maps[0].nbytes / 1e3:.1f} kB/frame")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        results['gzip pickle'] = bench_gzip_pickle(depth_maps, dates, folder)
+        for profile in ChunkedDepthFormat.PROFILES:
+            codec, level, flags = ChunkedDepthFormat.get_profile(profile)
+            results[f'{profile} (codec {codec}, level {level}, flags {flags})'] = bench_chunked(depth_maps, dates, folder, profile, args.workers)
+
+    print(f"{'format':<40}{'kB/frame':>12}{'ratio':>10}{'encode fps':>14}{'decode fps':>14}")
+    for name, (size, encode_time, decode_time) in results.items():
+        print(f"{name:<40}{size / nb_frames / 1e3:>12.1f}{depth_maps[0].nbytes * nb_frames / size:>10.2f}{nb_frames / encode_time:>14.1f}{nb_frames / decode_time:>14.1f}")
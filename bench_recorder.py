@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+import numpy as np
+from ExperimentRecorder import ExperimentRecorder
+from TrialPersistence import PersistenceExecutor
+from rgbd.FrameBuffers import FrameRingBuffer
+from rgbd.DepthStorage import ChunkedDepthFormat
+from rgbd.TrialMetadata import metadata_path, read_metadata
+
+
+def record_trials(folder, args):
+    """
+    Records trials with synthetic cameras, and returns the recording and saving durations.
+    """
+    persistence = PersistenceExecutor(workers=args.save_workers)
+    camera_options = {'jitter': args.jitter, 'drop_rate': args.drop_rate}
+    # with capture processes, the synthetic cameras run in their own process and share their frames through shared memory
+    camera_backend = 'shared_memory' if args.capture_processes else 'synthetic'
+    if args.capture_processes:
+        camera_options['capture_backend'] = 'synthetic'
+    recorders = [ExperimentRecorder(folder, device_id=f'synthetic{i}', resolution=tuple(args.resolution), fps=args.fps,
+                                    depth_profile=args.depth_profile, overflow_policy=args.overflow_policy, persistence=persistence,
+                                    camera_backend=camera_backend, camera_options=dict(camera_options, seed=i))
+                 for i in range(args.nb_cameras)]
+    for recorder in recorders:
+        recorder.init()
+    labels = []
+    t = time.perf_counter()
+    for n in range(args.nb_trials):
+        persistence.wait_for_capacity()
+        trial = SimpleNamespace(label=f'trial_{n}')
+        os.makedirs(os.path.join(folder, trial.label), exist_ok=True)
+        for recorder in recorders:
+            recorder.record_trial(trial)
+        time.sleep(args.duration)
+        for recorder in recorders:
+            recorder.stop_record()
+        labels.append(trial.label)
+        print(f"{trial.label} recorded, {persistence.get_status()}")
+    recording_time = time.perf_counter() - t
+    for recorder in recorders:
+        recorder.stop()
+    persistence.shutdown()
+    saving_time = time.perf_counter() - t - recording_time
+    return labels, recording_time, saving_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures the throughput of the whole recording and saving path with synthetic cameras")
+    parser.add_argument('-c', '--nb_cameras', type=int, default=2, help="Number of cameras")
+    parser.add_argument('-t', '--nb_trials', type=int, default=3, help="Number of trials")
+    parser.add_argument('-d', '--duration', type=float, default=5., help="Duration of each trial, in seconds")
+    parser.add_argument('-r', '--resolution', type=int, nargs=2, default=[1280, 720], help="Resolution of the frames")
+    parser.add_argument('--fps', type=float, default=30., help="Frame rate of the cameras")
+    parser.add_argument('--jitter', type=float, default=0.002, help="Standard deviation of the frames delivery delay, in seconds")
+    parser.add_argument('--drop_rate', type=float, default=0., help="Probability for a camera to drop a frame")
+    parser.add_argument('--depth_profile', choices=ChunkedDepthFormat.PROFILES, default=ChunkedDepthFormat.BALANCED, help="Compression profile of the depth maps")
+    parser.add_argument('--overflow_policy', choices=[FrameRingBuffer.BLOCK, FrameRingBuffer.DROP_OLDEST, FrameRingBuffer.DROP_NEWEST],
+                        default=FrameRingBuffer.DROP_NEWEST, help="Policy of the frame buffers when the writers fall behind")
+    parser.add_argument('--capture_processes', action='store_true', help="Run each camera in its own capture process")
+    parser.add_argument('--save_workers', type=int, default=2, help="Number of trials saved concurrently")
+    parser.add_argument('-o', '--output', default=None, help="Folder of the recordings, a temporary folder is used if not given")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        folder = args.output if args.output is not None else tmp_folder
+        os.makedirs(folder, exist_ok=True)
+        labels, recording_time, saving_time = record_trials(folder, args)
+
+        print(f"{'trial':<12}{'camera':<14}{'rgb captured':>14}{'rgb dropped':>13}{'depth captured':>16}{'depth dropped':>15}{'written MB':>12}")
+        totals = np.zeros(4, dtype=int)
+        for label in labels:
+            metadata = read_metadata(metadata_path(os.path.join(folder, label), label))
+            for device_id, camera_metadata in metadata.groupby('device_id'):
+                counts = np.array([camera_metadata['rgb_ts'].notna().sum(), (camera_metadata['rgb_dropped'] == True).sum(),
+                                   camera_metadata['depth_ts'].notna().sum(), (camera_metadata['depth_dropped'] == True).sum()])
+                totals += counts
+                size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(folder, label)) if entry.is_file() and f'_cam_{device_id}_' in entry.name)
+                print(f"{label:<12}{device_id:<14}{counts[0]:>14}{counts[1]:>13}{counts[2]:>16}{counts[3]:>15}{size / 1e6:>12.1f}")
+
+    written_frames = totals[0] - totals[1] + totals[2] - totals[3]
+    print(f"Recorded {args.nb_trials} trial(s) of {args.duration:.1f} s with {args.nb_cameras} camera(s) in {recording_time:.1f} s, saving finished {saving_time:.1f} s later")
+    print(f"Written {written_frames} frames ({written_frames / (recording_time + saving_time):.1f} frames/s), dropped {totals[1]} rgb frames and {totals[3]} depth maps")
@@ -0,0 +1,265 @@
+import threading
+import numpy as np
+from rgbd.CameraTelemetry import CameraTelemetry
+from rgbd.FrameBuffers import FramePool
+
+
+class RgbdFrame:
+    """
+    Rgb frame and depth map delivered together by a camera, with their timestamps and sequence numbers.
+
+    The arrays are pooled buffers retained for the frame: they stay valid until release() is called, after which
+    the camera may reuse them. A frame can be used as a context manager to release it.
+
+    Args:
+        rgb_ref (Optional[PooledFrame]): The retained rgb frame.
+        depth_ref (Optional[PooledFrame]): The retained depth map.
+        rgb_timestamp (float): Timestamp of the rgb frame, in seconds.
+        depth_timestamp (float): Timestamp of the depth map, in seconds.
+        rgb_seq (int): Sequence number of the rgb frame on the camera.
+        depth_seq (int): Sequence number of the depth map on the camera.
+    """
+    __slots__ = ('rgb_ref', 'depth_ref', 'rgb_timestamp', 'depth_timestamp', 'rgb_seq', 'depth_seq')
+
+    def __init__(self, rgb_ref, depth_ref, rgb_timestamp, depth_timestamp, rgb_seq, depth_seq):
+        self.rgb_ref = rgb_ref
+        self.depth_ref = depth_ref
+        self.rgb_timestamp = rgb_timestamp
+        self.depth_timestamp = depth_timestamp
+        self.rgb_seq = rgb_seq
+        self.depth_seq = depth_seq
+
+    @property
+    def rgb(self):
+        return self.rgb_ref.array if self.rgb_ref is not None else None
+
+    @property
+    def depth(self):
+        return self.depth_ref.array if self.depth_ref is not None else None
+
+    @property
+    def complete(self):
+        """
+        Returns:
+            bool: Whether both the rgb frame and the depth map are available.
+        """
+        return self.rgb_ref is not None and self.depth_ref is not None and self.rgb_timestamp != 0 and self.depth_timestamp != 0
+
+    def release(self):
+        for ref in [self.rgb_ref, self.depth_ref]:
+            if ref is not None:
+                ref.release()
+        self.rgb_ref = None
+        self.depth_ref = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class RgbdCameraBase:
+    """
+    Frame publication and threading model shared by all the cameras: a device, a recorded trial, generated frames or
+    shared memory rings.
+
+    Each source runs its collection tasks in threads, started by start() and joined by stop(). The tasks publish the frames
+    as pooled buffers with publish_rgb() and publish_depth(): the last rgb frame and depth map are kept with their timestamps and
+    sequence numbers, their telemetry is recorded, and the consumers waiting for a new frame are notified. Consumers read them
+    with get_frame() (RgbdFrame), or with wait_for_next() and get_last_frames() (tuples).
+
+    Args:
+        device_id (str): Id of the camera.
+        resolution (Tuple[int, int]): Resolution (width, height) of the rgb frames.
+        pool_size (int, optional): Initial number of buffers of each pool. Defaults to 4.
+    """
+    def __init__(self, device_id, resolution, pool_size=4):
+        self.device_id = device_id
+        self.resolution = (int(resolution[0]), int(resolution[1]))
+        self.running = False
+        self.rgb_encoding = None
+        # post-processing of the depth maps on the device, if any
+        self.depth_postprocessing = None
+        self.frame_condition = threading.Condition()
+        # frames are copied into reused buffers, instead of a new array per frame
+        self.rgb_pool = FramePool(pool_size, np.uint8, name=f'{device_id} rgb')
+        self.depth_pool = FramePool(pool_size, np.uint16, name=f'{device_id} depth')
+        self.rgb_ref = None
+        self.depth_ref = None
+        self.telemetry = CameraTelemetry(device_id)
+        self.threads = []
+        self.reset_frames()
+
+    def reset_frames(self):
+        for ref in [self.rgb_ref, self.depth_ref]:
+            if ref is not None:
+                ref.release()
+        self.rgb_ref = None
+        self.depth_ref = None
+        self.rgb_frame = None
+        self.depth_frame = None
+        self.current_rgb_timestamp = 0
+        self.current_depth_timestamp = 0
+        self.rgb_seq = 0
+        self.depth_seq = 0
+
+    def publish_rgb(self, rgb_ref, timestamp, sequence_num=None, latency=None):
+        """
+        Publishes an rgb frame, whose reference is handed over to the camera.
+
+        Args:
+            rgb_ref (PooledFrame): The frame.
+            timestamp (float): Timestamp of the frame, in seconds.
+            sequence_num (int, optional): Sequence number of the frame on the source, to detect dropped frames. Defaults to None.
+            latency (float, optional): Time from the capture of the frame to its publication, in seconds. Defaults to None.
+        """
+        self.telemetry.record_frame(CameraTelemetry.RGB, timestamp, latency=latency, sequence_num=sequence_num)
+        with self.frame_condition:
+            previous_ref = self.rgb_ref
+            self.rgb_ref = rgb_ref
+            self.rgb_frame = rgb_ref.array
+            self.current_rgb_timestamp = timestamp
+            self.rgb_seq += 1
+            self.frame_condition.notify_all()
+        if previous_ref is not None:
+            previous_ref.release()
+
+    def publish_depth(self, depth_ref, timestamp, sequence_num=None, latency=None):
+        """
+        Publishes a depth map, whose reference is handed over to the camera. See publish_rgb.
+        """
+        self.telemetry.record_frame(CameraTelemetry.DEPTH, timestamp, latency=latency, sequence_num=sequence_num)
+        with self.frame_condition:
+            previous_ref = self.depth_ref
+            self.depth_ref = depth_ref
+            self.depth_frame = depth_ref.array
+            self.current_depth_timestamp = timestamp
+            self.depth_seq += 1
+            self.frame_condition.notify_all()
+        if previous_ref is not None:
+            previous_ref.release()
+
+    def get_frame(self, last_frame=None, timeout=None):
+        """
+        Waits for a frame more recent than the last one read, on either stream.
+
+        Args:
+            last_frame (RgbdFrame, optional): The last frame read by the consumer. Defaults to None (any frame).
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to None.
+        Returns:
+            Optional[RgbdFrame]: The frame, which the consumer must release, None if the timeout expired or the camera was stopped.
+        """
+        last_rgb_seq, last_depth_seq = (last_frame.rgb_seq, last_frame.depth_seq) if last_frame is not None else (0, 0)
+        with self.frame_condition:
+            new_frame = self.frame_condition.wait_for(lambda: self.rgb_seq != last_rgb_seq or self.depth_seq != last_depth_seq or not self.running, timeout)
+            if not new_frame or not self.running:
+                return None
+            frame = RgbdFrame(self.rgb_ref.retain() if self.rgb_ref is not None else None, self.depth_ref.retain() if self.depth_ref is not None else None,
+                              self.current_rgb_timestamp, self.current_depth_timestamp, self.rgb_seq, self.depth_seq)
+        if frame.complete:
+            self.check_frames(frame.rgb, frame.depth, frame.rgb_timestamp, frame.depth_timestamp)
+        return frame
+
+    def get_last_frames(self):
+        """
+        Returns:
+            Tuple[bool, np.ndarray, np.ndarray, float, float]: The success status, the last rgb and depth frames and their timestamps.
+        """
+        with self.frame_condition:
+            rgb_frame, depth_frame = self.rgb_frame, self.depth_frame
+            rgb_timestamp, depth_timestamp = self.current_rgb_timestamp, self.current_depth_timestamp
+        return self.check_frames(rgb_frame, depth_frame, rgb_timestamp, depth_timestamp)
+
+    def wait_for_next(self, last_rgb_seq=0, last_depth_seq=0, timeout=None, retain=False):
+        """
+        Waits until a frame more recent than the given sequence numbers is available, on either stream.
+        Each consumer keeps track of the sequence numbers it has already seen, so that it wakes up exactly once per new frame.
+        Frames are pooled buffers, reused once newer frames arrived: a consumer holding them for longer retains them.
+
+        Args:
+            last_rgb_seq (int, optional): Sequence number of the last rgb frame seen by the consumer. Defaults to 0.
+            last_depth_seq (int, optional): Sequence number of the last depth frame seen by the consumer. Defaults to 0.
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to None.
+            retain (bool, optional): Whether to return the frames as retained PooledFrame, which the consumer must release. Defaults to False.
+        Returns:
+            Tuple[bool, np.ndarray, np.ndarray, float, float, int, int]: The success status, the last rgb and depth frames, their timestamps and their sequence numbers.
+        """
+        with self.frame_condition:
+            new_frame = self.frame_condition.wait_for(lambda: self.rgb_seq != last_rgb_seq or self.depth_seq != last_depth_seq or not self.running, timeout)
+            rgb_frame, depth_frame = self.rgb_frame, self.depth_frame
+            if retain:
+                rgb_frame = self.rgb_ref.retain() if self.rgb_ref is not None else None
+                depth_frame = self.depth_ref.retain() if self.depth_ref is not None else None
+            rgb_timestamp, depth_timestamp = self.current_rgb_timestamp, self.current_depth_timestamp
+            rgb_seq, depth_seq = self.rgb_seq, self.depth_seq
+        if not new_frame or not self.running:
+            return False, rgb_frame, depth_frame, rgb_timestamp, depth_timestamp, rgb_seq, depth_seq
+        arrays = (rgb_frame.array if retain and rgb_frame is not None else rgb_frame, depth_frame.array if retain and depth_frame is not None else depth_frame)
+        success = self.check_frames(*arrays, rgb_timestamp, depth_timestamp)[0]
+        return success, rgb_frame, depth_frame, rgb_timestamp, depth_timestamp, rgb_seq, depth_seq
+
+    def check_frames(self, rgb_frame, depth_frame, rgb_timestamp, depth_timestamp):
+        """
+        Checks the frames read by a consumer, and records their skew.
+
+        Returns:
+            Tuple[bool, np.ndarray, np.ndarray, float, float]: The success status, the frames and their timestamps.
+        """
+        if rgb_frame is None or depth_frame is None or rgb_timestamp == 0 or depth_timestamp == 0:
+            return False, rgb_frame, depth_frame, rgb_timestamp, depth_timestamp
+        self.telemetry.record_skew(rgb_timestamp, depth_timestamp)
+        return True, rgb_frame, depth_frame, rgb_timestamp, depth_timestamp
+
+    def add_packet_listener(self, listener):
+        raise ValueError(f'{type(self).__name__} does not output encoded packets')
+
+    def remove_packet_listener(self, listener):
+        pass
+
+    def get_collection_tasks(self):
+        """
+        Returns:
+            List[Callable[[], None]]: The functions run in the collection threads, until the camera is stopped.
+        """
+        raise NotImplementedError
+
+    def close_source(self):
+        """
+        Releases the source of the frames when the camera is stopped, before the collection threads are joined:
+        a task blocked on the source must return.
+        """
+        pass
+
+    def start(self):
+        self.reset_frames()
+        self.telemetry.reset()
+        self.running = True
+        self.threads = [threading.Thread(target=task, name=f'{self.device_id} {task.__name__}') for task in self.get_collection_tasks()]
+        for thread in self.threads:
+            thread.start()
+
+    def end_of_stream(self):
+        """
+        Called by a collection task when its source has no frame left: the camera stops and the consumers are woken up.
+        """
+        self.running = False
+        with self.frame_condition:
+            self.frame_condition.notify_all()
+
+    def stop(self):
+        self.running = False
+        # wake up the consumers waiting for a frame
+        with self.frame_condition:
+            self.frame_condition.notify_all()
+        self.close_source()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.threads = []
+
+    def is_on(self):
+        return self.running
+
+    def get_device_data(self):
+        return {'resolution': self.resolution}
@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+
+class RollingHistogram:
+    """
+    Distribution of the last values of a measure, in a fixed amount of memory.
+
+    The last window values are kept in a circular buffer, from which the statistics and the histogram are computed
+    when they are queried. The total number of values is also counted.
+
+    Args:
+        window (int, optional): Number of values kept. Defaults to 1024.
+    """
+    def __init__(self, window=1024):
+        if window < 1:
+            raise ValueError(f'window must be a positive integer, got {window}')
+        self.values = np.zeros(int(window), dtype=np.float64)
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def get_values(self):
+        """
+        Returns:
+            np.ndarray: The values of the window, in no particular order.
+        """
+        return self.values[:min(self.count, len(self.values))].copy()
+
+    def get_stats(self):
+        """
+        Returns:
+            Dict: The total number of values, and the mean, standard deviation, minimum, median, 95th and 99th percentiles and maximum of the window.
+        """
+        values = self.get_values()
+        if len(values) == 0:
+            return {'count': self.count}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {'count': self.count, 'mean': float(values.mean()), 'std': float(values.std()), 'min': float(values.min()),
+                'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(values.max())}
+
+    def histogram(self, bins=20, range=None):
+        """
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The counts and the bin edges of the values of the window, see np.histogram.
+        """
+        return np.histogram(self.get_values(), bins=bins, range=range)
+
+
+class CameraTelemetry:
+    """
+    Performance metrics of a camera, updated by its collection threads and queryable at any time.
+
+    Rolling histograms hold the interval between frames, the latency from the device to the host and the skew between
+    rgb and depth frames, in ms. Counters hold the frames received and the frames dropped on the link (detected from
+    gaps in the sequence numbers of the device), and gauges hold the last value of a measure, such as the depth of a queue.
+    Snapshots of the metrics can be exported periodically to a CSV or JSON lines file, so that the health of the cameras
+    can be followed during a session without printing each frame.
+
+    Args:
+        device_id (str): Id of the camera.
+        window (int, optional): Number of values kept by each histogram. Defaults to 1024.
+    """
+    RGB = 'rgb'
+    DEPTH = 'depth'
+
+    def __init__(self, device_id, window=1024):
+        self.device_id = device_id
+        self.window = window
+        self.lock = threading.Lock()
+        self.export_thread = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+            self.last_timestamps = {}
+            self.last_sequence_nums = {}
+            self.start_time = time.time()
+
+    def add(self, name, value):
+        """
+        Adds a value to a rolling histogram, created on first use.
+        """
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = RollingHistogram(self.window)
+            self.histograms[name].add(value)
+
+    def increment(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def record_frame(self, stream, timestamp, latency=None, sequence_num=None):
+        """
+        Records a frame received from the camera.
+
+        Args:
+            stream (str): 'rgb' or 'depth'.
+            timestamp (float): Device timestamp of the frame, in seconds.
+            latency (float, optional): Time between the capture of the frame and its reception by the host, in seconds. Defaults to None.
+            sequence_num (int, optional): Sequence number of the frame on the device, to detect the frames dropped. Defaults to None.
+        """
+        last_timestamp = self.last_timestamps.get(stream)
+        if last_timestamp is not None and timestamp > last_timestamp:
+            self.add(f'{stream}_interval_ms', (timestamp - last_timestamp) * 1000)
+        self.last_timestamps[stream] = timestamp
+        if latency is not None:
+            self.add(f'{stream}_latency_ms', latency * 1000)
+        self.increment(f'{stream}_frames')
+        if sequence_num is not None:
+            last_sequence_num = self.last_sequence_nums.get(stream)
+            if last_sequence_num is not None and sequence_num > last_sequence_num + 1:
+                self.increment(f'{stream}_dropped', sequence_num - last_sequence_num - 1)
+            self.last_sequence_nums[stream] = sequence_num
+
+    def record_skew(self, rgb_timestamp, depth_timestamp):
+        """
+        Records the time between an rgb frame and the depth map used with it.
+        """
+        self.add('skew_ms', (depth_timestamp - rgb_timestamp) * 1000)
+
+    def get_fps(self, stream):
+        """
+        Returns:
+            Optional[float]: The mean frame rate of a stream over the last frames.
+        """
+        with self.lock:
+            histogram = self.histograms.get(f'{stream}_interval_ms')
+            values = histogram.get_values() if histogram is not None else []
+        return 1000. / float(np.mean(values)) if len(values) > 0 else None
+
+    def snapshot(self):
+        """
+        Returns:
+            Dict: The current metrics, as a flat dictionary : the time, the device id, the frame rates, the statistics of each histogram
+                ('<histogram>_<statistic>'), the counters and the gauges.
+        """
+        snapshot = {'time': time.time(), 'device_id': self.device_id, 'uptime': time.time() - self.start_time}
+        for stream in [self.RGB, self.DEPTH]:
+            snapshot[f'{stream}_fps'] = self.get_fps(stream)
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                for key, value in histogram.get_stats().items():
+                    snapshot[f'{name}_{key}'] = value
+            snapshot.update(sorted(self.counters.items()))
+            snapshot.update(sorted(self.gauges.items()))
+        return snapshot
+
+    def summary(self):
+        """
+        Returns:
+            str: A one line summary of the metrics, for the logs.
+        """
+        snapshot = self.snapshot()
+        parts = [f"{self.device_id}"]
+        for stream in [self.RGB, self.DEPTH]:
+            fps = snapshot.get(f'{stream}_fps')
+            if fps is not None:
+                parts.append(f"{stream} {fps:.1f} fps, {snapshot.get(f'{stream}_dropped', 0)} dropped")
+            if f'{stream}_latency_ms_p95' in snapshot:
+                parts.append(f"{stream} latency p95 {snapshot[f'{stream}_latency_ms_p95']:.1f} ms")
+        if 'skew_ms_p95' in snapshot:
+            parts.append(f"skew p50 {snapshot['skew_ms_p50']:.1f} ms, p95 {snapshot['skew_ms_p95']:.1f} ms")
+        return ' | '.join(parts)
+
+    def export(self, path):
+        """
+        Appends a snapshot of the metrics to a file, as a JSON line if its extension is .json or .jsonl, as a CSV row otherwise.
+        Metrics are created on first use: when a snapshot has metrics missing from the columns of a CSV file, the file is
+        rewritten with the new columns, left empty in the previous rows.
+        """
+        snapshot = self.snapshot()
+        if os.path.splitext(path)[1] in ('.json', '.jsonl'):
+            with open(path, 'a') as f:
+                f.write(json.dumps(snapshot) + '\n')
+            return
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            columns = list(snapshot.keys())
+            with open(path, 'w') as f:
+                f.write(','.join(columns) + '\n')
+        else:
+            with open(path, 'r') as f:
+                lines = f.read().splitlines()
+            columns = lines[0].split(',')
+            new_columns = [column for column in snapshot.keys() if column not in columns]
+            if len(new_columns) > 0:
+                padding = ',' * len(new_columns)
+                rows = [line + padding for line in lines[1:]]
+                columns += new_columns
+                with open(path, 'w') as f:
+                    f.write('\n'.join([','.join(columns)] + rows) + '\n')
+        with open(path, 'a') as f:
+            f.write(','.join('' if snapshot.get(column) is None else str(snapshot.get(column)) for column in columns) + '\n')
+
+    def start_export(self, path, interval=10.):
+        """
+        Exports a snapshot of the metrics every interval seconds, until stop_export() is called.
+
+        Args:
+            path (str): Path of the CSV or JSON lines file.
+            interval (float, optional): Time between two snapshots, in seconds. Defaults to 10.
+        """
+        self.stop_export()
+        self.export_stop = threading.Event()
+        self.export_thread = threading.Thread(target=self.export_task, args=(path, interval, self.export_stop), daemon=True)
+        self.export_thread.start()
+
+    def export_task(self, path, interval, stop_event):
+        stopped = False
+        while not stopped:
+            stopped = stop_event.wait(interval)
+            try:
+                self.export(path)
+            except OSError as e:
+                print(f"Failed to export the telemetry of {self.device_id} to {path} : {e}")
+
+    def stop_export(self):
+        """
+        Stops the periodic export, after a last snapshot.
+        """
+        if self.export_thread is not None:
+            self.export_stop.set()
+            self.export_thread.join()
+            self.export_thread = None
@@ -0,0 +1,265 @@
+import cv2
+import numpy as np
+
+
+class DepthMapper:
+    """
+    Maps rgb pixel coordinates to depth map coordinates, when the depth map is aligned with the rgb camera but
+    has a different resolution.
+
+    The mapping of each rgb column and row is computed once, as lookup tables, so that a depth map never needs
+    to be resized: only the pixels actually read are looked up. The nearest depth pixel is used, so that the
+    depths of the foreground and the background are never blended on their edges.
+
+    Args:
+        depth_shape (Tuple[int, int]): Shape (height, width) of the depth maps.
+        rgb_resolution (Tuple[int, int]): Resolution (width, height) of the rgb frames.
+    """
+    _mappers = {}
+
+    def __init__(self, depth_shape, rgb_resolution):
+        self.depth_shape = (int(depth_shape[0]), int(depth_shape[1]))
+        self.rgb_resolution = (int(rgb_resolution[0]), int(rgb_resolution[1]))
+        depth_height, depth_width = self.depth_shape
+        rgb_width, rgb_height = self.rgb_resolution
+        self.cols = np.minimum(((np.arange(rgb_width) + 0.5) * depth_width / rgb_width).astype(np.intp), depth_width - 1)
+        self.rows = np.minimum(((np.arange(rgb_height) + 0.5) * depth_height / rgb_height).astype(np.intp), depth_height - 1)
+        self.identity = self.depth_shape == (rgb_height, rgb_width)
+
+    @classmethod
+    def get(cls, depth_shape, rgb_resolution):
+        """
+        Returns:
+            DepthMapper: The mapper between the given depth shape and rgb resolution, built once and shared.
+        """
+        key = (tuple(depth_shape[:2]), tuple(rgb_resolution))
+        if key not in cls._mappers:
+            cls._mappers[key] = cls(*key)
+        return cls._mappers[key]
+
+    def to_depth(self, x, y):
+        """
+        Returns:
+            Tuple[int, int]: The depth map coordinates (column, row) of an rgb pixel, clipped to the image.
+        """
+        rgb_width, rgb_height = self.rgb_resolution
+        return self.cols[min(max(int(x), 0), rgb_width - 1)], self.rows[min(max(int(y), 0), rgb_height - 1)]
+
+    def roi(self, depth_map, xmin, ymin, xmax, ymax):
+        """
+        Reads a region of the depth map, in rgb coordinates.
+
+        Returns:
+            np.ndarray: The depths of the region, with one value per rgb pixel.
+        """
+        if self.identity:
+            return depth_map[ymin:ymax, xmin:xmax]
+        return depth_map[np.ix_(self.rows[ymin:ymax], self.cols[xmin:xmax])]
+
+    def align(self, depth_map):
+        """
+        Returns:
+            np.ndarray: The whole depth map, at the rgb resolution.
+        """
+        if self.identity:
+            return depth_map
+        return depth_map[np.ix_(self.rows, self.cols)]
+
+
+class AlignedDepth:
+    """
+    Depth map at its native resolution, read in rgb coordinates.
+
+    It behaves as the depth map resized at the rgb resolution for reading regions (depth[ymin:ymax, xmin:xmax]) and for its
+    shape, while only the pixels read are looked up. The whole aligned depth map is only built when a consumer needs it (display,
+    recording, numpy functions), and then kept.
+
+    Args:
+        depth_map (np.ndarray): The depth map, at its native resolution.
+        rgb_resolution (Tuple[int, int]): Resolution (width, height) of the rgb frames.
+    """
+    def __init__(self, depth_map, rgb_resolution):
+        self.native = depth_map
+        self.mapper = DepthMapper.get(depth_map.shape, rgb_resolution)
+        self._aligned = None
+
+    @property
+    def shape(self):
+        return (self.mapper.rgb_resolution[1], self.mapper.rgb_resolution[0]) + self.native.shape[2:]
+
+    @property
+    def dtype(self):
+        return self.native.dtype
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    def __getitem__(self, key):
+        if self._aligned is None and isinstance(key, tuple) and len(key) == 2 and all(isinstance(k, slice) and k.step in (None, 1) for k in key):
+            rows, cols = key
+            ymin, ymax, _ = rows.indices(self.shape[0])
+            xmin, xmax, _ = cols.indices(self.shape[1])
+            return self.mapper.roi(self.native, xmin, ymin, max(xmin, xmax), max(ymin, ymax))
+        return self.aligned()[key]
+
+    def value_at(self, x, y):
+        """
+        Returns:
+            The depth at an rgb pixel.
+        """
+        col, row = self.mapper.to_depth(x, y)
+        return self.native[row, col]
+
+    def aligned(self):
+        """
+        Returns:
+            np.ndarray: The whole depth map, at the rgb resolution.
+        """
+        if self._aligned is None:
+            self._aligned = self.mapper.align(self.native)
+        return self._aligned
+
+    def __array__(self, dtype=None, copy=None):
+        aligned = self.aligned()
+        return aligned.astype(dtype) if dtype is not None else aligned
+
+
+def aligned_array(depth_map):
+    """
+    Returns:
+        Optional[np.ndarray]: The depth map as an array at the rgb resolution, whether it is an AlignedDepth or already an array.
+    """
+    if isinstance(depth_map, AlignedDepth):
+        return depth_map.aligned()
+    return depth_map
+
+
+class DepthSampler:
+    """
+    Mean depths of many regions of a depth map, with the depths outside the valid range ignored.
+
+    The sums and counts of the valid depths are computed as integral images over the bounding rectangle of the regions of a
+    query, and kept with the sampler: the mean depth of each region is then read in constant time, and later queries inside
+    an integrated rectangle do not read the depth map again. Querying the 21 landmarks of a hand costs a single pass over
+    the hand, instead of one pass per landmark, while a whole-frame integral image would cost more than all the landmarks
+    of a frame. A single region outside the integrated rectangles is averaged directly. A sampler is meant to be built once
+    per depth map, and shared by all its queries.
+
+    Regions are given in rgb coordinates. When the depth map is an AlignedDepth, they are mapped to the depth map at its
+    native resolution, to the nearest depth pixels: the mean depths are then those of the native pixels covered by the regions.
+
+    Args:
+        depth_map (np.ndarray or AlignedDepth): The depth map, aligned with the rgb frame.
+        thres_low (int, optional): Depths up to this value are ignored, in mm. Defaults to 50.
+        thres_high (int, optional): Depths from this value are ignored, in mm. Defaults to 3000.
+    """
+    # depth types accepted by cv2.integral
+    _INTEGRAL_DTYPES = [np.uint8, np.uint16, np.int16, np.float32, np.float64]
+
+    def __init__(self, depth_map, thres_low=50, thres_high=3000):
+        self.depth_map = depth_map
+        if isinstance(depth_map, AlignedDepth):
+            self.native = depth_map.native
+            self.mapper = depth_map.mapper
+        else:
+            self.native = np.asarray(depth_map)
+            self.mapper = None
+        self.thres_low = thres_low
+        self.thres_high = thres_high
+        # (xmin, ymin, xmax, ymax, sums, counts) of the rectangles already integrated, in depth map coordinates
+        self.integrals = []
+
+    @property
+    def shape(self):
+        if self.mapper is not None:
+            return (self.mapper.rgb_resolution[1], self.mapper.rgb_resolution[0])
+        return self.native.shape[:2]
+
+    def to_native(self, boxes):
+        """
+        Args:
+            boxes (np.ndarray): Regions (xmin, ymin, xmax, ymax) in rgb coordinates, as an (N, 4) array.
+        Returns:
+            np.ndarray: The regions in depth map coordinates, clipped to the depth map.
+        """
+        height, width = self.shape
+        xmin, ymin, xmax, ymax = (np.clip(boxes[:, i], 0, size) for i, size in enumerate([width, height, width, height]))
+        if self.mapper is None or self.mapper.identity:
+            return np.stack([xmin, ymin, xmax, ymax], axis=1)
+        empty = (xmax <= xmin) | (ymax <= ymin)
+        native_boxes = np.stack([self.mapper.cols[np.minimum(xmin, width - 1)], self.mapper.rows[np.minimum(ymin, height - 1)],
+                                 self.mapper.cols[np.maximum(xmax - 1, 0)] + 1, self.mapper.rows[np.maximum(ymax - 1, 0)] + 1], axis=1)
+        native_boxes[empty] = 0
+        return native_boxes
+
+    def means(self, boxes):
+        """
+        Args:
+            boxes (np.ndarray): Regions (xmin, ymin, xmax, ymax) in rgb coordinates, as an (N, 4) array. Regions are clipped to the image.
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The mean valid depth of each region, 0 if it has no valid depth, and its number of valid depths.
+        """
+        boxes = self.to_native(np.asarray(boxes, dtype=np.intp).reshape(-1, 4))
+        means = np.zeros(len(boxes))
+        counts = np.zeros(len(boxes), dtype=np.intp)
+        filled = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+        if not filled.any():
+            return means, counts
+        boxes = boxes[filled]
+        x0, y0, _, _, sums, valid_counts = self.integral(boxes)
+        xmin, ymin, xmax, ymax = (boxes[:, i] - offset for i, offset in enumerate([x0, y0, x0, y0]))
+        box_sums = sums[ymax, xmax] - sums[ymin, xmax] - sums[ymax, xmin] + sums[ymin, xmin]
+        box_counts = valid_counts[ymax, xmax] - valid_counts[ymin, xmax] - valid_counts[ymax, xmin] + valid_counts[ymin, xmin]
+        means[filled] = np.divide(box_sums, box_counts, out=np.zeros(len(boxes)), where=box_counts > 0)
+        counts[filled] = box_counts
+        return means, counts
+
+    def find_integral(self, boxes):
+        """
+        Returns:
+            Optional[Tuple]: The integrated rectangle containing all the regions (in depth map coordinates), None if there is none.
+        """
+        x0, y0, x1, y1 = boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()
+        for integral in self.integrals:
+            if integral[0] <= x0 and integral[1] <= y0 and x1 <= integral[2] and y1 <= integral[3]:
+                return integral
+        return None
+
+    def integral(self, boxes):
+        """
+        Returns:
+            Tuple: The integrated rectangle containing all the regions (in depth map coordinates), integrated on first use.
+        """
+        integral = self.find_integral(boxes)
+        if integral is not None:
+            return integral
+        x0, y0, x1, y1 = boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()
+        region = self.native[y0:y1, x0:x1]
+        valid = (self.thres_low < region) & (region < self.thres_high)
+        # integral images have an extra first row and column of zeros: the sum of region[y0:y1, x0:x1] is read at the 4 corners
+        values = np.where(valid, region, 0)
+        if values.dtype not in DepthSampler._INTEGRAL_DTYPES:
+            values = values.astype(np.float64)
+        integral = (x0, y0, x1, y1, cv2.integral(values, sdepth=cv2.CV_64F), cv2.integral(valid.view(np.uint8), sdepth=cv2.CV_32S))
+        self.integrals.append(integral)
+        return integral
+
+    def mean(self, xmin, ymin, xmax, ymax):
+        """
+        Returns:
+            float: The mean valid depth of a region in rgb coordinates, 0 if it has no valid depth.
+        """
+        height, width = self.shape
+        x0, y0, x1, y1 = (min(max(int(value), 0), size) for value, size in zip([xmin, ymin, xmax, ymax], [width, height, width, height]))
+        if x1 <= x0 or y1 <= y0:
+            return 0.
+        if self.mapper is not None and not self.mapper.identity:
+            x0, y0, x1, y1 = int(self.mapper.cols[x0]), int(self.mapper.rows[y0]), int(self.mapper.cols[x1 - 1]) + 1, int(self.mapper.rows[y1 - 1]) + 1
+        for integral in self.integrals:
+            if integral[0] <= x0 and integral[1] <= y0 and x1 <= integral[2] and y1 <= integral[3]:
+                return self.means(np.array([[xmin, ymin, xmax, ymax]]))[0][0]
+        # integrating a single region would read it twice
+        region = self.native[y0:y1, x0:x1]
+        valid = region[(self.thres_low < region) & (region < self.thres_high)]
+        return float(valid.mean()) if len(valid) > 0 else 0.
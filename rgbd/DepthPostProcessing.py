@@ -0,0 +1,97 @@
+class DepthPostProcessing:
+    """
+    Post-processing of the depth maps on the device, by the StereoDepth node, as named profiles.
+
+    Filtering and decimating the depth maps on the device saves the host the cost of filtering them, and decimation
+    divides the bandwidth of the depth stream on the link by the square of its factor. Depth maps are read in rgb
+    coordinates on the host (see DepthAccess), whatever their resolution.
+
+    Settings:
+        decimation (int): Decimation factor of the depth maps, 1 to 4.
+        median (Optional[int]): Size of the median filter kernel, 0 to disable it, 3, 5 or 7, None to keep the preset one.
+        spatial (bool): Whether the spatial edge-preserving filter is enabled, which also fills small holes.
+        temporal (bool): Whether the temporal filter is enabled, which uses the previous depth maps.
+        thres_low (Optional[int]): Minimal depth kept by the threshold filter, in mm, None to disable it.
+        thres_high (Optional[int]): Maximal depth kept by the threshold filter, in mm, None to disable it.
+        subpixel (Optional[bool]): Whether subpixel disparity is enabled, None to keep the preset one.
+    """
+    RAW = 'raw'
+    LIGHT = 'light'
+    FILTERED = 'filtered'
+    DECIMATED = 'decimated'
+    # the threshold range is the one used by StereoInference.calc_spatials on the host
+    PROFILES = {RAW: {'decimation': 1, 'median': None, 'spatial': False, 'temporal': False, 'thres_low': None, 'thres_high': None, 'subpixel': None},
+                LIGHT: {'decimation': 1, 'median': 5, 'spatial': False, 'temporal': False, 'thres_low': 50, 'thres_high': 3000, 'subpixel': False},
+                FILTERED: {'decimation': 1, 'median': 5, 'spatial': True, 'temporal': True, 'thres_low': 50, 'thres_high': 3000, 'subpixel': True},
+                DECIMATED: {'decimation': 2, 'median': 5, 'spatial': True, 'temporal': True, 'thres_low': 50, 'thres_high': 3000, 'subpixel': False}}
+    DECIMATION_FACTORS = [1, 2, 3, 4]
+    MEDIAN_KERNELS = [None, 0, 3, 5, 7]
+    # rows of the recording parameters csv : the profile, and optional overrides of its settings
+    PROFILE_PARAMETER = 'depth_postprocessing'
+    PARAMETER_PREFIX = 'depth_'
+
+    @staticmethod
+    def get_settings(profile=RAW, **overrides):
+        """
+        Args:
+            profile (str, optional): Name of the profile. Defaults to 'raw', the preset of the StereoDepth node only.
+            **overrides: Settings replacing those of the profile.
+        Returns:
+            Dict: The settings, with the name of the profile.
+        Raises:
+            ValueError: If the profile or a setting is invalid.
+        """
+        if profile not in DepthPostProcessing.PROFILES:
+            raise ValueError(f'profile must be one of {list(DepthPostProcessing.PROFILES.keys())}, got {profile}')
+        settings = dict(DepthPostProcessing.PROFILES[profile])
+        for key, value in overrides.items():
+            if key not in settings:
+                raise ValueError(f'Unknown depth post-processing setting {key}, expected one of {list(settings.keys())}')
+            settings[key] = value
+        if settings['decimation'] not in DepthPostProcessing.DECIMATION_FACTORS:
+            raise ValueError(f"decimation must be one of {DepthPostProcessing.DECIMATION_FACTORS}, got {settings['decimation']}")
+        if settings['median'] not in DepthPostProcessing.MEDIAN_KERNELS:
+            raise ValueError(f"median must be one of {DepthPostProcessing.MEDIAN_KERNELS}, got {settings['median']}")
+        if settings['thres_low'] is not None and settings['thres_high'] is not None and settings['thres_low'] >= settings['thres_high']:
+            raise ValueError(f"thres_low must be lower than thres_high, got {settings['thres_low']} and {settings['thres_high']}")
+        settings['profile'] = profile
+        return settings
+
+    @staticmethod
+    def from_recording_parameters(recording_parameters):
+        """
+        Reads the settings from the recording parameters: an optional 'depth_postprocessing' row with the name of the profile,
+        and optional rows overriding its settings, e.g. 'depth_decimation' or 'depth_thres_high'.
+
+        Args:
+            recording_parameters (Dict[str, List[str]]): The recording parameters, as read from the csv.
+        Returns:
+            Dict: The settings, see get_settings.
+        """
+        profile = (recording_parameters.get(DepthPostProcessing.PROFILE_PARAMETER) or [None])[0] or DepthPostProcessing.RAW
+        overrides = {}
+        for key, default in DepthPostProcessing.PROFILES[DepthPostProcessing.RAW].items():
+            values = recording_parameters.get(DepthPostProcessing.PARAMETER_PREFIX + key)
+            if values is not None and len(values) > 0 and values[0] != '':
+                overrides[key] = DepthPostProcessing.parse_value(key, values[0])
+        return DepthPostProcessing.get_settings(profile, **overrides)
+
+    @staticmethod
+    def parse_value(key, value):
+        if value in ('None', 'none'):
+            return None
+        if key in ('spatial', 'temporal', 'subpixel'):
+            return value in ('1', 'True', 'true', 'yes')
+        return int(value)
+
+    @staticmethod
+    def to_recording_info(settings):
+        """
+        Returns:
+            Dict: The settings as rows of the recording info of a trial, 'depth_postprocessing' for the profile and 'depth_<setting>' for the settings.
+        """
+        info = {DepthPostProcessing.PROFILE_PARAMETER: settings['profile']}
+        for key, value in settings.items():
+            if key != 'profile':
+                info[DepthPostProcessing.PARAMETER_PREFIX + key] = value
+        return info
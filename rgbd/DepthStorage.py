@@ -0,0 +1,477 @@
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ChunkedDepthFormat:
+    """
+    Layout of the chunked depth container.
+
+    The container starts with a file header, followed by chunks appended one after the other.
+    Each chunk is self-describing: a chunk header, the timestamps of its frames and the compressed
+    frames. Next to the container, an index file gets one entry appended per chunk, pointing to the
+    chunk offset and to the frames it holds. The index can always be rebuilt by scanning the container.
+
+    Frames are stored losslessly as uint16. Before compression, each frame of a chunk can be replaced by its
+    difference to the previous frame (delta flag, the first frame of a chunk is kept as is so that chunks
+    are decoded independently), and the low and high bytes of the pixels can be grouped (shuffle flag).
+    """
+    EXTENSION = '.dch'
+    INDEX_EXTENSION = '.idx'
+    FILE_MAGIC = b'DCHK'
+    CHUNK_MAGIC = b'CHNK'
+    VERSION = 2
+    # magic, version
+    FILE_HEADER = struct.Struct('<4sH')
+    # magic, first frame, number of frames, height, width, codec, flags, payload size
+    CHUNK_HEADER = struct.Struct('<4sIIHHBBQ')
+    # chunk offset, first frame, number of frames
+    INDEX_ENTRY = struct.Struct('<QII')
+
+    CODEC_RAW = 0
+    CODEC_ZLIB = 1
+    CODEC_LZ4 = 2
+    CODEC_ZSTD = 3
+
+    FLAG_DELTA = 1
+    FLAG_SHUFFLE = 2
+
+    # compression profiles, from the cheapest to encode to the smallest files
+    FAST = 'fast'
+    BALANCED = 'balanced'
+    ARCHIVE = 'archive'
+    PROFILES = {FAST: {'codec': CODEC_LZ4, 'level': 0, 'flags': FLAG_SHUFFLE},
+                BALANCED: {'codec': CODEC_ZSTD, 'level': 3, 'flags': FLAG_DELTA | FLAG_SHUFFLE},
+                ARCHIVE: {'codec': CODEC_ZSTD, 'level': 10, 'flags': FLAG_DELTA | FLAG_SHUFFLE}}
+    # zlib levels used when lz4 or zstandard are not installed
+    ZLIB_LEVELS = {FAST: 1, BALANCED: 6, ARCHIVE: 9}
+
+    @staticmethod
+    def index_path(path):
+        return path + ChunkedDepthFormat.INDEX_EXTENSION
+
+    @staticmethod
+    def get_profile(profile):
+        """
+        Returns the codec, compression level and flags of a profile, falling back to zlib if its codec is not installed.
+
+        Args:
+            profile (str): 'fast', 'balanced' or 'archive'.
+        Returns:
+            Tuple[int, int, int]: The codec, the compression level and the flags.
+        """
+        if profile not in ChunkedDepthFormat.PROFILES:
+            raise ValueError(f'profile must be one of {list(ChunkedDepthFormat.PROFILES.keys())}, got {profile}')
+        settings = ChunkedDepthFormat.PROFILES[profile]
+        codec = settings['codec']
+        if (codec == ChunkedDepthFormat.CODEC_LZ4 and lz4_frame is None) or (codec == ChunkedDepthFormat.CODEC_ZSTD and zstandard is None):
+            return ChunkedDepthFormat.CODEC_ZLIB, ChunkedDepthFormat.ZLIB_LEVELS[profile], settings['flags']
+        return codec, settings['level'], settings['flags']
+
+
+def encode_frames(frames, codec, level, flags):
+    """
+    Encodes a stack of depth maps into a chunk payload.
+
+    Args:
+        frames (np.ndarray): The depth maps, of shape (n_frames, height, width) and dtype uint16.
+        codec (int): The compression codec.
+        level (int): The compression level.
+        flags (int): The delta and shuffle flags.
+    Returns:
+        bytes: The payload.
+    """
+    data = frames
+    if flags & ChunkedDepthFormat.FLAG_DELTA and len(frames) > 1:
+        # uint16 differences wrap around, which is undone exactly by the cumulative sum at decoding
+        data = np.empty_like(frames)
+        data[0] = frames[0]
+        np.subtract(frames[1:], frames[:-1], out=data[1:])
+    if flags & ChunkedDepthFormat.FLAG_SHUFFLE:
+        payload = np.ascontiguousarray(data.reshape(-1).view(np.uint8).reshape(-1, 2).T).tobytes()
+    else:
+        payload = data.tobytes()
+    if codec == ChunkedDepthFormat.CODEC_ZLIB:
+        return zlib.compress(payload, level)
+    elif codec == ChunkedDepthFormat.CODEC_LZ4:
+        return lz4_frame.compress(payload, compression_level=level)
+    elif codec == ChunkedDepthFormat.CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(payload)
+    elif codec != ChunkedDepthFormat.CODEC_RAW:
+        raise ValueError(f'Unknown depth codec {codec}')
+    return payload
+
+
+def decode_frames(payload, codec, flags, n_frames, shape):
+    """
+    Decodes a chunk payload into a stack of depth maps.
+
+    Args:
+        payload (bytes): The payload.
+        codec (int): The compression codec.
+        flags (int): The delta and shuffle flags.
+        n_frames (int): The number of frames of the chunk.
+        shape (Tuple[int, int]): The shape of a frame.
+    Returns:
+        np.ndarray: The depth maps, of shape (n_frames, height, width) and dtype uint16.
+    """
+    if codec == ChunkedDepthFormat.CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    elif codec == ChunkedDepthFormat.CODEC_LZ4:
+        if lz4_frame is None:
+            raise ValueError('lz4 is required to read this depth file')
+        payload = lz4_frame.decompress(payload)
+    elif codec == ChunkedDepthFormat.CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError('zstandard is required to read this depth file')
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec != ChunkedDepthFormat.CODEC_RAW:
+        raise ValueError(f'Unknown depth codec {codec}')
+    if flags & ChunkedDepthFormat.FLAG_SHUFFLE:
+        data = np.frombuffer(payload, dtype=np.uint8).reshape(2, -1).T.copy().view(np.uint16)
+    else:
+        data = np.frombuffer(payload, dtype=np.uint16)
+    data = data.reshape((n_frames,) + tuple(shape))
+    if flags & ChunkedDepthFormat.FLAG_DELTA:
+        data = np.cumsum(data, axis=0, dtype=np.uint16)
+    return data
+
+
+class ChunkedDepthWriter:
+    """
+    Writes depth maps to disk in compressed chunks of a fixed number of frames, while they are being recorded.
+    Chunks are compressed by a pool of worker threads, and written in order as soon as they are ready.
+
+    Args:
+        path (str): Path of the container file.
+        chunk_size (int, optional): Number of frames per chunk. Defaults to 30.
+        profile (str, optional): Compression profile, 'fast', 'balanced' or 'archive'. Defaults to 'balanced'.
+        workers (int, optional): Number of compression threads, 0 to compress in the calling thread. Defaults to 2.
+    """
+    def __init__(self, path, chunk_size=30, profile=ChunkedDepthFormat.BALANCED, workers=2):
+        if chunk_size < 1:
+            raise ValueError(f'chunk_size must be a positive integer, got {chunk_size}')
+        self.path = path
+        self.chunk_size = int(chunk_size)
+        self.profile = profile
+        self.codec, self.level, self.flags = ChunkedDepthFormat.get_profile(profile)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        # chunks being compressed, in recording order
+        self.pending = deque()
+        # chunk arrays are recycled once their chunk is written
+        self.free_chunks = []
+        self.file = open(path, 'wb')
+        self.index_file = open(ChunkedDepthFormat.index_path(path), 'wb')
+        self.file.write(ChunkedDepthFormat.FILE_HEADER.pack(ChunkedDepthFormat.FILE_MAGIC, ChunkedDepthFormat.VERSION))
+        self.chunk = None
+        self.frame_shape = None
+        self.chunk_timestamps = np.zeros(self.chunk_size, dtype=np.float64)
+        self.chunk_count = 0
+        self.frame_count = 0
+        self.written_frame_count = 0
+
+    def write(self, depth_map, timestamp):
+        """
+        Adds a depth map to the current chunk, and sends the chunk to compression once it is full.
+
+        Args:
+            depth_map (np.ndarray): The depth map (uint16).
+            timestamp (float): The timestamp of the depth map.
+        """
+        if self.frame_shape is None:
+            self.frame_shape = depth_map.shape
+        elif depth_map.shape != self.frame_shape:
+            raise ValueError(f'depth map of shape {depth_map.shape} does not match the shape of the recording {self.frame_shape}')
+        if self.chunk is None:
+            self.chunk = self.free_chunks.pop() if len(self.free_chunks) > 0 else np.empty((self.chunk_size,) + self.frame_shape, dtype=np.uint16)
+        np.copyto(self.chunk[self.chunk_count], depth_map, casting='unsafe')
+        self.chunk_timestamps[self.chunk_count] = timestamp
+        self.chunk_count += 1
+        if self.chunk_count == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the pending frames to compression as a chunk, and writes the chunks already compressed.
+        """
+        if self.chunk_count > 0:
+            frames = self.chunk[:self.chunk_count]
+            if self.executor is None:
+                payload = encode_frames(frames, self.codec, self.level, self.flags)
+            else:
+                payload = self.executor.submit(encode_frames, frames, self.codec, self.level, self.flags)
+            self.pending.append((self.frame_count, self.chunk_count, self.chunk_timestamps[:self.chunk_count].copy(), self.chunk, payload))
+            self.frame_count += self.chunk_count
+            self.chunk_count = 0
+            self.chunk = None
+        # the backlog of chunks is bounded, so that a slow disk or codec slows the recording down instead of filling the memory
+        self.write_pending(wait=len(self.pending) > 2 * max(self.workers, 1))
+
+    def write_pending(self, wait=False, all=False):
+        """
+        Writes the compressed chunks to disk, in order.
+
+        Args:
+            wait (bool, optional): Whether to wait for the oldest chunk to be compressed. Defaults to False.
+            all (bool, optional): Whether to wait for all the chunks to be compressed. Defaults to False.
+        """
+        while len(self.pending) > 0:
+            first_frame, n_frames, timestamps, chunk, payload = self.pending[0]
+            if isinstance(payload, Future):
+                if not (payload.done() or wait or all):
+                    break
+                payload = payload.result()
+            self.pending.popleft()
+            wait = False
+            offset = self.file.tell()
+            height, width = self.frame_shape
+            self.file.write(ChunkedDepthFormat.CHUNK_HEADER.pack(ChunkedDepthFormat.CHUNK_MAGIC, first_frame, n_frames,
+                                                                 height, width, self.codec, self.flags, len(payload)))
+            self.file.write(timestamps.tobytes())
+            self.file.write(payload)
+            self.file.flush()
+            self.index_file.write(ChunkedDepthFormat.INDEX_ENTRY.pack(offset, first_frame, n_frames))
+            self.index_file.flush()
+            self.written_frame_count += n_frames
+            self.free_chunks.append(chunk)
+
+    def close(self):
+        """
+        Writes the last (incomplete) chunk and closes the files.
+        """
+        self.flush()
+        self.write_pending(all=True)
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.file.close()
+        self.index_file.close()
+        print(f"{self.frame_count} depth maps saved at {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ChunkedDepthReader:
+    """
+    Reads depth maps from a chunked depth container.
+
+    Args:
+        path (str): Path of the container file.
+        workers (int, optional): Number of threads decoding the chunks ahead when iterating over the depth maps. Defaults to 2.
+    """
+    def __init__(self, path, workers=2):
+        self.path = path
+        self.workers = workers
+        self.file = open(path, 'rb')
+        self.file_lock = threading.Lock()
+        magic, version = ChunkedDepthFormat.FILE_HEADER.unpack(self.file.read(ChunkedDepthFormat.FILE_HEADER.size))
+        if magic != ChunkedDepthFormat.FILE_MAGIC:
+            raise ValueError(f'{path} is not a chunked depth file')
+        if version > ChunkedDepthFormat.VERSION:
+            raise ValueError(f'{path} was written with a newer version of the format ({version})')
+        self.chunks = self.read_index()
+        self.first_frames = np.array([chunk['first_frame'] for chunk in self.chunks], dtype=np.int64)
+        self.nb_frames = sum(chunk['n_frames'] for chunk in self.chunks)
+        self.cached_chunk_index = None
+        self.cached_chunk = None
+    def read_index(self):
+        """
+        Reads the chunks index, or rebuilds it by scanning the container if the index file is missing or incomplete.
+
+        Returns:
+            List[Dict]: The offset, header and timestamps of each chunk.
+        """
+        index_path = ChunkedDepthFormat.index_path(self.path)
+        offsets = None
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            entry_size = ChunkedDepthFormat.INDEX_ENTRY.size
+            entries = [ChunkedDepthFormat.INDEX_ENTRY.unpack_from(data, i) for i in range(0, len(data) - entry_size + 1, entry_size)]
+            offsets = [entry[0] for entry in entries]
+        chunks = self.scan(offsets)
+        return chunks
+
+    def scan(self, offsets=None):
+        """
+        Reads the chunk headers, at the given offsets or by walking through the whole container.
+
+        Args:
+            offsets (List[int], optional): Offsets of the chunks. Defaults to None (scan the container).
+        Returns:
+            List[Dict]: The offset, header and timestamps of each complete chunk.
+        """
+        file_size = os.fstat(self.file.fileno()).st_size
+        chunks = []
+        offset = ChunkedDepthFormat.FILE_HEADER.size
+        scanning = offsets is None
+        offsets = iter(offsets) if offsets is not None else None
+        while True:
+            if not scanning:
+                offset = next(offsets, None)
+                if offset is None:
+                    # the index may miss the last chunks if the recording was interrupted
+                    offset = chunks[-1]['end'] if len(chunks) > 0 else ChunkedDepthFormat.FILE_HEADER.size
+                    scanning = True
+            if offset + ChunkedDepthFormat.CHUNK_HEADER.size > file_size:
+                break
+            self.file.seek(offset)
+            magic, first_frame, n_frames, height, width, codec, flags, payload_size = ChunkedDepthFormat.CHUNK_HEADER.unpack(self.file.read(ChunkedDepthFormat.CHUNK_HEADER.size))
+            end = offset + ChunkedDepthFormat.CHUNK_HEADER.size + 8 * n_frames + payload_size
+            if magic != ChunkedDepthFormat.CHUNK_MAGIC or end > file_size:
+                # truncated or corrupted chunk, the following data cannot be trusted
+                break
+            timestamps = np.frombuffer(self.file.read(8 * n_frames), dtype=np.float64)
+            chunks.append({'offset': offset, 'end': end, 'first_frame': first_frame, 'n_frames': n_frames,
+                           'shape': (height, width), 'codec': codec, 'flags': flags, 'payload_size': payload_size,
+                           'timestamps': timestamps})
+            offset = end
+        return chunks
+
+    def decode_chunk(self, chunk_index):
+        """
+        Decodes all the frames of a chunk.
+
+        Args:
+            chunk_index (int): Index of the chunk.
+        Returns:
+            np.ndarray: The frames of the chunk, of shape (n_frames, height, width).
+        """
+        chunk = self.chunks[chunk_index]
+        with self.file_lock:
+            self.file.seek(chunk['offset'] + ChunkedDepthFormat.CHUNK_HEADER.size + 8 * chunk['n_frames'])
+            payload = self.file.read(chunk['payload_size'])
+        return decode_frames(payload, chunk['codec'], chunk['flags'], chunk['n_frames'], chunk['shape'])
+
+    def read_chunk(self, chunk_index):
+        """
+        Decodes all the frames of a chunk. The last decoded chunk is cached.
+
+        Args:
+            chunk_index (int): Index of the chunk.
+        Returns:
+            np.ndarray: The frames of the chunk, of shape (n_frames, height, width).
+        """
+        if chunk_index == self.cached_chunk_index:
+            return self.cached_chunk
+        frames = self.decode_chunk(chunk_index)
+        self.cached_chunk_index = chunk_index
+        self.cached_chunk = frames
+        return frames
+
+    def __len__(self):
+        return self.nb_frames
+
+    def __getitem__(self, frame_index):
+        if frame_index < 0:
+            frame_index += self.nb_frames
+        if frame_index < 0 or frame_index >= self.nb_frames:
+            raise IndexError(f'depth map {frame_index} out of range ({self.nb_frames} frames)')
+        chunk_index = int(np.searchsorted(self.first_frames, frame_index, side='right')) - 1
+        return self.read_chunk(chunk_index)[frame_index - self.chunks[chunk_index]['first_frame']]
+
+    def __iter__(self):
+        if self.workers <= 1:
+            for chunk_index in range(len(self.chunks)):
+                for frame in self.read_chunk(chunk_index):
+                    yield frame
+            return
+        # the next chunks are decoded while the current one is consumed
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            decoding = deque()
+            next_chunk = 0
+            while next_chunk < len(self.chunks) or len(decoding) > 0:
+                while next_chunk < len(self.chunks) and len(decoding) < 2 * self.workers:
+                    decoding.append(executor.submit(self.decode_chunk, next_chunk))
+                    next_chunk += 1
+                for frame in decoding.popleft().result():
+                    yield frame
+
+    def get_timestamps(self):
+        """
+        Returns:
+            np.ndarray: The timestamps of all the depth maps.
+        """
+        if len(self.chunks) == 0:
+            return np.zeros(0, dtype=np.float64)
+        return np.concatenate([chunk['timestamps'] for chunk in self.chunks])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_depth_dataframe(path):
+    """
+    Loads depth maps as a dataframe with 'Depth_maps', 'Date' and 'Timestamps' columns,
+    from a chunked depth container or from a legacy gzip-pickled dataframe.
+
+    Args:
+        path (str): Path of the depth file.
+    Returns:
+        pd.DataFrame: The depth maps and their timestamps.
+    """
+    if not path.endswith(ChunkedDepthFormat.EXTENSION):
+        return pd.read_pickle(path, compression='gzip')
+    with ChunkedDepthReader(path) as reader:
+        dates = reader.get_timestamps()
+        depth_maps = [frame for frame in reader]
+    depth_df = pd.DataFrame({'Depth_maps': depth_maps, 'Date': dates})
+    depth_df['Timestamps'] = depth_df['Date'] - (dates[0] if len(dates) > 0 else 0.)
+    return depth_df
+
+
+def read_depth_timestamps(path):
+    """
+    Loads the timestamps of the depth maps only, as the 'Timestamps' column of read_depth_dataframe. They are read from the
+    chunk index of a chunked depth container, without decoding the depth maps.
+
+    Args:
+        path (str): Path of the depth file.
+    Returns:
+        np.ndarray: The timestamps, relative to the first depth map.
+    """
+    if not path.endswith(ChunkedDepthFormat.EXTENSION):
+        return pd.read_pickle(path, compression='gzip')['Timestamps'].to_numpy()
+    with ChunkedDepthReader(path) as reader:
+        dates = reader.get_timestamps()
+    return dates - (dates[0] if len(dates) > 0 else 0.)
+
+
+def write_depth_file(path, depth_maps, dates, chunk_size=30, profile=ChunkedDepthFormat.BALANCED, workers=2):
+    """
+    Saves a sequence of depth maps in a chunked depth container.
+
+    Args:
+        path (str): Path of the container file.
+        depth_maps (Iterable[np.ndarray]): The depth maps.
+        dates (Iterable[float]): The timestamps of the depth maps.
+        chunk_size (int, optional): Number of frames per chunk. Defaults to 30.
+        profile (str, optional): Compression profile, 'fast', 'balanced' or 'archive'. Defaults to 'balanced'.
+        workers (int, optional): Number of compression threads. Defaults to 2.
+    """
+    with ChunkedDepthWriter(path, chunk_size=chunk_size, profile=profile, workers=workers) as writer:
+        for depth_map, date in zip(depth_maps, dates):
+            writer.write(depth_map, date)
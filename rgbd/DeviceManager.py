@@ -0,0 +1,138 @@
+import concurrent.futures
+import os
+import time
+import depthai as dai
+import numpy as np
+from rgbd.RgbdCameras2 import SimpleRgbdCam
+
+
+class CalibrationCache:
+    """
+    Calibration of the cameras (cam_data : resolution, intrinsics matrix and hfov of the rgb camera), saved on disk
+    by device id and resolution, so that it is read from a device only the first time it is used.
+
+    Args:
+        path (str, optional): Folder of the cache. Defaults to DEFAULT_PATH.
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'rgbd_calibration')
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+
+    def file_path(self, device_id, resolution):
+        return os.path.join(self.path, f'{device_id}_{int(resolution[0])}_{int(resolution[1])}_calib.npz')
+
+    def load(self, device_id, resolution):
+        """
+        Returns:
+            Optional[Dict]: The cached cam_data of the device at the given resolution, None if it was never cached.
+        """
+        file_path = self.file_path(device_id, resolution)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with np.load(file_path) as cached:
+                return {'resolution': tuple(int(x) for x in cached['resolution']),
+                        'matrix': cached['matrix'],
+                        'hfov': float(cached['hfov'])}
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Calibration cache {file_path} could not be read ({e}), it is read from the device")
+            return None
+
+    def save(self, device_id, cam_data):
+        file_path = self.file_path(device_id, cam_data['resolution'])
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            np.savez(file_path, resolution=cam_data['resolution'], matrix=cam_data['matrix'], hfov=cam_data['hfov'])
+        except OSError as e:
+            print(f"Calibration of {device_id} could not be cached : {e}")
+
+    def clear(self, device_id=None):
+        """
+        Removes the cached calibrations of a device, or of all devices if device_id is None, e.g. after a recalibration.
+        """
+        if not os.path.exists(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith('_calib.npz') and (device_id is None or name.startswith(f'{device_id}_')):
+                os.remove(os.path.join(self.path, name))
+
+
+class DeviceManager:
+    """
+    Discovers the connected devices and opens their cameras concurrently.
+
+    Booting a device and starting its pipeline takes seconds, mostly spent waiting for the device. The cameras are
+    built in parallel threads, so that the startup time of a session does not grow with the number of devices.
+    Calibrations are read from the calibration cache when available.
+
+    Args:
+        calibration_cache (CalibrationCache, optional): Cache of the calibrations. Defaults to None (cache in CalibrationCache.DEFAULT_PATH).
+        refresh_calibration (bool, optional): Whether to read the calibrations from the devices and update the cache. Defaults to False.
+    """
+    def __init__(self, calibration_cache=None, refresh_calibration=False):
+        self.calibration_cache = calibration_cache if calibration_cache is not None else CalibrationCache()
+        self.refresh_calibration = refresh_calibration
+
+    @staticmethod
+    def list_devices():
+        """
+        Returns:
+            List[str]: The ids of the available devices.
+        """
+        return [device_info.getMxId() for device_info in dai.Device.getAllAvailableDevices()]
+
+    def open_camera(self, device_id, resolution=SimpleRgbdCam._720P, **camera_kwargs):
+        """
+        Opens the camera of a device, with its cached calibration if available.
+
+        Args:
+            device_id (str): Id of the device.
+            resolution (Tuple[int, int], optional): Resolution of the rgb frames. Defaults to 720P.
+            **camera_kwargs: Other arguments of SimpleRgbdCam.
+        Returns:
+            SimpleRgbdCam: The camera, with its pipeline started.
+        """
+        start = time.time()
+        calibration = None if self.refresh_calibration else self.calibration_cache.load(device_id, resolution)
+        camera = SimpleRgbdCam(device_id=device_id, resolution=resolution, calibration=calibration, **camera_kwargs)
+        if calibration is None:
+            self.calibration_cache.save(device_id, camera.get_device_data())
+        print(f"Device {device_id} opened in {time.time() - start:.1f} s{' (cached calibration)' if calibration is not None else ''}")
+        return camera
+
+    def open_cameras(self, device_ids, **camera_kwargs):
+        """
+        Opens the cameras of several devices concurrently. If a device cannot be opened, the devices already opened are closed.
+
+        Args:
+            device_ids (List[str]): Ids of the devices.
+            **camera_kwargs: Arguments of open_camera, shared by all cameras.
+        Returns:
+            Dict[str, SimpleRgbdCam]: The cameras, by device id.
+        Raises:
+            ValueError: If a device is not available.
+            The error of the first device that could not be opened.
+        """
+        available = self.list_devices()
+        missing = [device_id for device_id in device_ids if device_id not in available]
+        if len(missing) > 0:
+            raise ValueError(f'Devices {missing} are not available, found {available}')
+        start = time.time()
+        cameras = {}
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(device_ids))) as executor:
+            futures = {executor.submit(self.open_camera, device_id, **camera_kwargs): device_id for device_id in device_ids}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    cameras[futures[future]] = future.result()
+                except Exception as e:
+                    errors.append((futures[future], e))
+        if len(errors) > 0:
+            for camera in cameras.values():
+                camera.device.close()
+            device_id, error = errors[0]
+            print(f"Device {device_id} could not be opened, the other devices were closed")
+            raise error
+        print(f"{len(cameras)} devices opened in {time.time() - start:.1f} s")
+        return cameras
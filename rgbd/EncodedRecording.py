@@ -0,0 +1,331 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+
+H264 = 'H264'
+H265 = 'H265'
+CODECS = [H264, H265]
+BITSTREAM_EXTENSIONS = {H264: '.h264', H265: '.h265'}
+START_CODE = b'\x00\x00\x01'
+
+
+def iter_nal_units(data):
+    """
+    Splits an Annex-B bitstream into NAL units.
+
+    Args:
+        data (bytes): The bitstream.
+    Yields:
+        Tuple[int, int]: The start (first byte after the start code) and end offsets of each NAL unit.
+    """
+    start = data.find(START_CODE)
+    while start >= 0:
+        start += len(START_CODE)
+        next_start = data.find(START_CODE, start)
+        if next_start < 0:
+            yield start, len(data)
+            return
+        end = next_start
+        # 4 bytes start codes
+        if data[end - 1] == 0:
+            end -= 1
+        yield start, end
+        start = next_start
+
+
+def nal_type(data, offset, codec):
+    if codec == H264:
+        return data[offset] & 0x1F
+    return (data[offset] >> 1) & 0x3F
+
+
+def is_vcl(nal, codec):
+    if codec == H264:
+        return 1 <= nal <= 5
+    return nal < 32
+
+
+def is_keyframe(packet, codec):
+    """
+    Checks if an encoded packet holds an IDR/IRAP picture, from which decoding can start.
+
+    Args:
+        packet (bytes): The encoded packet.
+        codec (str): 'H264' or 'H265'.
+    Returns:
+        bool: True if the packet is a keyframe.
+    """
+    for start, end in iter_nal_units(packet):
+        if start >= end:
+            continue
+        nal = nal_type(packet, start, codec)
+        if (codec == H264 and nal == 5) or (codec == H265 and 16 <= nal <= 23):
+            return True
+    return False
+
+
+def split_access_units(data, codec):
+    """
+    Splits an Annex-B bitstream into access units (one encoded picture with its parameter sets),
+    the way they are output by the device encoder.
+
+    Args:
+        data (bytes): The bitstream.
+        codec (str): 'H264' or 'H265'.
+    Yields:
+        bytes: The encoded packets.
+    """
+    unit_start = None
+    has_picture = False
+    header_size = 1 if codec == H264 else 2
+    for start, end in iter_nal_units(data):
+        nal_start = data.rfind(START_CODE, 0, start)
+        if nal_start > 0 and data[nal_start - 1] == 0:
+            nal_start -= 1
+        if start + header_size >= end:
+            continue
+        nal = nal_type(data, start, codec)
+        if is_vcl(nal, codec):
+            # first_mb_in_slice == 0 (h264) or first_slice_segment_in_pic_flag (h265) starts a new picture
+            new_picture = data[start + header_size] & 0x80
+        else:
+            # parameter sets, delimiters and SEI precede the picture they belong to
+            new_picture = True
+        if new_picture and has_picture:
+            yield data[unit_start:nal_start]
+            unit_start = None
+            has_picture = False
+        if unit_start is None:
+            unit_start = nal_start
+        has_picture = has_picture or is_vcl(nal, codec)
+    if unit_start is not None:
+        yield data[unit_start:]
+
+
+def get_codec(path):
+    for codec, extension in BITSTREAM_EXTENSIONS.items():
+        if path.endswith(extension):
+            return codec
+    raise ValueError(f'Cannot deduce the codec of {path}, expected one of {list(BITSTREAM_EXTENSIONS.values())}')
+
+
+def packets_path(bitstream_path):
+    return os.path.splitext(bitstream_path)[0] + '_packets.csv'
+
+
+class EncodedPacket:
+    """
+    Encoded packet, exposing the same accessors as the depthai messages read from an output queue.
+    """
+    def __init__(self, data, timestamp, sequence_num):
+        self.data = data
+        self.timestamp = timestamp
+        self.sequence_num = sequence_num
+
+    def getData(self):
+        return np.frombuffer(self.data, dtype=np.uint8)
+
+    def getTimestamp(self):
+        return timedelta(seconds=self.timestamp)
+
+    def getSequenceNum(self):
+        return self.sequence_num
+
+
+class FileEncodedStream:
+    """
+    Stand-in for the encoded output queue of a device, replaying the packets of a recorded bitstream.
+    It allows to run the encoded recording path without any camera plugged.
+
+    Packets timestamps are read from the packets file written next to the bitstream if it exists,
+    otherwise they are generated at the given frame rate.
+
+    Args:
+        path (str): Path of the bitstream (.h264 or .h265).
+        fps (float, optional): Frame rate used to generate the timestamps, and to pace the packets. Defaults to 30.
+        realtime (bool, optional): Whether to deliver the packets at the recording pace. Defaults to True.
+    """
+    def __init__(self, path, fps=30., realtime=True):
+        self.path = path
+        self.codec = get_codec(path)
+        self.fps = fps
+        self.realtime = realtime
+        with open(path, 'rb') as f:
+            self.packets = list(split_access_units(f.read(), self.codec))
+        if os.path.exists(packets_path(path)):
+            self.timestamps = pd.read_csv(packets_path(path))['Date'].to_numpy()[:len(self.packets)]
+        else:
+            self.timestamps = np.arange(len(self.packets)) / fps
+        self.next_packet = 0
+        self.start_time = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.packets)
+
+    def has(self):
+        return self.next_packet < len(self.packets)
+
+    def get(self):
+        """
+        Returns:
+            Optional[EncodedPacket]: The next packet, or None once all the packets were delivered.
+        """
+        with self.lock:
+            if not self.has():
+                return None
+            index = self.next_packet
+            self.next_packet += 1
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.time() - self.timestamps[0]
+            delay = self.start_time + self.timestamps[index] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return EncodedPacket(self.packets[index], float(self.timestamps[index]), index)
+
+    def __iter__(self):
+        return iter(self.get, None)
+
+
+class EncodedStreamWriter:
+    """
+    Writes the packets output by a device encoder directly to a bitstream file, without decoding them.
+    The timestamp, size, offset and keyframe flag of each packet are saved next to the bitstream, so that
+    the bitstream can be remuxed into a container and the frames matched to the depth maps afterwards.
+
+    Args:
+        path (str): Path of the bitstream, its extension gives the codec (.h264 or .h265).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.codec = get_codec(path)
+        self.file = open(path, 'wb')
+        self.timestamps = []
+        self.sizes = []
+        self.offsets = []
+        self.keyframes = []
+
+    def write(self, packet, timestamp):
+        """
+        Appends an encoded packet to the bitstream.
+
+        Args:
+            packet (Union[bytes, np.ndarray]): The encoded packet.
+            timestamp (float): The timestamp of the frame held by the packet.
+        """
+        data = packet.tobytes() if isinstance(packet, np.ndarray) else bytes(packet)
+        self.offsets.append(self.file.tell())
+        self.file.write(data)
+        self.timestamps.append(timestamp)
+        self.sizes.append(len(data))
+        self.keyframes.append(is_keyframe(data, self.codec))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def close(self):
+        """
+        Closes the bitstream and saves the packets information.
+
+        Returns:
+            str: Path of the packets file.
+        """
+        self.file.close()
+        path_packets = packets_path(self.path)
+        pd.DataFrame({'Date': self.timestamps, 'Size': self.sizes, 'Offset': self.offsets, 'Keyframe': self.keyframes}).to_csv(path_packets, index=False)
+        nb_keyframes = sum(self.keyframes)
+        print(f"{len(self)} encoded frames ({nb_keyframes} keyframes) saved at {self.path}")
+        return path_packets
+
+
+def remux(bitstream_path, container_path, fps):
+    """
+    Copies a raw bitstream into a container (e.g. mp4 or mkv) with ffmpeg, without re-encoding it.
+
+    The container has a constant frame rate: the timestamps of the packets are only kept in the trial metadata and in the
+    packets file (see packets_path).
+
+    Args:
+        bitstream_path (str): Path of the bitstream.
+        container_path (str): Path of the container.
+        fps (float): Frame rate of the video.
+    Returns:
+        bool: True if the container was written, False if ffmpeg is not available or failed.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        print(f"ffmpeg not found, {bitstream_path} is kept as a raw bitstream")
+        return False
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-framerate', str(fps), '-i', bitstream_path, '-c', 'copy', container_path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Failed to remux {bitstream_path} : {result.stderr}")
+        return False
+    print(f"Video remuxed at {container_path}")
+    return True
+
+
+def bitstream_fps(bitstream_path, default=30.):
+    """
+    Returns:
+        float: The frame rate of a bitstream, from the timestamps of its packets file, default if they are not available.
+    """
+    path_packets = packets_path(bitstream_path)
+    if not os.path.exists(path_packets):
+        return default
+    dates = pd.read_csv(path_packets)['Date'].to_numpy()
+    intervals = np.diff(dates)
+    intervals = intervals[intervals > 0]
+    return float(1. / np.median(intervals)) if len(intervals) > 0 else default
+
+
+def remux_leftover_bitstreams(folder):
+    """
+    Remuxes the bitstreams of a trial folder that were left without container, when remuxing failed at the end of the recording.
+
+    Args:
+        folder (str): Folder of the trial.
+    Returns:
+        List[str]: The paths of the bitstreams that are still not remuxed.
+    """
+    leftovers = []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith(tuple('_video' + extension for extension in BITSTREAM_EXTENSIONS.values())):
+            continue
+        bitstream_path = os.path.join(folder, name)
+        container_path = os.path.splitext(bitstream_path)[0] + '.mp4'
+        if os.path.exists(container_path):
+            continue
+        if remux(bitstream_path, container_path, bitstream_fps(bitstream_path)):
+            os.remove(bitstream_path)
+        else:
+            print(f"WARNING : {bitstream_path} could not be remuxed, it is only readable as a raw bitstream")
+            leftovers.append(bitstream_path)
+    return leftovers
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # replays a recorded bitstream through the file-backed stream, as if it was output by a device, and records it again
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bitstream', help="Path of a .h264 or .h265 bitstream")
+    parser.add_argument('output', help="Path of the recorded bitstream")
+    parser.add_argument('--fps', type=float, default=30.)
+    parser.add_argument('--container', default=None, help="Path of the container to remux the recorded bitstream into")
+    args = parser.parse_args()
+
+    stream = FileEncodedStream(args.bitstream, fps=args.fps, realtime=False)
+    writer = EncodedStreamWriter(args.output)
+    for packet in stream:
+        writer.write(packet.getData(), packet.getTimestamp().total_seconds())
+    writer.close()
+    if args.container is not None:
+        remux(args.output, args.container, args.fps)
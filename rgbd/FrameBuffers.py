@@ -0,0 +1,283 @@
+import threading
+from collections import deque
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    Fixed-capacity ring buffer storing frames in a single preallocated slab, used as a bounded
+    single-producer single-consumer queue between a capture thread and a writer thread.
+
+    Frames are copied into the slot following the last written one, so that the memory
+    used by the buffer never grows during a recording. The slab is allocated when the first
+    frame is received (its shape is not always known before the device starts streaming) and
+    is then reused for every following recording.
+
+    When the buffer is full, the overflow policy decides what happens to the incoming frame:
+        - 'block': the producer waits for a free slot (at most block_timeout seconds, then the frame is dropped),
+        - 'drop_oldest': the oldest frame of the buffer is dropped to make room for the new one,
+        - 'drop_newest': the incoming frame is dropped.
+    Every time the buffer is found full is counted as an overrun, every frame lost is counted as dropped.
+
+    Args:
+        capacity (int): Maximum number of frames held by the buffer.
+        frame_shape (tuple, optional): Shape of a single frame. Defaults to None (deduced from the first frame).
+        dtype (np.dtype, optional): Data type of the frames. Defaults to np.uint8.
+        name (str, optional): Name of the buffer, used in messages. Defaults to 'frames'.
+        overflow (str, optional): Overflow policy. Defaults to 'drop_newest'.
+        block_timeout (float, optional): Maximum waiting time of the producer with the 'block' policy, in seconds. Defaults to 1.
+    """
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    _OVERFLOW_POLICIES = [BLOCK, DROP_OLDEST, DROP_NEWEST]
+
+    def __init__(self, capacity, frame_shape=None, dtype=np.uint8, name='frames', overflow=DROP_NEWEST, block_timeout=1.):
+        if capacity < 1:
+            raise ValueError(f'capacity must be a positive integer, got {capacity}')
+        if overflow not in self._OVERFLOW_POLICIES:
+            raise ValueError(f'overflow must be one of {self._OVERFLOW_POLICIES}')
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.name = name
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.slab = None
+        self.timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self.condition = threading.Condition()
+        self.frame_shape = None
+        if frame_shape is not None:
+            self.allocate(frame_shape)
+        self.reset()
+
+    def allocate(self, frame_shape):
+        """
+        Allocates the slab holding the frames.
+
+        Args:
+            frame_shape (tuple): Shape of a single frame.
+        """
+        self.frame_shape = tuple(int(s) for s in frame_shape)
+        self.slab = np.empty((self.capacity,) + self.frame_shape, dtype=self.dtype)
+        print(f'{self.name} ring buffer allocated: {self.capacity} frames of shape {self.frame_shape} ({self.nbytes / 1e6:.1f} MB)')
+
+    def reset(self):
+        """
+        Empties the buffer and resets the counters. The slab is kept for the next recording.
+        """
+        with self.condition:
+            self.write_count = 0
+            self.read_count = 0
+            self.overruns = 0
+            self.dropped = 0
+            self.high_water = 0
+            self.condition.notify_all()
+
+    def put(self, frame, timestamp):
+        """
+        Copies a frame into the next free slot of the buffer, applying the overflow policy if the buffer is full.
+
+        Args:
+            frame (np.ndarray): The frame to store.
+            timestamp (float): The timestamp of the frame.
+        Returns:
+            bool: True if the frame was stored, False if it was dropped.
+        Raises:
+            ValueError: If the frame does not match the shape or dtype of the buffer.
+        """
+        if self.slab is None:
+            self.allocate(frame.shape)
+        elif frame.shape != self.frame_shape:
+            raise ValueError(f'{self.name} frame of shape {frame.shape} does not fit in a buffer of shape {self.frame_shape}')
+        if frame.dtype != self.dtype:
+            raise ValueError(f'{self.name} frame of dtype {frame.dtype} does not fit in a buffer of dtype {self.dtype}')
+        with self.condition:
+            if self.write_count - self.read_count >= self.capacity:
+                self.overruns += 1
+                if self.overflow == self.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.overflow == self.DROP_OLDEST:
+                    self.read_count += 1
+                    self.dropped += 1
+                elif not self.condition.wait_for(lambda: self.write_count - self.read_count < self.capacity, self.block_timeout):
+                    self.dropped += 1
+                    return False
+            slot = self.write_count % self.capacity
+        # the slot cannot be read nor dropped before write_count is incremented
+        np.copyto(self.slab[slot], frame)
+        self.timestamps[slot] = timestamp
+        with self.condition:
+            self.write_count += 1
+            self.high_water = max(self.high_water, self.write_count - self.read_count)
+            self.condition.notify_all()
+        return True
+
+    def get(self, timeout=0., out=None):
+        """
+        Retrieves the oldest frame of the buffer, waiting for one if the buffer is empty.
+        The frame is copied out of the buffer, so the slot is immediately available for new frames.
+
+        Args:
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to 0 (no waiting).
+            out (np.ndarray, optional): Array in which the frame is copied. Defaults to None (a new array is allocated).
+        Returns:
+            Tuple[Optional[np.ndarray], Optional[float]]: The oldest frame and its timestamp, or (None, None) if the buffer is empty.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.write_count > self.read_count, timeout):
+                return None, None
+            # the copy is made while holding the lock, as the 'drop_oldest' policy may recycle this slot
+            slot = self.read_count % self.capacity
+            if out is None:
+                frame = self.slab[slot].copy()
+            else:
+                np.copyto(out, self.slab[slot])
+                frame = out
+            timestamp = float(self.timestamps[slot])
+            self.read_count += 1
+            self.condition.notify_all()
+        return frame, timestamp
+
+    def drain(self):
+        """
+        Yields the frames of the buffer, oldest first, until the buffer is empty.
+
+        Yields:
+            Tuple[np.ndarray, float]: A frame and its timestamp.
+        """
+        while True:
+            frame, timestamp = self.get()
+            if frame is None:
+                return
+            yield frame, timestamp
+
+    def __len__(self):
+        return self.write_count - self.read_count
+
+    @property
+    def nbytes(self):
+        if self.slab is None:
+            return 0
+        return self.slab.nbytes + self.timestamps.nbytes
+
+    def get_stats(self):
+        """
+        Returns:
+            Dict: The number of frames written and read, the number of overruns and dropped frames, and the maximum filling of the buffer.
+        """
+        # with the 'drop_oldest' policy, dropped frames are skipped by moving the read index forward
+        read = self.read_count - self.dropped if self.overflow == self.DROP_OLDEST else self.read_count
+        return {'written': self.write_count, 'read': read, 'overruns': self.overruns,
+                'dropped': self.dropped, 'high_water': self.high_water, 'capacity': self.capacity, 'overflow': self.overflow}
+
+
+class PooledFrame:
+    """
+    Frame held in a buffer of a FramePool, with a reference count. The buffer goes back to the pool when
+    the last reference is released.
+
+    Args:
+        array (np.ndarray): The buffer.
+        pool (FramePool, optional): The pool of the buffer. Defaults to None (the buffer is not pooled, releasing it does nothing).
+    """
+    __slots__ = ('array', 'pool', 'refs')
+
+    def __init__(self, array, pool=None):
+        self.array = array
+        self.pool = pool
+        self.refs = 0
+
+    def retain(self):
+        """
+        Adds a reference to the frame, which must be released once the frame is not used anymore.
+
+        Returns:
+            PooledFrame: The frame.
+        """
+        if self.pool is not None:
+            with self.pool.lock:
+                self.refs += 1
+        return self
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.release(self)
+
+
+class FramePool:
+    """
+    Pool of reusable frame buffers, so that the collection threads of a camera copy each frame received from the
+    device into an existing buffer instead of allocating a new array.
+
+    Free buffers are reused oldest first, so a buffer that is read without being retained is only overwritten
+    after the other free buffers of the pool. If all the buffers are in use, a new one is allocated rather than
+    blocking the collection thread, and the pool keeps it: the pool grows to the number of frames actually held.
+
+    Args:
+        size (int): Number of buffers allocated once the frame shape is known.
+        dtype (np.dtype, optional): Data type of the frames. Defaults to np.uint8.
+        name (str, optional): Name of the pool, used in messages. Defaults to 'frames'.
+    """
+    def __init__(self, size, dtype=np.uint8, name='frames'):
+        if size < 1:
+            raise ValueError(f'size must be a positive integer, got {size}')
+        self.size = int(size)
+        self.dtype = np.dtype(dtype)
+        self.name = name
+        self.lock = threading.Lock()
+        self.frame_shape = None
+        self.free = deque()
+        self.allocated = 0
+        self.exhausted = 0
+
+    def allocate(self, frame_shape):
+        # a new shape replaces the buffers, the ones still in use are not returned to the pool
+        self.frame_shape = tuple(int(s) for s in frame_shape)
+        self.free = deque(PooledFrame(np.empty(self.frame_shape, dtype=self.dtype), self) for _ in range(self.size))
+        self.allocated = self.size
+        print(f'{self.name} frame pool allocated: {self.size} frames of shape {self.frame_shape} ({self.size * self.free[0].array.nbytes / 1e6:.1f} MB)')
+
+    def acquire(self, frame_shape):
+        """
+        Takes a free buffer out of the pool, with one reference.
+
+        Args:
+            frame_shape (tuple): Shape of the frame.
+        Returns:
+            PooledFrame: The buffer, whose content is undefined.
+        """
+        with self.lock:
+            if tuple(frame_shape) != self.frame_shape:
+                self.allocate(frame_shape)
+            if len(self.free) > 0:
+                frame = self.free.popleft()
+            else:
+                self.exhausted += 1
+                self.allocated += 1
+                frame = PooledFrame(np.empty(self.frame_shape, dtype=self.dtype), self)
+            frame.refs = 1
+        return frame
+
+    def copy(self, array):
+        """
+        Returns:
+            PooledFrame: A buffer of the pool holding a copy of the array, with one reference.
+        """
+        frame = self.acquire(array.shape)
+        np.copyto(frame.array, array)
+        return frame
+
+    def release(self, frame):
+        with self.lock:
+            frame.refs -= 1
+            if frame.refs == 0 and frame.array.shape == self.frame_shape:
+                self.free.append(frame)
+
+    def get_stats(self):
+        """
+        Returns:
+            Dict: The number of buffers allocated, free and in use, and the number of times the pool had to grow.
+        """
+        with self.lock:
+            return {'allocated': self.allocated, 'free': len(self.free), 'in_use': self.allocated - len(self.free), 'exhausted': self.exhausted}
@@ -0,0 +1,173 @@
+import threading
+from collections import deque
+import numpy as np
+from rgbd.FrameBuffers import PooledFrame
+
+
+def retain(frame):
+    # pooled frames are reference counted, plain arrays are not
+    return frame.retain() if isinstance(frame, PooledFrame) else frame
+
+
+def release(frame):
+    if isinstance(frame, PooledFrame):
+        frame.release()
+
+
+class FrameSynchronizer:
+    """
+    Pairs rgb frames and depth maps received asynchronously from a camera, on the host, by device timestamp.
+
+    Both streams are kept in small buffers. Each rgb frame is paired with the depth map whose timestamp is the
+    nearest to its own, as soon as this depth map is known for sure: once a depth map more recent than the rgb
+    frame was received, as the following ones can only be further away. A pair whose skew exceeds max_skew is
+    unmatched, and handled according to the unmatched policy. The latency is bounded by max_latency: an rgb
+    frame still waiting for depth maps when a frame max_latency more recent is received is resolved with the
+    depth maps already received.
+
+    Frames can be arrays or pooled frames (PooledFrame). A pooled frame added to the synchronizer is handed over with a
+    reference, which the synchronizer releases when the frame is dropped, or hands over to the consumer with the pair:
+    the consumer releases the frames of the pairs it reads.
+
+    Args:
+        max_skew (float, optional): Maximum time between the rgb frame and the depth map of a pair, in seconds. Defaults to 0.02.
+        max_latency (float, optional): Maximum time an rgb frame waits for depth maps, in seconds of device time. Defaults to 0.1.
+        buffer_size (int, optional): Maximum number of frames kept in each stream buffer, and of pairs waiting to be read. Defaults to 8.
+        unmatched_policy (str, optional): What to do with unmatched rgb frames : 'drop' them, pair them with the
+            'nearest' depth map anyway, or output them 'rgb_only', without depth map. Defaults to 'drop'.
+    """
+    DROP = 'drop'
+    NEAREST = 'nearest'
+    RGB_ONLY = 'rgb_only'
+    _UNMATCHED_POLICIES = [DROP, NEAREST, RGB_ONLY]
+
+    def __init__(self, max_skew=0.02, max_latency=0.1, buffer_size=8, unmatched_policy=DROP):
+        if unmatched_policy not in self._UNMATCHED_POLICIES:
+            raise ValueError(f'unmatched_policy must be one of {self._UNMATCHED_POLICIES}, got {unmatched_policy}')
+        if buffer_size < 1:
+            raise ValueError(f'buffer_size must be a positive integer, got {buffer_size}')
+        self.max_skew = max_skew
+        self.max_latency = max_latency
+        self.buffer_size = int(buffer_size)
+        self.unmatched_policy = unmatched_policy
+        self.condition = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self.condition:
+            for frame, _ in getattr(self, 'rgb_frames', []):
+                release(frame)
+            for depth_map, _ in getattr(self, 'depth_maps', []):
+                release(depth_map)
+            for frame, depth_map, _, _, _ in getattr(self, 'pairs', []):
+                release(frame)
+                release(depth_map)
+            self.rgb_frames = deque()
+            self.depth_maps = deque()
+            self.pairs = deque()
+            self.skews = deque(maxlen=1000)
+            self.stats = {'pairs': 0, 'unmatched': 0, 'rgb_dropped': 0, 'depth_unused': 0, 'pairs_overwritten': 0}
+            self.last_paired_depth_timestamp = None
+
+    def add_rgb(self, frame, timestamp):
+        """
+        Adds an rgb frame, in timestamp order.
+        """
+        with self.condition:
+            self.rgb_frames.append((frame, timestamp))
+            self.resolve()
+
+    def add_depth(self, depth_map, timestamp):
+        """
+        Adds a depth map, in timestamp order.
+        """
+        with self.condition:
+            self.depth_maps.append((depth_map, timestamp))
+            if len(self.depth_maps) > self.buffer_size:
+                self.pop_depth()
+            self.resolve()
+
+    def pop_depth(self):
+        depth_map, timestamp = self.depth_maps.popleft()
+        release(depth_map)
+        if timestamp != self.last_paired_depth_timestamp:
+            self.stats['depth_unused'] += 1
+
+    def resolve(self):
+        # resolves the oldest rgb frames whose nearest depth map is known, or which waited for too long
+        while len(self.rgb_frames) > 0:
+            frame, timestamp = self.rgb_frames[0]
+            newest_depth = self.depth_maps[-1][1] if len(self.depth_maps) > 0 else None
+            newest_rgb = self.rgb_frames[-1][1]
+            decided = newest_depth is not None and newest_depth >= timestamp
+            expired = newest_rgb - timestamp > self.max_latency or len(self.rgb_frames) > self.buffer_size
+            if not decided and not expired:
+                break
+            self.rgb_frames.popleft()
+            self.pair(frame, timestamp)
+
+    def pair(self, frame, timestamp):
+        nearest = None
+        if len(self.depth_maps) > 0:
+            index = int(np.argmin([abs(depth_timestamp - timestamp) for _, depth_timestamp in self.depth_maps]))
+            # the depth maps older than the nearest one cannot be paired with the following rgb frames
+            for _ in range(index):
+                self.pop_depth()
+            nearest = self.depth_maps[0]
+        skew = nearest[1] - timestamp if nearest is not None else None
+        if skew is not None and abs(skew) <= self.max_skew:
+            self.stats['pairs'] += 1
+            self.skews.append(skew)
+            # the depth map stays in the buffer, it may be paired with the next rgb frame too
+            self.output(frame, retain(nearest[0]), timestamp, nearest[1], skew)
+            self.last_paired_depth_timestamp = nearest[1]
+            return
+        self.stats['unmatched'] += 1
+        if self.unmatched_policy == self.NEAREST and nearest is not None:
+            self.output(frame, retain(nearest[0]), timestamp, nearest[1], skew)
+            self.last_paired_depth_timestamp = nearest[1]
+        elif self.unmatched_policy == self.RGB_ONLY or (self.unmatched_policy == self.NEAREST and nearest is None):
+            self.output(frame, None, timestamp, None, skew)
+        else:
+            release(frame)
+            self.stats['rgb_dropped'] += 1
+
+    def output(self, frame, depth_map, rgb_timestamp, depth_timestamp, skew):
+        # the oldest pairs are overwritten if they are not read, the consumer always gets the most recent ones
+        if len(self.pairs) >= self.buffer_size:
+            overwritten_frame, overwritten_depth_map, _, _, _ = self.pairs.popleft()
+            release(overwritten_frame)
+            release(overwritten_depth_map)
+            self.stats['pairs_overwritten'] += 1
+        self.pairs.append((frame, depth_map, rgb_timestamp, depth_timestamp, skew))
+        self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Waits for the oldest pair that was not read yet.
+
+        Args:
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to None.
+        Returns:
+            Optional[Tuple[np.ndarray, Optional[np.ndarray], float, Optional[float], Optional[float]]]: The rgb frame,
+                the depth map, their timestamps and the skew (depth timestamp - rgb timestamp), None if the timeout expired.
+                Pooled frames are handed over to the consumer, which must release them.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.pairs) > 0, timeout):
+                return None
+            return self.pairs.popleft()
+
+    def get_stats(self):
+        """
+        Returns:
+            Dict: Counts of pairs, unmatched rgb frames, dropped rgb frames, unused depth maps and pairs overwritten before they
+                were read, and the mean, maximum and 95th percentile of the absolute skew of the last pairs, in ms.
+        """
+        with self.condition:
+            stats = dict(self.stats)
+            skews = np.abs(np.array(self.skews, dtype=np.float64)) * 1000
+        stats['skew_mean_ms'] = float(skews.mean()) if len(skews) > 0 else None
+        stats['skew_max_ms'] = float(skews.max()) if len(skews) > 0 else None
+        stats['skew_p95_ms'] = float(np.percentile(skews, 95)) if len(skews) > 0 else None
+        return stats
@@ -2,12 +2,70 @@ import depthai as dai
 import cv2
 import numpy as np
 import time
-from typing import Optional, Any, Dict, List
+from typing import Optional, Tuple
 from datetime import timedelta
-import threading
+from rgbd.DepthAccess import AlignedDepth, aligned_array
+from rgbd.EncodedRecording import H264, CODECS
+from rgbd.FrameSync import FrameSynchronizer
+from rgbd.CameraTelemetry import CameraTelemetry
+from rgbd.DepthPostProcessing import DepthPostProcessing
+from rgbd.CameraBase import RgbdCameraBase, RgbdFrame
 
 
-class SimpleRgbdCam:
+def copy_message(pool, msg, shape):
+    """
+    Copies the frame of a device message into a buffer of a pool. Raw pixels are copied straight from the message data,
+    YUV420 frames (the isp output) are converted straight into the buffer, other formats are converted first.
+
+    Args:
+        pool (FramePool): The pool.
+        msg (dai.ImgFrame): The message.
+        shape (tuple): Shape of the frame.
+    Returns:
+        PooledFrame: The frame, with one reference.
+    """
+    data = msg.getData()
+    frame = pool.acquire(shape)
+    if data.size == frame.array.nbytes:
+        np.copyto(frame.array.reshape(-1).view(np.uint8), data)
+    elif frame.array.ndim == 3 and data.size == shape[0] * shape[1] * 3 // 2:
+        height, width = shape[:2]
+        code = cv2.COLOR_YUV2BGR_NV12 if msg.getType() == dai.ImgFrame.Type.NV12 else cv2.COLOR_YUV2BGR_I420
+        cv2.cvtColor(data.reshape(height * 3 // 2, width), code, dst=frame.array)
+    else:
+        np.copyto(frame.array, msg.getCvFrame() if frame.array.ndim == 3 else msg.getFrame())
+    return frame
+
+
+def configure_stereo(stereo, settings):
+    """
+    Configures the post-processing of the depth maps on the device.
+
+    Args:
+        stereo (dai.node.StereoDepth): The stereo node, with its preset already set.
+        settings (Dict): The post-processing settings, see DepthPostProcessing.get_settings.
+    """
+    if settings['subpixel'] is not None:
+        stereo.setSubpixel(settings['subpixel'])
+    if settings['median'] is not None:
+        kernels = {0: dai.MedianFilter.MEDIAN_OFF, 3: dai.MedianFilter.KERNEL_3x3, 5: dai.MedianFilter.KERNEL_5x5, 7: dai.MedianFilter.KERNEL_7x7}
+        stereo.initialConfig.setMedianFilter(kernels[settings['median']])
+    config = stereo.initialConfig.get()
+    post_processing = config.postProcessing
+    post_processing.decimationFilter.decimationFactor = settings['decimation']
+    post_processing.decimationFilter.decimationMode = dai.RawStereoDepthConfig.PostProcessing.DecimationFilter.DecimationMode.NON_ZERO_MEDIAN
+    post_processing.spatialFilter.enable = settings['spatial']
+    post_processing.spatialFilter.holeFillingRadius = 2
+    post_processing.spatialFilter.numIterations = 1
+    post_processing.temporalFilter.enable = settings['temporal']
+    if settings['thres_low'] is not None:
+        post_processing.thresholdFilter.minRange = settings['thres_low']
+    if settings['thres_high'] is not None:
+        post_processing.thresholdFilter.maxRange = settings['thres_high']
+    stereo.initialConfig.set(config)
+
+
+class SimpleRgbdCam(RgbdCameraBase):
     _720P = (1280, 720)
     _1080P = (1920, 1080)
     _480P = (640, 480)
@@ -22,13 +80,17 @@ class SimpleRgbdCam:
                  show_depth=True,
                  show_stats=False,
                  show_fps=False,
-                 color_mode='RGB'
+                 color_mode='RGB',
+                 rgb_encoding=None,
+                 encoder_bitrate_kbps=None,
+                 preview_resolution=(640, 360),
+                 pool_size=4,
+                 calibration=None,
+                 depth_postprocessing=None
                  ):
-        self.device_id = device_id
-        self.running = False
+        super().__init__(device_id, resolution, pool_size)
         self.fps_rgb = fps_rgb
         self.fps_depth = fps_depth if fps_depth is not None else fps_rgb
-        self.resolution = (int(resolution[0]), int(resolution[1]))
         self.show_rgb = show_rgb
         self.show_depth = show_depth
         self.show_stats = show_stats
@@ -37,14 +99,32 @@ class SimpleRgbdCam:
             raise ValueError(f'color_mode must be one of {self._RGB_MODE} or {self._BGR_MODE}')
         else:
             self.color_mode = color_mode
+        # when encoding on the device, rgb frames are only low resolution previews and the full resolution
+        # stream is delivered as encoded packets to the packet listeners
+        if rgb_encoding is not None and rgb_encoding not in CODECS:
+            raise ValueError(f'rgb_encoding must be None or one of {CODECS}')
+        self.rgb_encoding = rgb_encoding
+        self.encoder_bitrate_kbps = encoder_bitrate_kbps
+        self.preview_resolution = (int(preview_resolution[0]), int(preview_resolution[1]))
+        self.packet_listeners = []
+        self.encoded_queue = None
+        # name of a DepthPostProcessing profile or settings, None for the preset of the stereo node only
+        if depth_postprocessing is None or isinstance(depth_postprocessing, str):
+            depth_postprocessing = DepthPostProcessing.get_settings(depth_postprocessing or DepthPostProcessing.RAW)
+        self.depth_postprocessing = depth_postprocessing
         
         self.build_device()
         
+        # the calibration can be given, e.g. read from the cache of the DeviceManager, instead of being read from the device
         self.cam_data = {}
         self.cam_data['resolution'] = self.resolution
-        calibData = self.device.readCalibration()
-        self.cam_data['matrix'] = np.array(calibData.getCameraIntrinsics(dai.CameraBoardSocket.RGB, self.cam_data['resolution'][0], self.cam_data['resolution'][1]))
-        self.cam_data['hfov'] = calibData.getFov(dai.CameraBoardSocket.RGB)
+        if calibration is not None:
+            self.cam_data['matrix'] = np.array(calibration['matrix'])
+            self.cam_data['hfov'] = float(calibration['hfov'])
+        else:
+            calibData = self.device.readCalibration()
+            self.cam_data['matrix'] = np.array(calibData.getCameraIntrinsics(dai.CameraBoardSocket.RGB, self.cam_data['resolution'][0], self.cam_data['resolution'][1]))
+            self.cam_data['hfov'] = calibData.getFov(dai.CameraBoardSocket.RGB)
         
     def build_device(self):
         
@@ -111,7 +191,8 @@ class SimpleRgbdCam:
         self.stereo.setDepthAlign(dai.CameraBoardSocket.CAM_A)
         self.stereo.setLeftRightCheck(True)
         self.stereo.setExtendedDisparity(False)
-        # stereo.setSubpixel(True)
+        # the depth maps are filtered and decimated on the device, before being sent to the host
+        configure_stereo(self.stereo, self.depth_postprocessing)
     
         self.stereo.left.setBlocking(self.blocking_queue)
         self.stereo.left.setQueueSize(self.queue_size)
@@ -135,7 +216,30 @@ class SimpleRgbdCam:
         depth_out.input.setBlocking(self.blocking_queue)
         depth_out.input.setQueueSize(self.queue_size)
         
-        color.isp.link(color_out.input)
+        if self.rgb_encoding is None:
+            color.isp.link(color_out.input)
+        else:
+            encoder = self.pipeline.create(dai.node.VideoEncoder)
+            if self.rgb_encoding == H264:
+                profile = dai.VideoEncoderProperties.Profile.H264_MAIN
+            else:
+                profile = dai.VideoEncoderProperties.Profile.H265_MAIN
+            encoder.setDefaultProfilePreset(self.fps_rgb, profile)
+            encoder.setKeyframeFrequency(int(self.fps_rgb))
+            if self.encoder_bitrate_kbps is not None:
+                encoder.setBitrateKbps(int(self.encoder_bitrate_kbps))
+            
+            # encoded packets cannot be dropped without corrupting the following frames, the queue is blocking
+            encoded_out = self.pipeline.create(dai.node.XLinkOut)
+            encoded_out.setStreamName("encoded")
+            encoded_out.input.setBlocking(True)
+            encoded_out.input.setQueueSize(30)
+            
+            color.setVideoSize(*self.resolution)
+            color.setPreviewSize(*self.preview_resolution)
+            color.video.link(encoder.input)
+            encoder.bitstream.link(encoded_out.input)
+            color.preview.link(color_out.input)
         monoLeft.out.link(self.stereo.left)
         monoRight.out.link(self.stereo.right)
 
@@ -146,92 +250,79 @@ class SimpleRgbdCam:
         self.device.startPipeline(self.pipeline)
         
     
-    def run(self):
-        self.rgb_frame = None
-        self.depth_frame = None
-        
-        self.running = True
-        self.current_depth_fps = 0
-        
-        
-        self.rgb_fps_list = []
-        self.depth_fps_list = []
-        self.rgb_to_depth_latency_list = []
-        
-        self.current_rgb_timestamp = 0
-        self.current_depth_timestamp = 0
-        self.rgb_thread = threading.Thread(target=self.rgb_collection_thread)
-        self.depth_thread = threading.Thread(target=self.depth_collection_thread)   
-        self.rgb_thread.start()
-        self.depth_thread.start()
+    def get_collection_tasks(self):
+        tasks = [self.rgb_collection_thread, self.depth_collection_thread]
+        if self.rgb_encoding is not None:
+            if self.encoded_queue is None:
+                self.encoded_queue = self.device.getOutputQueue("encoded", 30, True)
+            tasks.append(self.encoded_collection_thread)
+        return tasks
+    
+    def add_packet_listener(self, listener):
+        """
+        Registers a function called with each encoded rgb packet and its timestamp, from the collection thread.
+
+        Args:
+            listener (Callable[[np.ndarray, float], None]): The function to call.
+        """
+        self.packet_listeners.append(listener)
+    
+    def remove_packet_listener(self, listener):
+        if listener in self.packet_listeners:
+            self.packet_listeners.remove(listener)
+    
+    def get_message(self, queue):
+        # the queues raise once the device is closed, which ends the collection threads
+        try:
+            return queue.get()
+        except RuntimeError:
+            if self.running:
+                raise
+            return None
+    
+    def encoded_collection_thread(self):
+        print("Starting encoded RGB collection thread...")
+        while self.running:
+            packet = self.get_message(self.encoded_queue)
+            if packet is None:
+                # the file-backed stand-in has no packet left
+                break
+            data = packet.getData()
+            timestamp = packet.getTimestamp().total_seconds()
+            for listener in list(self.packet_listeners):
+                listener(data, timestamp)
     
     def rgb_collection_thread(self):
         print("Starting RGB collection thread...")
-        old_rgb_timestamp = 1 
         queue = self.device.getOutputQueue("video", self.queue_size, self.blocking_queue)  
         while self.running:
-            color_msg = queue.get()
-            self.rgb_frame = color_msg.getCvFrame()
-            self.current_rgb_timestamp = color_msg.getTimestamp().total_seconds()
-            
+            color_msg = self.get_message(queue)
+            if color_msg is None:
+                break
+            rgb_ref = copy_message(self.rgb_pool, color_msg, (color_msg.getHeight(), color_msg.getWidth(), 3))
+            self.publish_rgb(rgb_ref, color_msg.getTimestamp().total_seconds(), sequence_num=color_msg.getSequenceNum(),
+                             latency=(dai.Clock.now() - color_msg.getTimestamp()).total_seconds())
             
-            
-            if self.show_fps or self.show_stats:
-                current_rgb_fps = int(1.0 / (self.current_rgb_timestamp - old_rgb_timestamp))
-                
-            if self.show_fps:
-                print(f"RGB FPS: {current_rgb_fps}")
-            
-            if self.show_stats:
-                self.rgb_fps_list.append(current_rgb_fps)
-                
-            old_rgb_timestamp = self.current_rgb_timestamp
-            
-        
-        self.depth_thread.join()
+            if self.show_fps and self.rgb_seq % max(1, int(self.fps_rgb)) == 0:
+                print(self.telemetry.summary())
         
     def depth_collection_thread(self):
         print("Starting Depth collection thread...")
-        self.current_depth_timestamp = 0
-        self.old_depth_timestamp = 1
         self.depth_queue = self.device.getOutputQueue("depth", self.queue_size, self.blocking_queue)
         
         while self.running:
-            depth_msg = self.depth_queue.get()
-            self.depth_frame = depth_msg.getCvFrame()
-            self.current_depth_timestamp = depth_msg.getTimestamp().total_seconds()  
-            
-            if self.show_fps or self.show_stats:
-                self.current_depth_fps = int(1.0 / (self.current_depth_timestamp - self.old_depth_timestamp))
-                
-            if self.show_fps:
-                print(f"Depth FPS: {self.current_depth_fps}")
-                
-            if self.show_stats:
-                self.depth_fps_list.append(self.current_depth_fps)
-            self.old_depth_timestamp = self.current_depth_timestamp
-            # cv2.imshow("depth", depth_frame)
+            depth_msg = self.get_message(self.depth_queue)
+            if depth_msg is None:
+                break
+            depth_ref = copy_message(self.depth_pool, depth_msg, (depth_msg.getHeight(), depth_msg.getWidth()))
+            self.publish_depth(depth_ref, depth_msg.getTimestamp().total_seconds(), sequence_num=depth_msg.getSequenceNum(),
+                               latency=(dai.Clock.now() - depth_msg.getTimestamp()).total_seconds())
     
-    def get_last_frames(self):
-        
-        success = True
-        if self.rgb_frame is None or self.depth_frame is None or self.current_rgb_timestamp == 0 or self.current_depth_timestamp == 0:
-            success = False
-            return success, self.rgb_frame, self.depth_frame, self.current_rgb_timestamp, self.current_depth_timestamp
-        
-        if self.show_rgb or self.show_depth:
+    def check_frames(self, rgb_frame, depth_frame, rgb_timestamp, depth_timestamp):
+        checked = super().check_frames(rgb_frame, depth_frame, rgb_timestamp, depth_timestamp)
+        if checked[0] and (self.show_rgb or self.show_depth):
             self.show_frames()
-            
-        if self.show_fps or self.show_stats:
-            rgb_to_depth_latency = self.current_rgb_timestamp - self.current_depth_timestamp
-        
-        if self.show_fps:
-            print(f"RGB-Depth latency: {rgb_to_depth_latency*1000:.1f} ms")
-            
-        if self.show_stats:
-            self.rgb_to_depth_latency_list.append(rgb_to_depth_latency * 1000)  # storing latency in ms
-            
-        return success, self.rgb_frame, self.depth_frame, self.current_rgb_timestamp, self.current_depth_timestamp
+        return checked
     
     def show_frames(self):
         if self.show_rgb:
@@ -249,215 +340,135 @@ class SimpleRgbdCam:
             self.stop()
             
     def print_stats(self):
-        print(f"Average RGB FPS: {sum(self.rgb_fps_list) / len(self.rgb_fps_list)}")           
-        print(f"Max RGB FPS: {max(self.rgb_fps_list)}")  
-        print(f"Min RGB FPS: {min(self.rgb_fps_list)}")
-        std_rgb_fps = np.std(self.rgb_fps_list)  
-        print(f"Standard deviation RGB FPS: {std_rgb_fps}")
-        nb_frames_with_fps_below_desired_minus_std = len([fps for fps in self.rgb_fps_list if fps < self.fps_rgb - std_rgb_fps])
-        print(f"Number of frames with FPS below desired FPS minus standard deviation: {nb_frames_with_fps_below_desired_minus_std}")
-            
-        print(f"Average Depth FPS: {sum(self.depth_fps_list) / len(self.depth_fps_list)}")   
-        print(f"Max Depth FPS: {max(self.depth_fps_list)}")
-        print(f"Min Depth FPS: {min(self.depth_fps_list)}")            
-        std_depth_fps = np.std(self.depth_fps_list)
-        print(f"Standard deviation Depth FPS: {std_depth_fps}")
-        nb_depth_frames_below_threshold = len([fps for fps in self.depth_fps_list if fps < self.fps_depth - std_depth_fps])
-        print(f"Number of Depth frames below threshold minus standard deviation: {nb_depth_frames_below_threshold}")
-            
-        self.rgb_to_depth_latency_list= self.rgb_to_depth_latency_list[10:]                   
-        print(f"Average RGB-Depth latency: {sum(self.rgb_to_depth_latency_list) / len(self.rgb_to_depth_latency_list)} ms")
-        print(f"Max RGB-Depth latency: {max(self.rgb_to_depth_latency_list)} ms")
-        print(f"Min RGB-Depth latency: {min(self.rgb_to_depth_latency_list)} ms")
-            
+        print(self.telemetry.summary())
+        snapshot = self.telemetry.snapshot()
+        for stream, fps in [(CameraTelemetry.RGB, self.fps_rgb), (CameraTelemetry.DEPTH, self.fps_depth)]:
+            if f'{stream}_interval_ms_mean' not in snapshot:
+                continue
+            print(f"{stream} interval: mean {snapshot[f'{stream}_interval_ms_mean']:.1f} ms, std {snapshot[f'{stream}_interval_ms_std']:.1f} ms, "
+                  f"p99 {snapshot[f'{stream}_interval_ms_p99']:.1f} ms, max {snapshot[f'{stream}_interval_ms_max']:.1f} ms (desired {1000 / fps:.1f} ms)")
+            print(f"{stream} frames: {snapshot.get(f'{stream}_frames', 0)}, dropped: {snapshot.get(f'{stream}_dropped', 0)}")
+        if 'skew_ms_mean' in snapshot:
+            print(f"RGB-Depth skew: mean {snapshot['skew_ms_mean']:.1f} ms, min {snapshot['skew_ms_min']:.1f} ms, max {snapshot['skew_ms_max']:.1f} ms")
 
-    def start(self):
-        self.run()
+    def run(self):
+        self.start()
+    
+    def close_source(self):
+        self.device.close()
         
     def stop(self):
-        self.running = False
-        self.device.close()
+        super().stop()
         cv2.destroyAllWindows()
         if self.show_stats:
             self.print_stats()
-        
-    def is_on(self):
-        return self.running
     
     def get_device_data(self):
-        return {'resolution': (1280, 720)}
+        return self.cam_data
 
-class RgbdCamera:
+class RgbdCamera(RgbdCameraBase):
     """
-    A class to represent an RGB-D camera.
+    RGB-D camera streaming from a device, in one of four modes: rgb frames only, rgb frames and depth maps not synchronized,
+    synchronized on the host by timestamp, or synchronized by the Sync node of the device.
+
+    The frames are collected into pooled buffers by the collection threads of RgbdCameraBase, started by start() and joined by stop().
+    get_frame() returns them as an RgbdFrame, retained for the consumer, which releases it. next_frame() returns them as a tuple:
+    its arrays are the pooled buffers themselves, retained until the next call of next_frame() or until the camera is stopped.
+    Recorded videos are replayed by rgbd.SyntheticCameras.VideoReplayCam.
 
     Attributes:
-        _720P (List[float]): Resolution for 720P.
-        _1080P (List[float]): Resolution for 1080P.
-        _480P (List[float]): Resolution for 48supportedTypes: [MONO], hasAutofocus: 0, hasAutofocusIC: 0, name: right}
+        _720P (Tuple[int, int]): Resolution for 720P.
+        _1080P (Tuple[int, int]): Resolution for 1080P.
+        _480P (Tuple[int, int]): Resolution for 480P (640x360, the 1080P sensor scaled by 1/3).
         _RGB_MODE (str): RGB color mode.
         _BGR_MODE (str): BGR color mode.
-        cam_auto_mode (bool): Flag for automatic camera mode.
-        device_id (Optional[str]): Device ID.
-        replay (bool): Flag indicating whether to replay data.
-        fps (float): Frames per second.
-        resolution (List[float]): Resolution of the camera.
-        print_rgb_stereo_latency (bool): Flag indicating whether to print RGB stereo latency.
-        show_disparity (bool): Flag indicating whether to show disparity.
-        color_mode (str): Color mode.
-        cam_data (Dict): Camera data.
-        frame (Optional[np.ndarray]): Current frame.
-        new_frame (bool): Flag indicating whether a new frame is available.
-        device (dai.Device): DepthAI device.
-        lensPos (int): Lens position.
-        expTime (int): Exposure time.
-        sensIso (int): ISO sensitivity.
-        wbManual (int): Manual white balance.
-        rgb_res (dai.ColorCameraProperties.SensorResolution): RGB camera resolution.
-        mono_res (dai.MonoCameraProperties.SensorResolution): Mono camera resolution.
-        rgbQ (dai.DataOutputQueue): RGB output queue.
-        depthQ (dai.DataOutputQueue): Depth output queue.
-        cam_out (dai.node.XLinkOut): XLinkOut node for RGB camera.
-        depth_out (dai.node.XLinkOut): XLinkOut node for depth map.
-        depth_map (Optional[np.ndarray]): Current depth map.
-        timestamp (float): Timestamp of the current frame.
-        video (cv2.VideoCapture): Video capture object for replay.
-        nb_frames (int): Number of frames in the video replay.
-        current_frame_index (int): Current frame index in the video replay.
-        timestamps (List[float]): Timestamps of the frames in the video replay.
-        depth_maps (List[np.ndarray]): Depth maps of the frames in the video replay.
-        on (bool): Flag indicating whether the camera is on.
+        cam_data (Dict): Camera data (resolution, intrinsics matrix and horizontal field of view).
+        synchronizer (Optional[FrameSynchronizer]): The host synchronizer, if depth is synchronized on the host.
 
     Methods:
-        __init__(self, replay: bool = False, replay_data: Optional[Any] = None, cam_params: Optional[Dict] = None, device_id: Optional[str] = None, fps: float = 30., resolution: List[float] = _480P, print_rgb_stereo_latency: bool = False, show_disparity: bool = False, color_mode: str = _BGR_MODE) -> None:
-            Instantiate a RGB-D Camera object.
-        build_device(self) -> None:
-            Build the device and initialize camera settings.
-        create_RGB_pipeline(self) -> None:
-            Create a pipeline for the RGB camera.
-        create_stereo_pipeline(self) -> None:
-            Create a pipeline for the stereo cameras.
-        create_rgb_only_pipeline(self) -> None:
-            Create a pipeline for RGB-D cameras, but only RGB frames are captured.
-        create_rgb_depth_pipeline(self) -> None:
-            Create a pipeline for RGB-D cameras, captures RGB and depth frames asynchronously.
-        create_rgb_depth_synced_pipeline(self, max_rgb_depth_latency) -> None:
-            Create a pipeline for RGB-D cameras, captures RGB and depth frames synchronously, within a given latency tolerance.
-        load_replay(self, replay: dict) -> None:
-            Load a replay file.
-        next_frame_livestream(self) -> Tuple[bool, Optional[np.ndarray], Optional[np.ndarray]]:
-            Retrieve the next frame from the livestream.
-        next_frame_video(self) -> Tuple[bool, np.ndarray, np.ndarray]:
-            Read the next frame from the video and update the current frame, depth map, and timestamp.
-        get_depth_map(self) -> np.ndarray:
-            Get the current depth map.
-        start(self) -> None:
-            Start the RGB-D camera.
-        stop(self) -> None:
-            Stop the RGB-D camera.
-        get_res(self) -> Tuple[int, int]:
+        get_frame(last_frame, timeout) -> Optional[RgbdFrame]:
+            Waits for the next frame, retained for the consumer.
+        next_frame(timeout) -> Tuple[bool, Optional[np.ndarray], Optional[np.ndarray], Optional[float]]:
+            Reads the next frame as a tuple.
+        get_depth_map() -> Optional[np.ndarray]:
+            Get the depth map returned by the last call of next_frame.
+        get_sync_stats() -> Optional[Dict]:
+            Get the statistics of the host synchronization.
+        get_res() -> Tuple[int, int]:
             Get the resolution of the RGB-D camera.
-        get_device_data(self) -> Dict:
+        get_device_data() -> Dict:
             Get the device data of the RGB-D camera.
-        get_num_frames(self) -> int:
-            Get the total number of frames in the video replay.
-        get_timestamps(self) -> List[float]:
-            Get the timestamps of the frames in the video replay.
-        is_on(self) -> bool:
-            Check if the RGB-D camera is currently on.
-        is_on_replay(self) -> bool:
-            Check if the RGB-D camera is currently on replay mode.
     """
-    _720P = [1280., 720.]
-    _1080P = [1920., 1080.]
-    _480P = [640., 480.]
-    _480P = [640., 360.]
+    _720P = (1280, 720)
+    _1080P = (1920, 1080)
+    _480P = (640, 360)
     _RGB_MODE = 'RGB'
     _BGR_MODE = 'BGR'
     
-    def __init__(self, replay: bool = False, 
-                 replay_data: Optional[Any] = None, 
-                 cam_params: Optional[Dict] = None, 
-                 device_id: Optional[str] = None, 
+    def __init__(self, device_id: Optional[str] = None, 
                  fps: float = 30., 
-                 resolution: List[float] = _480P, 
+                 resolution: Tuple[int, int] = _480P, 
                  print_rgb_stereo_latency: bool = False, 
                  show_disparity: bool = False,
                  color_mode: str = _BGR_MODE,
                  auto_focus = True,
                  get_depth = True,
-                 sync_depth = True) -> None:
+                 sync_depth = True,
+                 host_sync = True,
+                 sync_policy: str = FrameSynchronizer.DROP) -> None:
         
         """Instantiate a RGBd Camera object.
             Args:
-                replay (bool, optional): Flag indicating whether to replay data. Defaults to False.
-                replay_data (Any, optional): Data for replaying. Defaults to None.
-                cam_params (Dict, optional): Camera parameters. Defaults to None.
                 device_id (str, optional): Device ID. Defaults to None.
                 fps (float, optional): Frames per second. Defaults to 30.0.
-                resolution (List[float], optional): Resolution of the camera. Defaults to _480P.
-                print_rgb_stereo_latency (bool, optional): Flag indicating whether to print RGB stereo latency. Defaults to False.
+                resolution (Tuple[int, int], optional): Resolution of the camera. Defaults to _480P.
+                print_rgb_stereo_latency (bool, optional): Flag indicating whether to print a summary of the telemetry of the camera (fps, latencies, rgb-depth skew) once per second. Defaults to False.
                 show_disparity (bool, optional): Flag indicating whether to show disparity. Defaults to False.
                 color_mode (str, optional): Color mode. Defaults to _BGR_MODE.
                 auto_focus (bool, optional): Flag indicating whether to use auto focus. Defaults to True.
                 get_depth (bool, optional): Flag indicating whether to get depth. Defaults to True.
                 sync_depth (bool, optional): Flag indicating whether to synchronize depth. Defaults to True.
-            Returns:
-                None
+                host_sync (bool, optional): Flag indicating whether depth is synchronized on the host by timestamp matching, rather than by the device Sync node. Defaults to True.
+                sync_policy (str, optional): Policy of the host synchronizer for rgb frames without depth map, see FrameSynchronizer. Defaults to 'drop'.
+            Raises:
+                ValueError: If the color mode is invalid.
         """
 
         print('Building RGBd Camera...')
-        self.on = False
+        if color_mode not in [self._RGB_MODE, self._BGR_MODE]:
+            raise ValueError(f'color_mode must be one of {self._RGB_MODE} or {self._BGR_MODE}')
         self.cam_auto_mode = True
-        self.device_id = device_id
-        print(f'device_id: {self.device_id}')
-        self.replay = replay
         self.fps = fps
-        self.resolution = resolution
         self.print_rgb_stereo_latency=print_rgb_stereo_latency
         self.show_disparity=show_disparity
-        if color_mode not in [self._RGB_MODE, self._BGR_MODE]:
-            raise ValueError(f'color_mode must be one of {self._RGB_MODE} or {self._BGR_MODE}')
         self.color_mode = color_mode
         self.auto_focus = auto_focus
         self.get_depth = get_depth
         self.sync_depth = sync_depth
+        self.host_sync = host_sync
+        self.synchronizer = None
+        self.last_summary_time = 0
         
-        self.rgb_fps_measured = 0
-        self.depth_fps_measured = 0
-        
-        print(f'fps: {fps}, resolution: {resolution}')
-        if self.replay :
-            if replay_data is not None:
-                self.load_replay(replay_data)
-            self.next_frame = self.next_frame_video
-            self.is_on = self.is_on_replay
-            self.cam_data = cam_params
-        else:
-            self.cam_data = {}
-            if self.get_depth:                
-                self.mono_fps = 60 # maximum fps for mono cameras, to ensure that the stereo depth node can output with minimum latency compared to the RGB camera
-                if not self.sync_depth:
-                    self.next_frame = self.next_frame_depth_livestream
-                else:
-                    self.max_rgb_depth_latency = 20 # maximum latency between RGB and depth frames
-                    self.next_frame = self.next_frame_depth_synced_livestream
-            else:
-                self.next_frame = self.next_frame_livestream
-            self.build_device()
-        self.rgb_frame = None
-        self.depth_map = None
-        self.new_frame = False
-        self.rgb_timestamp = 0
-        self.depth_timestamp = 0
-        
-        self.rgb_frames_thread = threading.Thread(target=self.collect_rgb_frames)
-        self.rgb_frames_thread.start()
         if self.get_depth:
-            self.depth_frames_thread = threading.Thread(target=self.collect_depth_frames)
-            self.depth_frames_thread.start()    
-
-        print(f'RGBd Camera built: replay={replay}')
+            self.mono_fps = 60 # maximum fps for mono cameras, to ensure that the stereo depth node can output with minimum latency compared to the RGB camera
+            if self.sync_depth:
+                self.max_rgb_depth_latency = 20 # maximum latency between RGB and depth frames
+                if self.host_sync:
+                    # frames are streamed asynchronously and paired on the host, without the latency of the device Sync node
+                    self.synchronizer = FrameSynchronizer(max_skew=self.max_rgb_depth_latency / 1000., unmatched_policy=sync_policy)
+        
+        # the host synchronizer holds frames in its buffers, which must not be reused before they are paired
+        pool_size = 4 + (2 * self.synchronizer.buffer_size if self.synchronizer is not None else 0)
+        super().__init__(device_id, resolution, pool_size)
+        print(f'device_id: {self.device_id}')
+        print(f'fps: {fps}, resolution: {self.resolution}')
+        
+        # frame returned by next_frame, retained until the next call
+        self.consumer_frame = None
+        self.frame_count = 0
+        self.cam_data = {}
+        self.build_device()
+        print('RGBd Camera built')
     
 
     def build_device(self):
@@ -478,13 +489,13 @@ class RgbdCamera:
         else:
             self.device = dai.Device(dai.DeviceInfo(self.device_id), maxUsbSpeed=dai.UsbSpeed.SUPER_PLUS)
             
-        self.cam_data['resolution'] = (int(self.resolution[0]), int(self.resolution[1]))
+        self.cam_data['resolution'] = self.resolution
         calibData = self.device.readCalibration()
         self.cam_data['matrix'] = np.array(calibData.getCameraIntrinsics(dai.CameraBoardSocket.RGB, self.cam_data['resolution'][0], self.cam_data['resolution'][1]))
         self.cam_data['hfov'] = calibData.getFov(dai.CameraBoardSocket.RGB)
         
         if self.get_depth:
-            if not self.sync_depth:
+            if not self.sync_depth or self.host_sync:
                 self.create_rgb_depth_pipeline()
             else:
                 self.create_rgb_depth_synced_pipeline(self.max_rgb_depth_latency)
@@ -682,258 +693,192 @@ class RgbdCamera:
         self.device.startPipeline(self.pipeline)
         self.synced_queue = self.device.getOutputQueue(name="xout", maxSize=self.queue_size, blocking=self.blocking_queue)
 
-    def load_replay(self, replay):
-        """
-        Load a replay file.
-
-        Parameters:
-        - replay (dict): A dictionary containing the replay information.
-
-        Raises:
-        - ValueError: If there is an error reading the video.
-
-        """
-        self.video = cv2.VideoCapture(replay['Video'])
-        self.nb_frames = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.current_frame_index = 0
-        if not self.video.isOpened():
-            raise ValueError("Error reading video")
-        self.timestamps = replay['Timestamps']
-        self.depth_maps = replay['Depth_maps']
-        
+    def get_collection_tasks(self):
+        if not self.get_depth:
+            return [self.collect_rgb_frames]
+        if self.sync_depth and not self.host_sync:
+            return [self.collect_synced_frames]
+        return [self.collect_rgb_frames, self.collect_depth_frames]
+    
+    def get_message(self, queue):
+        # the queues raise once the device is closed, which ends the collection threads
+        try:
+            return queue.get()
+        except RuntimeError:
+            if self.running:
+                raise
+            return None
+    
     def collect_rgb_frames(self):
         """
-        Collects RGB frames from the camera.
-
-        Returns:
-            None
+        Collects RGB frames from the camera, and publishes them. With host synchronization, they are also added to the synchronizer.
         """
-        old_rgb_timestamp = 1
-        
-        while True:
-            if self.on:
-                try:
-                    frame = self.rgbQ.get()
-                    self.rgb_timestamp = frame.getTimestamp().total_seconds()
-                    self.rgb_fps_measured = int(1.0 / (self.rgb_timestamp - old_rgb_timestamp))
-                    self.rgb_frame = frame.getCvFrame()
-                    self.new_frame = True
-                    old_rgb_timestamp = self.rgb_timestamp  # update old timestamp for next frame
-                except:
-                    self.rgb_frame = None
-            else:
-                time.sleep(0.05)
+        while self.running:
+            msg = self.get_message(self.rgbQ)
+            if msg is None:
+                break
+            timestamp = msg.getTimestamp().total_seconds()
+            rgb_ref = copy_message(self.rgb_pool, msg, (msg.getHeight(), msg.getWidth(), 3))
+            if self.synchronizer is not None:
+                # the synchronizer holds its own reference, released when the frame is dropped or read
+                self.synchronizer.add_rgb(rgb_ref.retain(), timestamp)
+            self.publish_rgb(rgb_ref, timestamp, sequence_num=msg.getSequenceNum(),
+                             latency=(dai.Clock.now() - msg.getTimestamp()).total_seconds())
     
     def collect_depth_frames(self):
         """
-        Collects depth frames from the camera.
-
-        Returns:
-            None
+        Collects depth frames from the camera, and publishes them. With host synchronization, they are also added to the synchronizer.
         """
-        old_depth_timestamp = 1
-        while True:
-            if self.on:
-                try:
-                    frame = self.depthQ.get()
-                    self.depth_timestamp = frame.getTimestamp().total_seconds() 
-                    self.depth_map = frame.getFrame()
-
-                    self.depth_fps_measured = int(1.0 / (self.depth_timestamp - old_depth_timestamp))
-                    old_depth_timestamp = self.depth_timestamp  # update old timestamp for next frame
-                except:
-                    self.depth_map = None
-            else:
-                time.sleep(0.05)
-        
-    def next_frame_livestream(self):
+        while self.running:
+            msg = self.get_message(self.depthQ)
+            if msg is None:
+                break
+            timestamp = msg.getTimestamp().total_seconds()
+            depth_ref = copy_message(self.depth_pool, msg, (msg.getHeight(), msg.getWidth()))
+            if self.synchronizer is not None:
+                self.synchronizer.add_depth(depth_ref.retain(), timestamp)
+            self.publish_depth(depth_ref, timestamp, sequence_num=msg.getSequenceNum(),
+                               latency=(dai.Clock.now() - msg.getTimestamp()).total_seconds())
+    
+    def collect_synced_frames(self):
         """
-        Retrieves the next frame from the livestream, without depth map.
-        Returns:
-            Tuple[bool, Optional[np.ndarray], Optional[np.ndarray]]: A tuple containing the success status, the RGB frame, and the depth map.
-                - success (bool): True if both the RGB frame and the depth map are available, False otherwise.
-                - frame (Optional[np.ndarray]): The RGB frame as a NumPy array, or None if not available.
+        Collects the RGB and depth frames synchronized by the device (at the cost of latency ~ 200ms), and publishes them.
         """
-        try:
-            r_frame = self.rgbQ.get()
-            self.rgb_timestamp = r_frame.getTimestamp().total_seconds()
-            
-        except:
-            return False, None, None, None
-        
-        if r_frame is not None:
-            frame = r_frame.getCvFrame()
-            frame = cv2.resize(frame, self.cam_data['resolution'])
-            self.rgb_frame = frame
-            self.new_frame = True
-            success = True
-        else:
-            self.rgb_frame = None
-            success = False
-            
-        
-        if success and self.print_rgb_stereo_latency:
+        while self.running:
+            frames = self.get_message(self.synced_queue)
+            if frames is None:
+                break
+            r_frame = frames['rgb']
+            d_frame = frames['depth']
+            if r_frame is None or d_frame is None:
+                continue
+            depth_ref = copy_message(self.depth_pool, d_frame, (d_frame.getHeight(), d_frame.getWidth()))
+            rgb_ref = copy_message(self.rgb_pool, r_frame, (r_frame.getHeight(), r_frame.getWidth(), 3))
             now = dai.Clock.now()
-            rgb_latency = (now - r_frame.getTimestamp()).total_seconds() * 1000
-            print(f'rgb latency: {rgb_latency} ms')
-        
-        if success:
-            return success, self.rgb_frame, None, self.rgb_timestamp
-        else:
-            print('unsuccessful')
-            return False, None, None, None
-        
-    def next_frame_depth_livestream(self):
+            # both are published under the lock of the frames (reentrant), so that the consumers are woken up once, with the pair
+            with self.frame_condition:
+                self.publish_depth(depth_ref, d_frame.getTimestamp().total_seconds(),
+                                   sequence_num=d_frame.getSequenceNum(), latency=(now - d_frame.getTimestamp()).total_seconds())
+                self.publish_rgb(rgb_ref, r_frame.getTimestamp().total_seconds(),
+                                 sequence_num=r_frame.getSequenceNum(), latency=(now - r_frame.getTimestamp()).total_seconds())
+    
+    def close_source(self):
+        self.device.close()
+    
+    def get_frame(self, last_frame=None, timeout=None):
         """
-        Retrieves the next frame from the livestream.
+        Waits for the next frame: with host synchronization the next pair of the synchronizer, otherwise a frame more recent than
+        the last one read, on either stream.
+
+        Args:
+            last_frame (RgbdFrame, optional): The last frame read by the consumer, unused with host synchronization. Defaults to None (any frame).
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to None.
         Returns:
-            Tuple[bool, Optional[np.ndarray], Optional[np.ndarray]]: A tuple containing the success status, the RGB frame, and the depth map.
-                - success (bool): True if both the RGB frame and the depth map are available, False otherwise.
-                - frame (Optional[np.ndarray]): The RGB frame as a NumPy array, or None if not available.
-                - depth_map (Optional[np.ndarray]): The depth map as a NumPy array, or None if not available.
-        """
-        
-        if self.rgb_frame is not None and self.depth_map is not None:
-            success = True
-        else:
-            success = False
-            
-        if success and self.print_rgb_stereo_latency:
-            now = dai.Clock.now().total_seconds()
-            rgb_latency = (now - self.rgb_timestamp) * 1000
-            depth_latency = (now - self.depth_timestamp) * 1000
-            rgb_depth_delay = (self.depth_timestamp - self.rgb_timestamp) * 1000
-
-            print(f'fps rgb: {self.rgb_fps_measured}')
-            print(f'fps depth: {self.depth_fps_measured}')
-            print(f'rgb latency: {rgb_latency} ms')
-            print(f'depth latency: {depth_latency} ms')
-            print(f'rgb-depth delay: {rgb_depth_delay} ms')
-            
-        if success and self.show_disparity:
-            depthFrameColor = cv2.normalize(self.depth_map, None, 255, 0, cv2.NORM_INF, cv2.CV_8UC1)
-            depthFrameColor = cv2.equalizeHist(depthFrameColor)
-            depthFrameColor = cv2.applyColorMap(depthFrameColor, cv2.COLORMAP_JET)
-            cv2.imshow(f'depth {self.device_id}', depthFrameColor)
-            cv2.waitKey(1)
-        if success:
-            return success, self.rgb_frame, self.depth_map, self.rgb_timestamp
-        else:
-            print('unsuccessful')
-            return success, None, None, None
+            Optional[RgbdFrame]: The frame, which the consumer must release, None if the timeout expired or the camera was stopped.
+                Its depth map is None in rgb only mode, and for rgb frames unmatched with the 'rgb_only' policy.
+        """
+        if self.synchronizer is None:
+            return super().get_frame(last_frame, timeout)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        pair = None
+        # the synchronizer is polled, for the consumer to return once the camera is stopped
+        while pair is None and self.running:
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if wait <= 0:
+                return None
+            pair = self.synchronizer.get(timeout=wait)
+        if pair is None:
+            return None
+        # the references of the pair are handed over by the synchronizer
+        rgb_ref, depth_ref, rgb_timestamp, depth_timestamp, skew = pair
+        if skew is not None:
+            self.telemetry.record_skew(rgb_timestamp, depth_timestamp)
+        self.frame_count += 1
+        return RgbdFrame(rgb_ref, depth_ref, rgb_timestamp, depth_timestamp if depth_timestamp is not None else 0, self.frame_count, self.frame_count)
     
-    def next_frame_depth_synced_livestream(self):
+    def next_frame(self, timeout=1.):
         """
-        Retrieves the next frame from the livestream. The RGB and depth frames are synchronized. (at the cost of latency ~ 200ms)
+        Reads the next frame, see get_frame. Its pooled buffers are returned without copy, retained until the next call of next_frame
+        or until the camera is stopped, so the consumer must not keep them longer.
+
+        Args:
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to 1.
         Returns:
-            Tuple[bool, Optional[np.ndarray], Optional[np.ndarray]]: A tuple containing the success status, the RGB frame, and the depth map.
-                - success (bool): True if both the RGB frame and the depth map are available, False otherwise.
+            Tuple[bool, Optional[np.ndarray], Optional[np.ndarray], Optional[float]]: A tuple containing the success status, the RGB frame, the depth map and the RGB timestamp.
+                - success (bool): True if the RGB frame and, unless in rgb only mode or unmatched with the 'rgb_only' policy, the depth map are available, False otherwise.
                 - frame (Optional[np.ndarray]): The RGB frame as a NumPy array, or None if not available.
-                - depth_map (Optional[np.ndarray]): The depth map as a NumPy array, or None if not available.
-        """
-        try:
-            frames = self.synced_queue.get()
-            
-            r_frame = frames['rgb']
-            d_frame = frames['depth']
-            
-            self.rgb_timestamp = r_frame.getTimestamp()
-            
-        except:
-            # raise 
+                - depth_map (Optional[np.ndarray]): The depth map, as an AlignedDepth when it is synchronized, or None if not available.
+                - timestamp (Optional[float]): The timestamp of the RGB frame, or None if not available.
+        """
+        last_frame = self.consumer_frame
+        if last_frame is not None:
+            last_frame.release()
+        frame = self.get_frame(last_frame, timeout)
+        if frame is None:
+            return False, None, None, None
+        self.consumer_frame = frame
+        depth_required = self.get_depth and self.synchronizer is None
+        if frame.rgb_ref is None or (depth_required and frame.depth_ref is None):
             return False, None, None, None
         
-        if r_frame is not None:
-            frame = r_frame.getCvFrame()
-            # frame = cv2.resize(frame, self.cam_data['resolution'])
-            self.rgb_frame = frame
-            self.new_frame = True
-        else:
-            self.rgb_frame = None
-            
-        if d_frame is not None:
-            frame = d_frame.getFrame()
-            frame = cv2.resize(frame, self.cam_data['resolution'])
-            self.depth_map = frame
-        else:
-            self.depth_map = None
-
-
-        if self.show_disparity:
-            depthFrameColor = cv2.normalize(self.depth_map, None, 255, 0, cv2.NORM_INF, cv2.CV_8UC1)
+        depth_map = frame.depth
+        if depth_map is not None and self.sync_depth:
+            # depth is kept at its native resolution and read in rgb coordinates, instead of being resized
+            depth_map = AlignedDepth(depth_map, self.cam_data['resolution'])
+        
+        if self.show_disparity and depth_map is not None:
+            depthFrameColor = cv2.normalize(aligned_array(depth_map), None, 255, 0, cv2.NORM_INF, cv2.CV_8UC1)
             depthFrameColor = cv2.equalizeHist(depthFrameColor)
             depthFrameColor = cv2.applyColorMap(depthFrameColor, cv2.COLORMAP_JET)
             cv2.imshow(f'depth {self.device_id}', depthFrameColor)
             cv2.waitKey(1)
-
+        
         if self.print_rgb_stereo_latency:
-            now = dai.Clock.now()
-            rgb_latency = (now - r_frame.getTimestamp()).total_seconds() * 1000
-            depth_latency = (now - d_frame.getTimestamp()).total_seconds() * 1000
-            print(f'rgb latency: {rgb_latency} ms, depth latency: {depth_latency} ms')
-            rgb_depth_delay = (d_frame.getTimestamp() - r_frame.getTimestamp()).total_seconds() * 1000
-            print(f'rgb-depth delay: {rgb_depth_delay} ms')
-        
-        if self.rgb_frame is not None and self.depth_map is not None:
-            success = True
-        else:
-            success = False
-            
-        if success:
-            return success, self.rgb_frame, self.depth_map, self.rgb_timestamp
-        else:
-            return False, None, None, None
-    
+            self.print_summary()
+        return True, frame.rgb, depth_map, frame.rgb_timestamp
     
-    def next_frame_video(self):
+    def get_sync_stats(self):
         """
-        Reads the next frame from the video and updates the current frame, depth map, and timestamp.
+        Get the statistics of the host synchronization of RGB and depth frames.
 
         Returns:
-            Tuple[bool, np.ndarray, np.ndarray]: A tuple containing the success status of reading the frame,
-            the frame itself, and the corresponding depth map.
-        """
-        success, frame = self.video.read()
-        self.rgb_frame = frame
-        self.depth_map = self.depth_maps[self.current_frame_index]
-        self.rgb_timestamp = self.timestamps[self.current_frame_index]
-        self.current_frame_index += 1
-        self.new_frame = True
-        return success, self.rgb_frame, self.depth_map
+            Optional[Dict]: The statistics, see FrameSynchronizer.get_stats, or None if frames are not synchronized on the host.
+        """
+        return self.synchronizer.get_stats() if self.synchronizer is not None else None
+    
+    def print_summary(self, interval=1.):
+        """
+        Prints a summary of the telemetry of the camera, at most once per interval seconds.
+        """
+        now = time.time()
+        if now - self.last_summary_time < interval:
+            return
+        self.last_summary_time = now
+        summary = self.telemetry.summary()
+        if self.synchronizer is not None:
+            summary += f" | sync {self.synchronizer.get_stats()}"
+        print(summary)
     
     def get_depth_map(self):
         """
-        Get the current depth map.
+        Get the depth map returned by the last call of next_frame.
 
         Returns:
-            np.ndarray: The depth map as a NumPy array.
-        """
-        return self.depth_map
-
-    def start(self):
+            Optional[np.ndarray]: The depth map as a NumPy array.
         """
-        Start the RGB-D camera.
+        return self.consumer_frame.depth if self.consumer_frame is not None else None
 
-        Returns:
-            None
-        """
-        self.on = True
-    
     def stop(self):
         """
-        Stop the RGB-D camera.
-
-        Returns:
-            None
+        Stop the RGB-D camera: the device is closed, the collection threads are joined and the frames still held go back to their pools.
         """
-        self.on = False
-        #wait for 50ms
-        if not self.replay:
-            time.sleep(0.05)
-            self.device.close()
-        self.rgb_frames_thread.join()
-        if self.get_depth:
-            self.depth_frames_thread.join()
+        super().stop()
+        if self.consumer_frame is not None:
+            self.consumer_frame.release()
+            self.consumer_frame = None
+        if self.synchronizer is not None:
+            self.synchronizer.reset()
+        self.reset_frames()
 
     def get_res(self):
         """
@@ -952,40 +897,3 @@ class RgbdCamera:
             Dict: The device data as a dictionary.
         """
         return self.cam_data
-
-    def get_num_frames(self):
-        """
-        Get the total number of frames in the video replay.
-
-        Returns:
-            int: The number of frames.
-        """
-        return self.nb_frames
-    
-    def get_timestamps(self):
-        """
-        Get the timestamps of the frames in the video replay.
-
-        Returns:
-            List[float]: The timestamps as a list of floats.
-        """
-        return self.timestamps
-    
-    
-    def is_on(self):
-        """
-        Check if the RGB-D camera is currently on.
-
-        Returns:
-            bool: True if the camera is on, False otherwise.
-        """
-        return self.on
-    
-    def is_on_replay(self):
-        """
-        Check if the RGB-D camera is currently on replay mode.
-
-        Returns:
-            bool: True if the camera is on replay mode, False otherwise.
-        """
-        return self.current_frame_index < self.nb_frames
\ No newline at end of file
@@ -0,0 +1,330 @@
+import multiprocessing
+import os
+import queue
+import time
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from rgbd.CameraBase import RgbdCameraBase
+from rgbd.CameraTelemetry import CameraTelemetry
+
+
+class SharedFrameRing:
+    """
+    Ring of frames in shared memory, written by one process and read by any number of processes.
+
+    The block starts with a header (capacity, number of frames written, closed flag, shape and dtype of the frames), followed by
+    the timestamp and the sequence number of each slot, then by the frames. The writer never waits for the readers: a slot is
+    invalidated while it is written, and its sequence number is set once it is complete, so that a reader detects a frame
+    overwritten while it was copied.
+
+    Args:
+        shm (shared_memory.SharedMemory): The shared memory block.
+        owner (bool): Whether this process created the block, and unlinks it when closed.
+    """
+    MAGIC = 0x52474244
+    HEADER_SIZE = 16
+    # header fields
+    CAPACITY, WRITE_COUNT, CLOSED, DTYPE, NDIM, SHAPE = 1, 2, 3, 4, 5, 6
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((self.HEADER_SIZE,), dtype=np.int64, buffer=shm.buf)
+        if self.header[0] != self.MAGIC:
+            raise ValueError(f'Shared memory {shm.name} is not a frame ring')
+        self.capacity = int(self.header[self.CAPACITY])
+        self.dtype = np.dtype(chr(int(self.header[self.DTYPE])))
+        self.frame_shape = tuple(int(x) for x in self.header[self.SHAPE:self.SHAPE + int(self.header[self.NDIM])])
+        offset = self.HEADER_SIZE * 8
+        self.timestamps = np.ndarray((self.capacity,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += self.capacity * 8
+        self.sequence_nums = np.ndarray((self.capacity,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.capacity * 8
+        self.frames = np.ndarray((self.capacity,) + self.frame_shape, dtype=self.dtype, buffer=shm.buf, offset=offset)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @classmethod
+    def create(cls, name, capacity, frame_shape, dtype):
+        """
+        Creates a ring in a new shared memory block.
+
+        Args:
+            name (str): Name of the block, used by the readers to attach to it.
+            capacity (int): Number of frames kept.
+            frame_shape (Tuple[int, ...]): Shape of the frames, up to 3 dimensions.
+            dtype (np.dtype): Type of the frames.
+        Returns:
+            SharedFrameRing: The ring.
+        """
+        if capacity < 1:
+            raise ValueError(f'capacity must be a positive integer, got {capacity}')
+        if len(frame_shape) > cls.HEADER_SIZE - cls.SHAPE:
+            raise ValueError(f'frames of shape {frame_shape} have too many dimensions')
+        dtype = np.dtype(dtype)
+        size = cls.HEADER_SIZE * 8 + capacity * 16 + capacity * int(np.prod(frame_shape)) * dtype.itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((cls.HEADER_SIZE,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[cls.CAPACITY] = capacity
+        header[cls.DTYPE] = ord(dtype.char)
+        header[cls.NDIM] = len(frame_shape)
+        header[cls.SHAPE:cls.SHAPE + len(frame_shape)] = frame_shape
+        header[0] = cls.MAGIC
+        ring = cls(shm, owner=True)
+        ring.sequence_nums[:] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name, untrack=False):
+        """
+        Attaches to a ring created by another process.
+
+        Args:
+            name (str): Name of the ring.
+            untrack (bool, optional): Whether to stop tracking the block, for a process which was not started by the same
+                parent as the creator, so that its resource tracker does not unlink the block when it exits. Defaults to False.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def write_count(self):
+        return int(self.header[self.WRITE_COUNT])
+
+    @property
+    def closed(self):
+        return bool(self.header[self.CLOSED])
+
+    def put(self, frame, timestamp):
+        """
+        Writes a frame in the next slot, overwriting the oldest one.
+
+        Raises:
+            ValueError: If the frame does not match the shape of the ring.
+        """
+        if frame.shape != self.frame_shape:
+            raise ValueError(f'{self.name} frame of shape {frame.shape} does not fit in a ring of shape {self.frame_shape}')
+        sequence_num = self.write_count
+        slot = sequence_num % self.capacity
+        self.sequence_nums[slot] = -1
+        np.copyto(self.frames[slot], frame, casting='unsafe')
+        self.timestamps[slot] = timestamp
+        self.sequence_nums[slot] = sequence_num
+        self.header[self.WRITE_COUNT] = sequence_num + 1
+
+    def read(self, sequence_num, out):
+        """
+        Copies a frame.
+
+        Args:
+            sequence_num (int): Sequence number of the frame, from 0.
+            out (np.ndarray): Array the frame is copied to.
+        Returns:
+            Optional[float]: The timestamp of the frame, None if it was overwritten before or while it was copied.
+        """
+        slot = sequence_num % self.capacity
+        if self.sequence_nums[slot] != sequence_num:
+            return None
+        np.copyto(out, self.frames[slot])
+        timestamp = float(self.timestamps[slot])
+        if self.sequence_nums[slot] != sequence_num:
+            return None
+        return timestamp
+
+    def close(self):
+        # the views on the block must be released before it is closed
+        self.header = self.timestamps = self.sequence_nums = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def mark_closed(self):
+        self.header[self.CLOSED] = 1
+
+
+class SharedFrameConsumer(RgbdCameraBase):
+    """
+    Camera reading the rgb frames and depth maps of a capture process from their shared memory rings. Writers, previews or
+    online detectors can run in separate processes, each attached to the rings of the cameras by their names.
+
+    A collection thread polls the rings and copies each new frame into a pooled buffer, published as the frames of any camera.
+    The camera stops by itself once the capture process closed its rings.
+
+    Args:
+        device_id (str): Id of the camera.
+        rgb_ring_name (str, optional): Name of the rgb ring. Defaults to None (attached later with attach()).
+        depth_ring_name (str, optional): Name of the depth ring. Defaults to None.
+        resolution (Tuple[int, int], optional): Resolution of the rgb frames. Defaults to None (read from the rgb ring).
+        poll_interval (float, optional): Time between two checks for new frames, in seconds. Defaults to 0.001.
+        untrack (bool, optional): See SharedFrameRing.attach. Defaults to False.
+    """
+    def __init__(self, device_id, rgb_ring_name=None, depth_ring_name=None, resolution=None, poll_interval=0.001, untrack=False):
+        self.rings = {}
+        if rgb_ring_name is not None:
+            self.attach(rgb_ring_name, depth_ring_name, untrack)
+        if resolution is None and len(self.rings) > 0:
+            height, width = self.rings[CameraTelemetry.RGB].frame_shape[:2]
+            resolution = (width, height)
+        super().__init__(device_id, resolution if resolution is not None else (0, 0))
+        self.poll_interval = poll_interval
+
+    def attach(self, rgb_ring_name, depth_ring_name, untrack=False):
+        self.rings = {CameraTelemetry.RGB: SharedFrameRing.attach(rgb_ring_name, untrack), CameraTelemetry.DEPTH: SharedFrameRing.attach(depth_ring_name, untrack)}
+
+    def get_ring_names(self):
+        """
+        Returns:
+            Tuple[str, str]: The names of the rgb and depth rings, to attach other consumers.
+        """
+        return self.rings[CameraTelemetry.RGB].name, self.rings[CameraTelemetry.DEPTH].name
+
+    def get_collection_tasks(self):
+        return [self.ring_thread]
+
+    def ring_thread(self):
+        pools = {CameraTelemetry.RGB: self.rgb_pool, CameraTelemetry.DEPTH: self.depth_pool}
+        publish = {CameraTelemetry.RGB: self.publish_rgb, CameraTelemetry.DEPTH: self.publish_depth}
+        read_counts = {stream: ring.write_count for stream, ring in self.rings.items()}
+        while self.running:
+            for stream, ring in self.rings.items():
+                # only the most recent frame is copied, the frames skipped are counted as dropped by the telemetry
+                write_count = ring.write_count
+                if write_count == read_counts[stream]:
+                    continue
+                read_counts[stream] = write_count
+                ref = pools[stream].acquire(ring.frame_shape)
+                timestamp = ring.read(write_count - 1, ref.array)
+                if timestamp is None:
+                    ref.release()
+                    continue
+                publish[stream](ref, timestamp, sequence_num=write_count - 1)
+            if self.rings[CameraTelemetry.RGB].closed:
+                self.end_of_stream()
+                break
+            time.sleep(self.poll_interval)
+
+    def stop(self):
+        super().stop()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+
+
+def build_capture_camera(device_id, capture_backend, camera_kwargs):
+    # the camera is built in the capture process, depthai is only imported there
+    if capture_backend == 'depthai':
+        from rgbd.DeviceManager import DeviceManager
+        return DeviceManager().open_camera(device_id, show_rgb=False, show_depth=False, **camera_kwargs)
+    elif capture_backend == 'synthetic':
+        from rgbd.SyntheticCameras import SyntheticRgbdCam
+        return SyntheticRgbdCam(device_id=device_id, **camera_kwargs)
+    raise ValueError(f"Unknown capture backend '{capture_backend}', expected 'depthai' or 'synthetic'")
+
+
+def capture_process(device_id, capture_backend, camera_kwargs, ring_prefix, capacity, start_event, stop_event, info_queue):
+    """
+    Main function of a capture process: opens the camera, and once started, writes its frames in two shared memory rings,
+    created with the shapes of the first frames. The device data, then the names of the rings, are sent through the info queue.
+    """
+    try:
+        camera = build_capture_camera(device_id, capture_backend, camera_kwargs)
+        info_queue.put(('device_data', camera.get_device_data(), camera.depth_postprocessing))
+    except Exception as e:
+        info_queue.put(('error', f'{type(e).__name__}: {e}'))
+        raise
+    while not start_event.wait(0.1):
+        if stop_event.is_set():
+            camera.stop()
+            return
+    camera.start()
+    rings = {}
+    rgb_seq, depth_seq = 0, 0
+    try:
+        while not stop_event.is_set():
+            _, rgb_ref, depth_ref, rgb_timestamp, depth_timestamp, new_rgb_seq, new_depth_seq = camera.wait_for_next(rgb_seq, depth_seq, timeout=0.1, retain=True)
+            for stream, ref, timestamp, is_new in [(CameraTelemetry.RGB, rgb_ref, rgb_timestamp, new_rgb_seq != rgb_seq),
+                                                    (CameraTelemetry.DEPTH, depth_ref, depth_timestamp, new_depth_seq != depth_seq)]:
+                if ref is None:
+                    continue
+                if is_new:
+                    if stream not in rings:
+                        rings[stream] = SharedFrameRing.create(f'{ring_prefix}_{stream}', capacity, ref.array.shape, ref.array.dtype)
+                        if len(rings) == 2:
+                            info_queue.put(('rings', rings[CameraTelemetry.RGB].name, rings[CameraTelemetry.DEPTH].name))
+                    rings[stream].put(ref.array, timestamp)
+                ref.release()
+            rgb_seq, depth_seq = new_rgb_seq, new_depth_seq
+    finally:
+        camera.stop()
+        for ring in rings.values():
+            ring.mark_closed()
+            ring.close()
+
+
+class SharedMemoryCamera(SharedFrameConsumer):
+    """
+    Camera running in its own capture process, with the interface of SimpleRgbdCam.
+
+    The device is read, and its frames converted, in a separate interpreter, so that the capture of several cameras does not
+    compete for the GIL with the writers of the recording process. The frames are written in shared memory rings, which
+    other processes can also read, through a SharedFrameConsumer attached to get_ring_names().
+
+    Args:
+        device_id (str): Id of the device.
+        capture_backend (str, optional): 'depthai' for an OAK device, 'synthetic' for generated frames. Defaults to 'depthai'.
+        capacity (int, optional): Number of frames of each ring. Defaults to 16.
+        start_timeout (float, optional): Maximal time to wait for the device and its first frames, in seconds. Defaults to 30.
+        **camera_kwargs: Arguments of the camera, e.g. resolution and fps_rgb.
+    """
+    def __init__(self, device_id, capture_backend='depthai', capacity=16, start_timeout=30., **camera_kwargs):
+        if camera_kwargs.get('rgb_encoding') is not None:
+            raise ValueError('rgb_encoding is not supported by the shared memory capture, encoded packets are not shared')
+        camera_kwargs.pop('rgb_encoding', None)
+        self.start_timeout = start_timeout
+        # spawned, as forking a process running the threads of depthai is unsafe
+        context = multiprocessing.get_context('spawn')
+        self.start_event = context.Event()
+        self.stop_event = context.Event()
+        self.info_queue = context.Queue()
+        ring_prefix = f'rgbd{os.getpid()}_{uuid.uuid4().hex[:8]}'
+        self.process = context.Process(target=capture_process, name=f'capture {device_id}', daemon=True,
+                                       args=(device_id, capture_backend, camera_kwargs, ring_prefix, capacity, self.start_event, self.stop_event, self.info_queue))
+        self.process.start()
+        self.device_id = device_id
+        _, self.device_data, depth_postprocessing = self.get_info('device_data')
+        super().__init__(device_id, resolution=self.device_data['resolution'])
+        self.depth_postprocessing = depth_postprocessing
+
+    def get_info(self, expected):
+        try:
+            info = self.info_queue.get(timeout=self.start_timeout)
+        except queue.Empty:
+            self.stop_event.set()
+            raise TimeoutError(f'Capture process of {self.device_id} did not send its {expected} within {self.start_timeout} s')
+        if info[0] == 'error':
+            self.process.join()
+            raise RuntimeError(f'Capture process of {self.device_id} failed : {info[1]}')
+        return info
+
+    def start(self):
+        self.start_event.set()
+        _, rgb_ring_name, depth_ring_name = self.get_info('rings')
+        self.attach(rgb_ring_name, depth_ring_name)
+        super().start()
+        print(f'Capture process of {self.device_id} started, rings {rgb_ring_name} and {depth_ring_name}')
+
+    def close_source(self):
+        self.stop_event.set()
+
+    def stop(self):
+        super().stop()
+        self.process.join()
+
+    def get_device_data(self):
+        return self.device_data
@@ -0,0 +1,277 @@
+import os
+import time
+import cv2
+import numpy as np
+from rgbd.CameraBase import RgbdCameraBase, RgbdFrame
+from rgbd.CameraTelemetry import CameraTelemetry
+from rgbd.FrameBuffers import PooledFrame
+from rgbd.DepthStorage import ChunkedDepthFormat, ChunkedDepthReader
+from rgbd.TrialMetadata import METADATA_SUFFIX, read_timestamps
+from rgbd.EncodedRecording import BITSTREAM_EXTENSIONS
+from rgbd.VideoReaders import ReadAheadVideoReader
+
+
+class SyntheticRgbdCam(RgbdCameraBase):
+    """
+    Camera generating rgb frames and depth maps, to run and benchmark the recording pipeline without any device.
+    Timestamps are on the time.monotonic() clock, from which the latency of each frame is recorded in the telemetry.
+
+    Frames are drawn from a small set of precomputed images (a disc moving over a slanted plane), so that
+    generating them costs almost nothing. Each frame is delivered with a device-like timestamp, after a random
+    delay around its nominal time, and may be dropped to mimic a saturated link.
+
+    Args:
+        device_id (str, optional): Id of the camera. Defaults to 'synthetic'.
+        fps_rgb (float, optional): Frame rate of the rgb stream. Defaults to 30.
+        fps_depth (float, optional): Frame rate of the depth stream. Defaults to None (same as fps_rgb).
+        resolution (tuple, optional): Resolution of the frames. Defaults to (1280, 720).
+        jitter (float, optional): Standard deviation of the delivery delay, in seconds. Defaults to 0.002.
+        drop_rate (float, optional): Probability for a frame to be dropped. Defaults to 0.
+        nb_patterns (int, optional): Number of precomputed frames. Defaults to 16.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+    """
+    def __init__(self, device_id='synthetic', fps_rgb=30, fps_depth=None, resolution=(1280, 720), jitter=0.002, drop_rate=0., nb_patterns=16, seed=0, **kwargs):
+        super().__init__(device_id if device_id is not None else 'synthetic', resolution)
+        if not 0. <= drop_rate < 1.:
+            raise ValueError(f'drop_rate must be in [0, 1), got {drop_rate}')
+        if kwargs.get('rgb_encoding') is not None:
+            raise ValueError('SyntheticRgbdCam does not support rgb_encoding')
+        self.fps_rgb = float(fps_rgb)
+        self.fps_depth = float(fps_depth) if fps_depth is not None else self.fps_rgb
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.rng = np.random.default_rng(seed)
+        self.build_patterns(nb_patterns)
+        self.generated = {'rgb': 0, 'depth': 0}
+        self.dropped = {'rgb': 0, 'depth': 0}
+
+    def build_patterns(self, nb_patterns):
+        width, height = self.resolution
+        y, x = np.mgrid[0:height, 0:width]
+        plane = 600 + 0.5 * y + 0.1 * x
+        self.rgb_patterns = []
+        self.depth_patterns = []
+        for i in range(nb_patterns):
+            cx = int(width * (0.2 + 0.6 * i / max(nb_patterns - 1, 1)))
+            cy = height // 2
+            radius = max(height // 8, 1)
+            rgb = np.empty((height, width, 3), dtype=np.uint8)
+            rgb[:] = (90, 110, 130)
+            cv2.circle(rgb, (cx, cy), radius, (60, 160, 220), -1)
+            depth = plane.copy()
+            depth[(x - cx) ** 2 + (y - cy) ** 2 < radius ** 2] -= 150
+            depth += self.rng.normal(0, 2, depth.shape)
+            self.rgb_patterns.append(rgb)
+            self.depth_patterns.append(depth.astype(np.uint16))
+
+    def get_collection_tasks(self):
+        return [self.generation_thread]
+
+    def generation_thread(self):
+        start = time.monotonic()
+        next_times = {'rgb': 0., 'depth': 0.}
+        periods = {'rgb': 1. / self.fps_rgb, 'depth': 1. / self.fps_depth}
+        while self.running:
+            stream = min(next_times, key=next_times.get)
+            nominal_time = next_times[stream]
+            next_times[stream] += periods[stream]
+            delay = start + nominal_time + abs(self.rng.normal(0, self.jitter)) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if not self.running:
+                break
+            index = self.generated[stream]
+            self.generated[stream] += 1
+            if self.rng.random() < self.drop_rate:
+                self.dropped[stream] += 1
+                continue
+            # timestamps are taken at the nominal time, as the device timestamps frames at exposure
+            timestamp = start + nominal_time
+            # frames are copied into pooled buffers, as the frames received from a device
+            if stream == 'rgb':
+                self.publish_rgb(self.rgb_pool.copy(self.rgb_patterns[index % len(self.rgb_patterns)]), timestamp,
+                                 sequence_num=index, latency=time.monotonic() - timestamp)
+            else:
+                self.publish_depth(self.depth_pool.copy(self.depth_patterns[index % len(self.depth_patterns)]), timestamp,
+                                   sequence_num=index, latency=time.monotonic() - timestamp)
+
+    def stop(self):
+        super().stop()
+        print(f"{self.device_id} generated {self.generated['rgb']} rgb frames ({self.dropped['rgb']} dropped) and {self.generated['depth']} depth maps ({self.dropped['depth']} dropped)")
+
+
+class TrialReplayCam(RgbdCameraBase):
+    """
+    Camera replaying a recorded trial at the recording speed, to run the recording pipeline on real frames without any device.
+
+    Args:
+        trial_path (str): Folder of the recorded trial.
+        device_id (str): Id of the camera whose recording is replayed.
+        loop (bool, optional): Whether to replay the trial again once it is over, otherwise the camera stops. Defaults to False.
+        speed (float, optional): Replay speed, 1 for real time. Defaults to 1.
+    """
+    def __init__(self, trial_path, device_id, loop=False, speed=1., **kwargs):
+        label = os.path.basename(os.path.normpath(trial_path))
+        self.base = os.path.join(trial_path, f'{label}_cam_{device_id}')
+        self.path_metadata = os.path.join(trial_path, f'{label}{METADATA_SUFFIX}')
+        self.path_depth = self.base + '_depth_map' + ChunkedDepthFormat.EXTENSION
+        # a raw bitstream is replayed when it could not be remuxed into a container
+        video_extensions = ['.avi', '.mp4'] + list(BITSTREAM_EXTENSIONS.values())
+        self.path_vid = next((self.base + f'_video{extension}' for extension in video_extensions if os.path.exists(self.base + f'_video{extension}')), None)
+        if self.path_vid is None or not os.path.exists(self.path_depth) or not os.path.exists(self.path_metadata):
+            raise ValueError(f'No recording of {device_id} with metadata and chunked depth maps in {trial_path}')
+        video = cv2.VideoCapture(self.path_vid)
+        resolution = (int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        video.release()
+        super().__init__(device_id, resolution)
+        self.loop = loop
+        self.speed = speed
+        self.rgb_dates = read_timestamps(self.path_metadata, device_id, 'rgb')['Date'].to_numpy()
+        self.depth_dates = read_timestamps(self.path_metadata, device_id, 'depth')['Date'].to_numpy()
+
+    def get_collection_tasks(self):
+        return [self.generation_thread]
+
+    def generation_thread(self):
+        start = time.monotonic()
+        offset = 0.
+        while self.running:
+            first_date = min(self.rgb_dates[0], self.depth_dates[0])
+            video = cv2.VideoCapture(self.path_vid)
+            depth_reader = ChunkedDepthReader(self.path_depth)
+            depth_maps = iter(depth_reader)
+            events = sorted([(date, 'rgb') for date in self.rgb_dates] + [(date, 'depth') for date in self.depth_dates])
+            for date, stream in events:
+                if not self.running:
+                    break
+                delay = start + (offset + date - first_date) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                timestamp = start + offset + date - first_date
+                if stream == 'rgb':
+                    rgb_ref = self.rgb_pool.acquire((self.resolution[1], self.resolution[0], 3))
+                    success, _ = video.read(rgb_ref.array)
+                    if success:
+                        self.publish_rgb(rgb_ref, timestamp, latency=time.monotonic() - timestamp)
+                    else:
+                        rgb_ref.release()
+                else:
+                    # decoded depth maps are new arrays, they are published without copy
+                    depth_map = next(depth_maps, None)
+                    if depth_map is not None:
+                        self.publish_depth(PooledFrame(depth_map), timestamp, latency=time.monotonic() - timestamp)
+            video.release()
+            depth_reader.close()
+            offset += events[-1][0] - first_date + 1. / 30. if len(events) > 0 else 0.
+            if not self.loop:
+                break
+        self.end_of_stream()
+
+
+class VideoReplayCam(RgbdCameraBase):
+    """
+    Camera replaying the pre-processed video and depth maps of a trial frame by frame, e.g. for ExperimentReplayer.
+
+    Unlike the other cameras, no frame may be skipped: frames are not published, each get_frame() returns the next frame of the
+    video, paired with its depth map and timestamp. They are decoded in the background, ahead of the consumer, by a
+    ReadAheadVideoReader. Decoded frames are new arrays, returned without copy.
+
+    Args:
+        device_id (str, optional): Id of the camera whose recording is replayed. Defaults to 'replay'.
+        cam_data (dict, optional): The camera data of the device, returned by get_device_data. Defaults to None.
+        replay (dict, optional): The replay to load, see load_replay. Defaults to None.
+        read_ahead (int, optional): Number of frames decoded ahead. Defaults to 8.
+        color_conversion (int, optional): cv2 colour conversion code applied to the frames by the decoder. Defaults to None.
+        rotation (int, optional): cv2 rotation code applied to the frames by the decoder. Defaults to None.
+    """
+    def __init__(self, device_id='replay', cam_data=None, replay=None, read_ahead=8, color_conversion=None, rotation=None):
+        super().__init__(device_id, cam_data['resolution'] if cam_data is not None else (0, 0), pool_size=1)
+        self.cam_data = cam_data
+        self.read_ahead = read_ahead
+        self.color_conversion = color_conversion
+        self.rotation = rotation
+        self.video_reader = None
+        self.timestamps = []
+        self.nb_frames = 0
+        self.current_frame_index = 0
+        if replay is not None:
+            self.load_replay(replay)
+
+    def load_replay(self, replay):
+        """
+        Loads a replay, and starts decoding it.
+
+        Args:
+            replay (dict): The path of the 'Video', and its 'Depth_maps' and 'Timestamps'.
+        Raises:
+            ValueError: If the video cannot be read.
+        """
+        self.stop()
+        self.timestamps = replay['Timestamps']
+        self.video_reader = ReadAheadVideoReader(replay['Video'], replay['Depth_maps'], self.timestamps, queue_size=self.read_ahead,
+                                                 color_conversion=self.color_conversion, rotation=self.rotation)
+        self.nb_frames = self.video_reader.nb_frames
+        self.current_frame_index = 0
+        self.start()
+
+    def get_collection_tasks(self):
+        # the frames are decoded by the thread of the reader
+        return []
+
+    def close_source(self):
+        if self.video_reader is not None:
+            self.video_reader.close()
+            self.video_reader = None
+
+    def get_frame(self, last_frame=None, timeout=None):
+        """
+        Reads the next frame of the video.
+
+        Args:
+            last_frame (RgbdFrame, optional): Unused, frames are read in order. Defaults to None.
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to None.
+        Returns:
+            Optional[RgbdFrame]: The frame, None at the end of the video or if the timeout expired. Its arrays are not pooled.
+        """
+        if not self.running:
+            return None
+        success, rgb_frame, depth_map, timestamp = self.video_reader.read(timeout)
+        if not success:
+            if self.video_reader.finished:
+                self.end_of_stream()
+            return None
+        self.current_frame_index += 1
+        self.telemetry.record_frame(CameraTelemetry.RGB, timestamp, sequence_num=self.current_frame_index)
+        return RgbdFrame(PooledFrame(rgb_frame), PooledFrame(depth_map) if depth_map is not None else None,
+                         timestamp, timestamp, self.current_frame_index, self.current_frame_index)
+
+    def next_frame(self):
+        """
+        Reads the next frame of the video, as the replay reader of i_grip.
+
+        Returns:
+            Tuple[bool, Optional[np.ndarray], Optional[np.ndarray]]: The success status, the frame and its depth map.
+        """
+        frame = self.get_frame()
+        if frame is None:
+            return False, None, None
+        return True, frame.rgb, frame.depth
+
+    def get_timestamps(self):
+        return self.timestamps
+
+    def get_num_frames(self):
+        return self.nb_frames
+
+    def get_stats(self):
+        """
+        Returns:
+            Dict: See ReadAheadVideoReader.get_stats, None if no replay is loaded.
+        """
+        return self.video_reader.get_stats() if self.video_reader is not None else None
+
+    def is_on(self):
+        return self.running and self.current_frame_index < self.nb_frames
+
+    def get_device_data(self):
+        return self.cam_data if self.cam_data is not None else super().get_device_data()
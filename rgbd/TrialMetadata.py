@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+METADATA_SUFFIX = '_metadata.parquet'
+RGB = 'rgb'
+DEPTH = 'depth'
+# key of the recording info of the cameras in the key-value metadata of the parquet file
+RECORDING_INFO_KEY = b'recording_info'
+# the cameras of a trial save their metadata in the same file, one at a time
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+
+def metadata_path(folder, label):
+    """
+    Returns:
+        str: Path of the metadata of the trial with the given label, in the given folder.
+    """
+    return os.path.join(folder, f'{label}{METADATA_SUFFIX}')
+
+
+def build_metadata(device_id, rgb_dates, rgb_host_dates, rgb_written_dates, depth_dates, depth_host_dates, depth_written_dates):
+    """
+    Builds the metadata of a trial recorded by a camera, with one row per frame index.
+    The i-th row holds the device and host timestamps of the i-th rgb frame and of the i-th depth map received
+    from the camera, and whether they were dropped before reaching the disk. The shortest stream is padded with
+    missing values.
+
+    Args:
+        device_id (str): Id of the camera.
+        rgb_dates (List[float]): Device timestamps of the rgb frames received from the camera.
+        rgb_host_dates (List[float]): Host timestamps of the rgb frames received from the camera.
+        rgb_written_dates (List[float]): Device timestamps of the rgb frames written to disk.
+        depth_dates (List[float]): Device timestamps of the depth maps received from the camera.
+        depth_host_dates (List[float]): Host timestamps of the depth maps received from the camera.
+        depth_written_dates (List[float]): Device timestamps of the depth maps written to disk.
+    Returns:
+        pd.DataFrame: The metadata.
+    """
+    nb_rows = max(len(rgb_dates), len(depth_dates))
+    metadata = pd.DataFrame({'frame_index': np.arange(nb_rows, dtype=np.int32)})
+    for stream, dates, host_dates, written_dates in [(RGB, rgb_dates, rgb_host_dates, rgb_written_dates),
+                                                     (DEPTH, depth_dates, depth_host_dates, depth_written_dates)]:
+        padding = nb_rows - len(dates)
+        dates = np.asarray(dates, dtype=np.float64)
+        metadata[f'{stream}_ts'] = np.pad(dates, (0, padding), constant_values=np.nan)
+        metadata[f'{stream}_host_ts'] = np.pad(np.asarray(host_dates, dtype=np.float64), (0, padding), constant_values=np.nan)
+        dropped = pd.array(~np.isin(dates, np.asarray(written_dates, dtype=np.float64)), dtype='boolean')
+        metadata[f'{stream}_dropped'] = pd.concat([pd.Series(dropped), pd.Series([pd.NA] * padding, dtype='boolean')], ignore_index=True)
+    metadata['device_id'] = str(device_id)
+    return metadata
+
+
+def written_metadata(metadata):
+    """
+    Builds the metadata of the frames written to disk, as used once the trial is recorded: the i-th row holds
+    the timestamps of the i-th rgb frame and of the i-th depth map of the recording files.
+
+    Args:
+        metadata (pd.DataFrame): The metadata of a camera, as built by build_metadata.
+    Returns:
+        pd.DataFrame: The metadata of the written frames, without the drop flags.
+    """
+    streams = {}
+    for stream in [RGB, DEPTH]:
+        written = metadata[metadata[f'{stream}_dropped'] == False]
+        streams[stream] = written[[f'{stream}_ts', f'{stream}_host_ts']].reset_index(drop=True)
+    written = pd.concat(streams.values(), axis=1)
+    written.insert(0, 'frame_index', np.arange(len(written), dtype=np.int32))
+    written['device_id'] = metadata['device_id'].iloc[0] if len(metadata) > 0 else None
+    return written
+
+
+def to_json(value):
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+
+def write_metadata(path, metadata, recording_info=None):
+    """
+    Writes the metadata of one or several cameras in the parquet file of the trial. The previous metadata of these cameras
+    is replaced, the metadata of the other cameras is kept. The file is replaced atomically.
+
+    Args:
+        path (str): Path of the metadata.
+        metadata (pd.DataFrame): The metadata, with a 'device_id' column.
+        recording_info (Dict[str, Dict], optional): Settings and statistics of the recording of each camera, by device id,
+            kept in the key-value metadata of the file. Defaults to None (the recording info of the file is kept).
+    """
+    with _write_locks_lock:
+        lock = _write_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        info = read_recording_info(path) if os.path.exists(path) else {}
+        if os.path.exists(path):
+            previous = pd.read_parquet(path)
+            device_ids = metadata['device_id'].astype(str).unique()
+            previous = previous[~previous['device_id'].astype(str).isin(device_ids)]
+            if len(previous) > 0:
+                metadata = pd.concat([previous, metadata], ignore_index=True)
+        if recording_info is not None:
+            info.update({str(device_id): device_info for device_id, device_info in recording_info.items()})
+        table = pa.Table.from_pandas(metadata, preserve_index=False)
+        schema = table.schema.with_metadata({**(table.schema.metadata or {}), RECORDING_INFO_KEY: json.dumps(info, default=to_json)})
+        temporary_path = path + '.tmp'
+        # each camera is written in its own row groups, which the filters on device_id skip when reading another camera
+        with pq.ParquetWriter(temporary_path, schema) as writer:
+            for device_id in pd.unique(metadata['device_id']):
+                writer.write_table(table.filter(pc.equal(table['device_id'], device_id)))
+        os.replace(temporary_path, path)
+
+
+def read_recording_info(path, device_id=None):
+    """
+    Reads the recording info of the cameras of a trial, without reading its metadata.
+
+    Args:
+        path (str): Path of the metadata.
+        device_id (str, optional): Id of the camera. Defaults to None (all cameras).
+    Returns:
+        Dict: The recording info of the camera, or the recording info of each camera by device id.
+    """
+    schema_metadata = pq.read_schema(path).metadata or {}
+    info = json.loads(schema_metadata.get(RECORDING_INFO_KEY, b'{}'))
+    return info.get(str(device_id), {}) if device_id is not None else info
+
+
+def read_metadata(path, device_id=None, columns=None, filters=None):
+    """
+    Reads the metadata of a trial. Only the row groups matching the filters are read.
+
+    Args:
+        path (str): Path of the metadata.
+        device_id (str, optional): Id of the camera. Defaults to None (all cameras).
+        columns (List[str], optional): Columns to read. Defaults to None (all columns).
+        filters (List[Tuple], optional): Additional filters, as (column, operator, value) tuples. Defaults to None.
+    Returns:
+        pd.DataFrame: The metadata.
+    """
+    filters = list(filters) if filters is not None else []
+    if device_id is not None:
+        filters.append(('device_id', '==', str(device_id)))
+    metadata = pd.read_parquet(path, columns=columns, filters=filters if len(filters) > 0 else None)
+    if 'device_id' in metadata.columns:
+        metadata['device_id'] = metadata['device_id'].astype(str)
+    return metadata.sort_values([c for c in ['device_id', 'frame_index'] if c in metadata.columns], ignore_index=True)
+
+
+def read_timestamps(path, device_id, stream=RGB, sequence=None):
+    """
+    Reads the timestamps of the frames of a stream, as a dataframe with 'Date' (device timestamps) and
+    'Timestamps' (starting at 0) columns.
+
+    Args:
+        path (str): Path of the metadata.
+        device_id (str): Id of the camera.
+        stream (str, optional): 'rgb' or 'depth'. Defaults to 'rgb'.
+        sequence (str, optional): Sequence of a pre-processed trial. Defaults to None.
+    Returns:
+        pd.DataFrame: The timestamps.
+    """
+    filters = [('sequence', '==', sequence)] if sequence is not None else []
+    dates = read_metadata(path, device_id, columns=['frame_index', f'{stream}_ts'], filters=filters)[f'{stream}_ts'].dropna().to_numpy()
+    timestamps = pd.DataFrame({'Date': dates})
+    timestamps['Timestamps'] = dates - (dates[0] if len(dates) > 0 else 0.)
+    return timestamps
+
+
+def read_sequences(path, device_id=None):
+    """
+    Returns:
+        List[str]: The sequences of a pre-processed trial, for a camera or for all of them.
+    """
+    return sorted(read_metadata(path, device_id, columns=['sequence'])['sequence'].unique().tolist())
@@ -0,0 +1,490 @@
+import os
+import queue
+import struct
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+import pandas as pd
+from rgbd.EncodedRecording import BITSTREAM_EXTENSIONS, packets_path
+
+
+def is_bitstream(path):
+    """
+    Returns:
+        bool: Whether a video is a raw bitstream recorded from the device, without container.
+    """
+    return path.endswith(tuple(BITSTREAM_EXTENSIONS.values()))
+
+
+class ReadAheadVideoReader:
+    """
+    Decodes a recorded video in a background thread, ahead of the consumer, so that decoding overlaps with the
+    processing of the previous frames instead of adding to it.
+
+    Decoded frames are paired with their depth map and timestamp, and put in a bounded queue: the decoder stays at
+    most queue_size frames ahead. The colour conversion and the rotation of the frames are also made by the decoder.
+
+    Args:
+        path (str): Path of the video.
+        depth_maps (Sequence[np.ndarray], optional): Depth maps of the frames. Defaults to None.
+        timestamps (Sequence[float], optional): Timestamps of the frames. Defaults to None.
+        queue_size (int, optional): Maximum number of frames decoded ahead. Defaults to 8.
+        color_conversion (int, optional): cv2 colour conversion code applied to the frames, e.g. cv2.COLOR_BGR2RGB. Defaults to None.
+        rotation (int, optional): cv2 rotation code applied to the frames, e.g. cv2.ROTATE_90_COUNTERCLOCKWISE. Defaults to None.
+    Raises:
+        ValueError: If the video cannot be read.
+    """
+    _END = None
+
+    def __init__(self, path, depth_maps=None, timestamps=None, queue_size=8, color_conversion=None, rotation=None):
+        if queue_size < 1:
+            raise ValueError(f'queue_size must be a positive integer, got {queue_size}')
+        self.path = path
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise ValueError(f"Error reading video {path}")
+        self.nb_frames = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.depth_maps = depth_maps
+        self.timestamps = timestamps
+        self.color_conversion = color_conversion
+        self.rotation = rotation
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.running = True
+        self.finished = False
+        self.decode_time = 0.
+        self.wait_time = 0.
+        self.thread = threading.Thread(target=self.decode_task, daemon=True)
+        self.thread.start()
+
+    def decode_task(self):
+        index = 0
+        while self.running:
+            t = time.perf_counter()
+            success, frame = self.video.read()
+            if not success:
+                break
+            if self.color_conversion is not None:
+                frame = cv2.cvtColor(frame, self.color_conversion)
+            if self.rotation is not None:
+                frame = cv2.rotate(frame, self.rotation)
+            depth_map = self.depth_maps[index] if self.depth_maps is not None and index < len(self.depth_maps) else None
+            timestamp = self.timestamps[index] if self.timestamps is not None and index < len(self.timestamps) else None
+            self.decode_time += time.perf_counter() - t
+            if not self.put((frame, depth_map, timestamp)):
+                break
+            index += 1
+        self.video.release()
+        self.put(self._END)
+
+    def put(self, item):
+        # the decoder gives up when the reader is closed while the queue is full
+        while self.running:
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self, timeout=None):
+        """
+        Returns the next frame, waiting for the decoder if needed.
+
+        Args:
+            timeout (float, optional): Maximum waiting time in seconds, None to wait indefinitely. Defaults to None.
+        Returns:
+            Tuple[bool, Optional[np.ndarray], Optional[np.ndarray], Optional[float]]: The success status, the frame, its depth map
+                and its timestamp. The success status is False at the end of the video or if the timeout expired.
+        """
+        if self.finished:
+            return False, None, None, None
+        t = time.perf_counter()
+        try:
+            item = self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return False, None, None, None
+        finally:
+            self.wait_time += time.perf_counter() - t
+        if item is self._END:
+            self.finished = True
+            return False, None, None, None
+        frame, depth_map, timestamp = item
+        return True, frame, depth_map, timestamp
+
+    def __iter__(self):
+        while True:
+            success, frame, depth_map, timestamp = self.read()
+            if not success:
+                return
+            yield frame, depth_map, timestamp
+
+    def get_stats(self):
+        """
+        Returns:
+            Dict: Time spent decoding by the decoder and time spent waiting for frames by the consumer, in seconds, and number of frames decoded ahead.
+        """
+        return {'decode_time': self.decode_time, 'wait_time': self.wait_time, 'queued': self.frames.qsize()}
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class VideoSeekIndex:
+    """
+    Frame-accurate seek index of a recorded video: for each frame, the offset of its data in the file, whether it is a
+    keyframe and its timestamp in the video.
+
+    The index is read from the container (the chunks of an AVI file, the sync samples of an MP4 file), so that a frame can
+    be decoded from the keyframe preceding it instead of from an arbitrary position. It is built once, and cached next to
+    the video with the SUFFIX extension. When the keyframes cannot be found, every frame is considered a keyframe, and
+    seeking falls back on the seeking of cv2.
+
+    Args:
+        frame_offsets (np.ndarray): Offset of the data of each frame in the file, -1 if unknown.
+        keyframes (np.ndarray): Whether each frame is a keyframe.
+        fps (float): Frame rate of the video.
+    """
+    SUFFIX = '.seek.npz'
+    # fourcc of the MPEG-4 part 2 videos, whose keyframes are read from the VOP headers
+    MPEG4_FOURCCS = [b'XVID', b'xvid', b'DIVX', b'divx', b'DX50', b'FMP4', b'fmp4', b'MP4V', b'mp4v']
+    AVI_KEYFRAME_FLAG = 0x10
+
+    def __init__(self, frame_offsets, keyframes, fps):
+        self.frame_offsets = np.asarray(frame_offsets, dtype=np.int64)
+        self.keyframes = np.asarray(keyframes, dtype=bool)
+        if len(self.keyframes) > 0:
+            self.keyframes[0] = True
+        self.fps = float(fps)
+        self.keyframe_indices = np.flatnonzero(self.keyframes)
+        self.timestamps = np.arange(len(self.keyframes)) / self.fps if self.fps > 0 else np.zeros(len(self.keyframes))
+
+    def __len__(self):
+        return len(self.keyframes)
+
+    def keyframe_before(self, frame_index):
+        """
+        Returns:
+            int: The index of the last keyframe at or before the given frame.
+        """
+        return int(self.keyframe_indices[np.searchsorted(self.keyframe_indices, frame_index, side='right') - 1])
+
+    def keyframe_offset(self, frame_index):
+        """
+        Returns:
+            int: The offset in the file of the last keyframe at or before the given frame, -1 if unknown.
+        """
+        return int(self.frame_offsets[self.keyframe_before(frame_index)])
+
+    @staticmethod
+    def index_path(path):
+        return path + VideoSeekIndex.SUFFIX
+
+    @classmethod
+    def load(cls, path, fps=None):
+        """
+        Reads the cached index of a video, or builds and caches it if it is missing or older than the video.
+
+        Args:
+            path (str): Path of the video.
+            fps (float, optional): Frame rate of the video. Defaults to None (read from the video).
+        Returns:
+            VideoSeekIndex: The index.
+        """
+        index_path = cls.index_path(path)
+        stat = os.stat(path)
+        if os.path.exists(index_path):
+            try:
+                with np.load(index_path) as cached:
+                    if int(cached['video_size']) == stat.st_size and float(cached['video_mtime']) == stat.st_mtime:
+                        return cls(cached['frame_offsets'], cached['keyframes'], float(cached['fps']) if fps is None else fps)
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Seek index {index_path} could not be read ({e}), it is rebuilt")
+        index = cls.build(path, fps)
+        try:
+            with open(index_path, 'wb') as f:
+                np.savez(f, frame_offsets=index.frame_offsets, keyframes=index.keyframes, fps=index.fps,
+                         video_size=stat.st_size, video_mtime=stat.st_mtime)
+        except OSError as e:
+            print(f"Seek index of {path} could not be cached : {e}")
+        return index
+
+    @classmethod
+    def build(cls, path, fps=None):
+        """
+        Builds the index of a video from its container.
+
+        Args:
+            path (str): Path of the video.
+            fps (float, optional): Frame rate of the video. Defaults to None (read from the video).
+        Returns:
+            VideoSeekIndex: The index.
+        """
+        video = cv2.VideoCapture(path)
+        nb_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        if fps is None:
+            fps = video.get(cv2.CAP_PROP_FPS)
+        video.release()
+        with open(path, 'rb') as f:
+            header = f.read(12)
+        frame_offsets, keyframes = None, None
+        try:
+            if is_bitstream(path) and os.path.exists(packets_path(path)):
+                # raw bitstream left without container, its packets are listed by the recorder
+                packets = pd.read_csv(packets_path(path))
+                frame_offsets, keyframes = np.array(packets['Offset'], dtype=np.int64), np.array(packets['Keyframe'], dtype=bool)
+            elif header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+                frame_offsets, keyframes = read_avi_frames(path, cls.MPEG4_FOURCCS, cls.AVI_KEYFRAME_FLAG)
+            elif header[4:8] == b'ftyp':
+                keyframes = read_mp4_sync_samples(path)
+                frame_offsets = np.full(len(keyframes), -1, dtype=np.int64) if keyframes is not None else None
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Keyframes of {path} could not be read : {e}")
+            frame_offsets, keyframes = None, None
+        if keyframes is None:
+            frame_offsets, keyframes = np.full(nb_frames, -1, dtype=np.int64), np.ones(nb_frames, dtype=bool)
+        print(f"Seek index of {path} built : {len(keyframes)} frames, {int(np.sum(keyframes))} keyframes")
+        return cls(frame_offsets, keyframes, fps)
+
+
+def read_avi_frames(path, mpeg4_fourccs, keyframe_flag):
+    """
+    Lists the video frames of an AVI file by walking its chunks, including the extensions of OpenDML files.
+    The keyframes of MPEG-4 part 2 videos are read from the VOP headers, those of other videos from the idx1 index.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The offset of each frame and whether it is a keyframe.
+    """
+    offsets, vop_keyframes, fourcc = [], [], None
+    idx1_flags = []
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        position = 0
+        while position + 12 <= file_size:
+            f.seek(position)
+            riff, riff_size, riff_type = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF':
+                break
+            riff_end = min(position + 8 + riff_size, file_size)
+            chunk_position = position + 12
+            while chunk_position + 8 <= riff_end:
+                f.seek(chunk_position)
+                chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+                if chunk_id == b'LIST':
+                    list_type = f.read(4)
+                    if list_type == b'movi':
+                        read_movi(f, chunk_position + 12, min(chunk_position + 8 + chunk_size, riff_end), offsets, vop_keyframes)
+                    elif list_type == b'hdrl' and fourcc is None:
+                        header = f.read(min(chunk_size - 4, 4096))
+                        strh = header.find(b'strhvids')
+                        fourcc = header[strh + 8:strh + 12] if strh >= 0 else None
+                elif chunk_id == b'idx1':
+                    entries = np.frombuffer(f.read(chunk_size - chunk_size % 16), dtype=np.dtype([('id', 'S4'), ('flags', '<u4'), ('offset', '<u4'), ('size', '<u4')]))
+                    idx1_flags = [entry['flags'] for entry in entries if entry['id'][2:] in (b'dc', b'db')]
+                chunk_position += 8 + chunk_size + chunk_size % 2
+            position = riff_end + (riff_end - position) % 2
+    if fourcc in mpeg4_fourccs:
+        keyframes = vop_keyframes
+    elif fourcc == b'MJPG':
+        keyframes = [True] * len(offsets)
+    elif len(idx1_flags) == len(offsets):
+        keyframes = [bool(flags & keyframe_flag) for flags in idx1_flags]
+    else:
+        return None, None
+    return np.array(offsets, dtype=np.int64), np.array(keyframes, dtype=bool)
+
+
+def read_movi(f, start, end, offsets, keyframes):
+    # video chunks are named '##dc' (compressed) or '##db' (uncompressed), other chunks hold audio or indexes
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        if chunk_id == b'LIST':
+            position += 12
+            continue
+        if chunk_id[2:] in (b'dc', b'db'):
+            offsets.append(position)
+            payload = f.read(min(chunk_size, 256))
+            vop = payload.find(b'\x00\x00\x01\xb6')
+            # the two first bits of a VOP header give its coding type, 0 for an intra-coded VOP
+            keyframes.append(vop >= 0 and vop + 4 < len(payload) and payload[vop + 4] >> 6 == 0)
+        position += 8 + chunk_size + chunk_size % 2
+
+
+def read_mp4_sync_samples(path):
+    """
+    Reads the sync samples (keyframes) of the video track of an MP4 file.
+
+    Returns:
+        Optional[np.ndarray]: Whether each frame is a keyframe, None if the file has no video track.
+    """
+    with open(path, 'rb') as f:
+        data = None
+        # the moov box is read alone, the media data can be much larger
+        file_size = os.fstat(f.fileno()).st_size
+        position = 0
+        while position + 8 <= file_size:
+            f.seek(position)
+            size, box_type = struct.unpack('>I4s', f.read(8))
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+            elif size == 0:
+                size = file_size - position
+            if box_type == b'moov':
+                f.seek(position)
+                data = f.read(size)
+                break
+            position += size
+    if data is None:
+        return None
+
+    def boxes(start, end):
+        while start + 8 <= end:
+            size, box_type = struct.unpack('>I4s', data[start:start + 8])
+            header = 8
+            if size == 1:
+                size = struct.unpack('>Q', data[start + 8:start + 16])[0]
+                header = 16
+            elif size == 0:
+                size = end - start
+            yield box_type, start + header, start + size
+            start += size
+
+    def find(start, end, path_types):
+        for box_type, body, box_end in boxes(start, end):
+            if box_type == path_types[0]:
+                if len(path_types) == 1:
+                    return body, box_end
+                found = find(body, box_end, path_types[1:])
+                if found is not None:
+                    return found
+        return None
+
+    for box_type, body, box_end in boxes(8, len(data)):
+        if box_type != b'trak':
+            continue
+        hdlr = find(body, box_end, [b'mdia', b'hdlr'])
+        if hdlr is None or data[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+        stsz = find(body, box_end, [b'mdia', b'minf', b'stbl', b'stsz'])
+        if stsz is None:
+            return None
+        nb_samples = struct.unpack('>I', data[stsz[0] + 8:stsz[0] + 12])[0]
+        stss = find(body, box_end, [b'mdia', b'minf', b'stbl', b'stss'])
+        if stss is None:
+            # without sync sample table, every sample is a sync sample
+            return np.ones(nb_samples, dtype=bool)
+        nb_sync = struct.unpack('>I', data[stss[0] + 4:stss[0] + 8])[0]
+        sync_samples = np.frombuffer(data[stss[0] + 8:stss[0] + 8 + 4 * nb_sync], dtype='>u4').astype(np.int64) - 1
+        keyframes = np.zeros(nb_samples, dtype=bool)
+        keyframes[sync_samples[sync_samples < nb_samples]] = True
+        return keyframes
+    return None
+
+
+class IndexedVideoReader:
+    """
+    Random access reader of a recorded video, using its seek index.
+
+    Frames are decoded forward from the current position as long as no keyframe separates it from the requested frame, so
+    that playing frames in order never seeks. Otherwise, the reader seeks to the keyframe preceding the requested frame:
+    a random access costs at most the decoding of one GOP (group of pictures). The decoded frames of the last GOPs are kept,
+    so that going back and forth around a frame, as with the trackbars of the pre-processor, does not decode them again.
+
+    Raw bitstreams (.h264/.h265) cannot be seeked reliably by cv2: they are decoded again from their start to go back.
+
+    Args:
+        path (str): Path of the video.
+        cache_gops (int, optional): Number of decoded GOPs kept. Defaults to 2.
+        max_cached_frames (int, optional): Maximum number of frames kept per GOP, for videos with long GOPs. Defaults to 120.
+    Raises:
+        ValueError: If the video cannot be read.
+    """
+    def __init__(self, path, cache_gops=2, max_cached_frames=120):
+        self.path = path
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise ValueError(f"Error reading video {path}")
+        self.resolution = (int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.index = VideoSeekIndex.load(path, self.video.get(cv2.CAP_PROP_FPS))
+        self.nb_frames = len(self.index)
+        self.cache_gops = cache_gops
+        self.max_cached_frames = max_cached_frames
+        self.cache = OrderedDict()
+        self.position = 0
+        self.seeks = 0
+        self.bitstream = is_bitstream(path)
+
+    def __len__(self):
+        return self.nb_frames
+
+    def isOpened(self):
+        return self.video.isOpened()
+
+    def get(self, frame_index):
+        """
+        Returns:
+            Optional[np.ndarray]: The frame at the given index, None if it cannot be decoded. The frame may be shared with the cache and must not be modified.
+        """
+        if frame_index < 0 or frame_index >= self.nb_frames:
+            return None
+        gop = self.index.keyframe_before(frame_index)
+        cached = self.cache.get(gop)
+        if cached is not None and frame_index in cached:
+            self.cache.move_to_end(gop)
+            return cached[frame_index]
+        # decoding forward is cheaper than seeking as long as the current position is in the same GOP
+        if self.bitstream:
+            if self.position > frame_index:
+                self.video.release()
+                self.video = cv2.VideoCapture(self.path)
+                self.position = 0
+                self.seeks += 1
+        elif not (self.position <= frame_index and self.index.keyframe_before(self.position) == gop):
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, float(gop))
+            self.position = gop
+            self.seeks += 1
+        frame = None
+        while self.position <= frame_index:
+            success, frame = self.video.read()
+            if not success:
+                return None
+            self.store(self.position, frame)
+            self.position += 1
+        return frame
+
+    def store(self, frame_index, frame):
+        gop = self.index.keyframe_before(frame_index)
+        if gop not in self.cache:
+            self.cache[gop] = {}
+            while len(self.cache) > self.cache_gops:
+                self.cache.popitem(last=False)
+        self.cache.move_to_end(gop)
+        if frame_index - gop < self.max_cached_frames:
+            self.cache[gop][frame_index] = frame
+
+    def iter_range(self, start, end):
+        """
+        Yields the frames from start (included) to end (excluded), decoded sequentially.
+
+        Yields:
+            Tuple[int, np.ndarray]: The index of a frame and the frame.
+        """
+        for frame_index in range(max(start, 0), min(end, self.nb_frames)):
+            frame = self.get(frame_index)
+            if frame is None:
+                return
+            yield frame_index, frame
+
+    def release(self):
+        self.video.release()
+        self.cache.clear()
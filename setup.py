@@ -8,5 +8,7 @@ setup(
     author='Etienne Moullet',
     author_email='etienne.moullet@inria.fr',
     license='MIT',
-    packages=['rgbd']
+    packages=['rgbd'],
+    # codecs of the depth files (rgbd.DepthStorage), files written with one of them can only be read where it is installed
+    extras_require={'depth': ['lz4>=4.3', 'zstandard>=0.22']}
 )